@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# encoding: utf8
+
+"""Compares page load request fan-out over HTTP/1.1 and HTTP/2.
+
+Usage::
+
+    python benchmarks/http2_fanout.py [-n RUNS] [--assets N] [--size BYTES]
+                                      [--latency MS] [--connections N]
+
+Starts a TLS listener configured by an ``SslServer`` with ``http2: true``
+that serves a page and ``--assets`` small files, each answered after
+``--latency`` milliseconds. It then loads the page and all assets:
+
+* over HTTP/1.1 using ``--connections`` parallel keep-alive connections,
+  which is what browsers do (6 per host), and
+* over HTTP/2 using a single multiplexed connection.
+
+Prints min and median wall clock time per protocol. Needs the h2 and
+priority packages.
+"""
+
+from __future__ import print_function
+
+import ssl
+import sys
+import socket
+import argparse
+import datetime
+import tempfile
+import threading
+
+from time import time
+from os.path import abspath, dirname, join
+
+try:
+    from http.client import HTTPSConnection
+    from queue import Queue, Empty
+except ImportError:  # Python 2
+    from httplib import HTTPSConnection
+    from Queue import Queue, Empty
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+
+def gen_cert(path):
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, u'localhost')])
+    now = datetime.datetime.utcnow()
+
+    cert = x509.CertificateBuilder() \
+        .subject_name(name).issuer_name(name) \
+        .public_key(key.public_key()) \
+        .serial_number(x509.random_serial_number()) \
+        .not_valid_before(now - datetime.timedelta(days=1)) \
+        .not_valid_after(now + datetime.timedelta(days=1)) \
+        .sign(key, hashes.SHA256())
+
+    cert_path = join(path, 'cert.pem')
+    with open(cert_path, 'wb') as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+
+    key_path = join(path, 'key.pem')
+    with open(key_path, 'wb') as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM,
+                                  serialization.PrivateFormat.TraditionalOpenSSL,
+                                  serialization.NoEncryption()))
+
+    return cert_path, key_path
+
+
+def start_server(num_assets, size, latency):
+    """Starts the reactor in a thread and returns the port number."""
+
+    from twisted.internet import reactor
+    from twisted.web.server import Site, NOT_DONE_YET
+    from twisted.web.resource import Resource
+
+    from neurons.daemon.config import SslServer
+
+    class Asset(Resource):
+        isLeaf = True
+
+        def render_GET(self, request):
+            request.setHeader(b'content-type', b'text/css')
+            reactor.callLater(latency, self._finish, request)
+            return NOT_DONE_YET
+
+        def _finish(self, request):
+            request.write(b'x' * size)
+            request.finish()
+
+    class Page(Resource):
+        isLeaf = True
+
+        def render_GET(self, request):
+            request.setHeader(b'content-type', b'text/html')
+            return b''.join(b'<link rel="import" href="/asset/%d">' % i
+                                                     for i in range(num_assets))
+
+    root = Resource()
+    root.putChild(b'page', Page())
+    root.putChild(b'asset', Asset())
+
+    cert, key = gen_cert(tempfile.mkdtemp())
+    config = SslServer(name='http2_fanout', cert=cert, key=key, http2=True)
+    options = config.gen_ssl_options()
+    assert config.get_alpn_protocols() is not None, \
+                                   "HTTP/2 is not available, see the log above."
+
+    port = reactor.listenSSL(0, Site(root), options, interface='127.0.0.1')
+
+    thread = threading.Thread(target=reactor.run,
+                                        kwargs={'installSignalHandlers': False})
+    thread.daemon = True
+    thread.start()
+
+    return port.getHost().port
+
+
+def _gen_ssl_context(alpn):
+    retval = ssl.create_default_context()
+    retval.check_hostname = False
+    retval.verify_mode = ssl.CERT_NONE
+    retval.set_alpn_protocols(alpn)
+    return retval
+
+
+def load_http11(port, num_assets, num_connections):
+    ctx = _gen_ssl_context(['http/1.1'])
+    queue = Queue()
+
+    conn = HTTPSConnection('127.0.0.1', port, context=ctx)
+    conn.request('GET', '/page')
+    conn.getresponse().read()
+    conn.close()
+
+    for i in range(num_assets):
+        queue.put('/asset/%d' % i)
+
+    def worker():
+        conn = HTTPSConnection('127.0.0.1', port, context=ctx)
+        while True:
+            try:
+                path = queue.get_nowait()
+            except Empty:
+                break
+
+            conn.request('GET', path)
+            conn.getresponse().read()
+
+        conn.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(num_connections)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def load_http2(port, num_assets):
+    import h2.config
+    import h2.events
+    import h2.connection
+
+    ctx = _gen_ssl_context(['h2'])
+    skt = ctx.wrap_socket(socket.create_connection(('127.0.0.1', port)))
+    assert skt.selected_alpn_protocol() == 'h2', skt.selected_alpn_protocol()
+
+    conn = h2.connection.H2Connection(
+                      config=h2.config.H2Configuration(client_side=True))
+    conn.initiate_connection()
+
+    def request(path):
+        stream_id = conn.get_next_available_stream_id()
+        conn.send_headers(stream_id, [
+            (':method', 'GET'), (':path', path),
+            (':scheme', 'https'), (':authority', 'localhost'),
+        ], end_stream=True)
+        return stream_id
+
+    def wait(pending):
+        skt.sendall(conn.data_to_send())
+
+        while pending:
+            data = skt.recv(65536)
+            assert data, "Connection closed"
+
+            for event in conn.receive_data(data):
+                if isinstance(event, h2.events.DataReceived):
+                    conn.acknowledge_received_data(
+                              event.flow_controlled_length, event.stream_id)
+                elif isinstance(event, h2.events.StreamEnded):
+                    pending.discard(event.stream_id)
+
+            skt.sendall(conn.data_to_send())
+
+    wait({request('/page')})
+    wait(set(request('/asset/%d' % i) for i in range(num_assets)))
+
+    conn.close_connection()
+    skt.sendall(conn.data_to_send())
+    skt.close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', '--runs', type=int, default=5)
+    parser.add_argument('--assets', type=int, default=60,
+                                 help="Number of assets the page refers to.")
+    parser.add_argument('--size', type=int, default=4096,
+                                 help="Size of each asset in bytes.")
+    parser.add_argument('--latency', type=float, default=20,
+                help="Time the server takes to answer each asset request, in "
+                     "milliseconds.")
+    parser.add_argument('--connections', type=int, default=6,
+                 help="Number of parallel HTTP/1.1 connections.")
+    args = parser.parse_args(argv[1:])
+
+    port = start_server(args.assets, args.size, args.latency / 1e3)
+
+    loaders = (
+        ('HTTP/1.1 x%d' % args.connections,
+             lambda: load_http11(port, args.assets, args.connections)),
+        ('HTTP/2', lambda: load_http2(port, args.assets)),
+    )
+
+    print("%d assets of %d bytes, %.1fms latency each" % (args.assets,
+                                                   args.size, args.latency))
+    print("%-16s %10s %10s" % ("protocol", "min (ms)", "median (ms)"))
+
+    for name, loader in loaders:
+        times = []
+        for _ in range(args.runs):
+            start_t = time()
+            loader()
+            times.append(time() - start_t)
+
+        times.sort()
+        print("%-16s %10.1f %10.1f" % (name, times[0] * 1e3,
+                                                times[len(times) // 2] * 1e3))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# encoding: utf8
+
+"""Measures the import time of neurons modules, each in a fresh interpreter.
+
+Usage::
+
+    python benchmarks/import_time.py [-n RUNS] [--top N] [module ...]
+
+Prints min and median wall clock time of ``python -c "import <module>"``
+per module. With ``--top``, also prints the most expensive imports as
+reported by ``python -X importtime`` (Python 3.7+ only).
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import argparse
+import subprocess
+
+from time import time
+from os.path import abspath, dirname
+
+
+DEFAULT_MODULES = (
+    'neurons',
+    'neurons.daemon',
+    'neurons.daemon.config',
+    'neurons.model',
+)
+
+ROOT = dirname(dirname(abspath(__file__)))
+
+
+def _env():
+    retval = dict(os.environ)
+    pp = retval.get('PYTHONPATH')
+    retval['PYTHONPATH'] = ROOT if not pp else os.pathsep.join((ROOT, pp))
+    return retval
+
+
+def time_import(module, runs):
+    retval = []
+    env = _env()
+
+    for _ in range(runs):
+        start_t = time()
+        subprocess.check_call([sys.executable, '-c', 'import %s' % module],
+                                                                        env=env)
+        retval.append(time() - start_t)
+
+    # the bare interpreter startup time is not what we are after
+    base_t = min(time_bare(env) for _ in range(runs))
+
+    return [t - base_t for t in retval]
+
+
+def time_bare(env):
+    start_t = time()
+    subprocess.check_call([sys.executable, '-c', 'pass'], env=env)
+    return time() - start_t
+
+
+def top_imports(module, num):
+    cmd = [sys.executable, '-X', 'importtime', '-c', 'import %s' % module]
+    out = subprocess.Popen(cmd, stderr=subprocess.PIPE, env=_env()) \
+                                                              .communicate()[1]
+
+    retval = []
+    for line in out.decode('utf8').splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+
+        # import time:  self [us] | cumulative | imported package
+        self_us, cum_us, name = line.split(':', 1)[1].split('|')
+        retval.append((int(cum_us), int(self_us), name.strip()))
+
+    retval.sort(reverse=True)
+    return retval[:num]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', '--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=0,
+                                 help="Show the N most expensive imports.")
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES)
+    args = parser.parse_args(argv[1:])
+
+    print("%-28s %10s %10s" % ("module", "min (ms)", "median (ms)"))
+    for module in args.modules:
+        times = sorted(time_import(module, args.runs))
+        print("%-28s %10.1f %10.1f" % (module, times[0] * 1e3,
+                                                times[len(times) // 2] * 1e3))
+
+    if args.top > 0 and sys.version_info >= (3, 7):
+        for module in args.modules:
+            print()
+            print("Top %d imports for %s (cumulative / self, ms):" %
+                                                           (args.top, module))
+            for cum_us, self_us, name in top_imports(module, args.top):
+                print("%10.1f %10.1f  %s" % (cum_us / 1e3, self_us / 1e3, name))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
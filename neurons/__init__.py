@@ -38,9 +38,24 @@ CONFIG_FILE_VERSION = 2
 REACTOR_THREAD = None
 REACTOR_THREAD_ID = None
 
+import sys
+
 from neurons._base import _is_reactor_thread_none as is_reactor_thread
 from neurons._base import py_start_t
+from neurons._base import gen_lazy_getattr
+
+# These pull in spyne and sqlalchemy, so they are imported on first access.
+_LAZY_ATTRS = {
+    'Application': 'neurons.application',
+    'TableModel': 'neurons.model',
+    'ReadContext': 'neurons.context',
+    'WriteContext': 'neurons.context',
+}
+
+if sys.version_info >= (3, 7):
+    __getattr__ = gen_lazy_getattr(__name__, _LAZY_ATTRS)
 
-from neurons.application import Application
-from neurons.model import TableModel
-from neurons.context import ReadContext, WriteContext
+else:
+    from neurons.application import Application
+    from neurons.model import TableModel
+    from neurons.context import ReadContext, WriteContext
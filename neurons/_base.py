@@ -37,9 +37,12 @@ py_start_t = time()
 """Approximate start time of the python code"""
 
 
+import sys
 import neurons
 import threading
 
+from importlib import import_module
+
 # don't import these directly, import the correct one directly from root
 # neurons package.
 
@@ -49,3 +52,28 @@ def _is_reactor_thread():
 
 def _is_reactor_thread_none():
     return None
+
+
+def gen_lazy_getattr(module_name, lazy_attrs):
+    """Returns a PEP 562 module-level ``__getattr__`` that imports the
+    attributes in ``lazy_attrs`` on first access.
+
+    :param module_name: ``__name__`` of the module the function is for.
+    :param lazy_attrs: A dict that maps attribute names to names of the
+        modules they are to be imported from.
+    """
+
+    def __getattr__(name):
+        src = lazy_attrs.get(name, None)
+        if src is None:
+            raise AttributeError("module %r has no attribute %r" %
+                                                           (module_name, name))
+
+        retval = getattr(import_module(src), name)
+
+        # so that __getattr__ is not called again for this name
+        setattr(sys.modules[module_name], name, retval)
+
+        return retval
+
+    return __getattr__
@@ -0,0 +1,199 @@
+# encoding: utf8
+#
+# This file is part of the Neurons project.
+# Copyright (c), Arskom Ltd. (arskom.com.tr),
+#                Burak Arslan <burak.arslan@arskom.com.tr>.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of the Arskom Ltd., the neurons project nor the names of
+#   its its contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""Content-hashed asset urls.
+
+Files under a ``StaticFileServer`` with ``fingerprint`` set are also served
+under names that contain a hash of their contents, e.g. ``X.css`` is also
+served as ``X.0123456789ab.css``. As the contents of such a url never change,
+they are served with an ``immutable`` Cache-Control header and browsers don't
+need to revalidate them.
+
+Code that emits asset urls passes them through :func:`get_asset_url` to get
+the fingerprinted url when there is one.
+
+Hashing happens when the daemon starts. For big asset directories, the
+manifest can be generated at build time instead::
+
+    python -m neurons.base.assets /path/to/assets > manifest.json
+
+and passed to the ``StaticFileServer`` via its ``manifest`` option.
+"""
+
+from __future__ import absolute_import, print_function
+
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import sys
+import json
+import hashlib
+
+
+FINGERPRINT_LENGTH = 12
+"""Number of hex digits of the content hash to put in file names."""
+
+IMMUTABLE_CACHE_CONTROL = b'public, max-age=31536000, immutable'
+"""Cache-Control header value for fingerprinted urls."""
+
+PRECOMPRESSED_EXTS = ('.br', '.gz')
+"""Extensions of precompressed siblings of files. ``foo.css.gz`` is not
+fingerprinted when there is ``foo.css`` next to it, as it's served in place of
+``foo.css`` anyway."""
+
+HASH_BLOCK_SIZE = 64 * 1024
+
+
+_urls = {}
+"""Maps asset urls to fingerprinted asset urls."""
+
+
+def get_fingerprinted_name(name, digest):
+    """Returns the given file name with the given digest inserted before its
+    extension. ``X.css`` becomes ``X.<digest>.css``."""
+
+    base, ext = os.path.splitext(name)
+    if base == '':
+        return '%s.%s' % (name, digest)
+
+    return '%s.%s%s' % (base, digest, ext)
+
+
+def get_file_digest(path):
+    hasher = hashlib.sha256()
+
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(HASH_BLOCK_SIZE)
+            if not data:
+                break
+            hasher.update(data)
+
+    return hasher.hexdigest()[:FINGERPRINT_LENGTH]
+
+
+def gen_manifest(path, disallowed_exts=()):
+    """Hashes all files under the given directory.
+
+    :param path: The directory to scan.
+    :param disallowed_exts: Files with these extensions are skipped.
+    :return: A dict that maps file paths to fingerprinted file paths, both
+        relative to ``path`` and with forward slashes as separators.
+    """
+
+    disallowed_exts = set(disallowed_exts)
+    retval = {}
+
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+
+        for fn in sorted(filenames):
+            base, ext = os.path.splitext(fn)
+            if ext.lstrip('.') in disallowed_exts:
+                continue
+
+            if ext in PRECOMPRESSED_EXTS and base in filenames:
+                continue
+
+            full_path = os.path.join(dirpath, fn)
+            if not os.path.isfile(full_path):
+                continue
+
+            rel_dir = os.path.relpath(dirpath, path)
+            if rel_dir == os.curdir:
+                rel_dir = ''
+
+            digest = get_file_digest(full_path)
+            key = '/'.join(rel_dir.split(os.sep) + [fn]).lstrip('/')
+            retval[key] = '/'.join(rel_dir.split(os.sep) +
+                                [get_fingerprinted_name(fn, digest)]).lstrip('/')
+
+    return retval
+
+
+def load_manifest(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def register_assets(url, manifest):
+    """Makes :func:`get_asset_url` return fingerprinted urls for the files in
+    the given manifest.
+
+    :param url: The url prefix the files are served under.
+    :param manifest: A dict as returned by :func:`gen_manifest`.
+    """
+
+    prefix = '/%s/' % url.strip('/')
+    if prefix == '//':
+        prefix = '/'
+
+    for k, v in manifest.items():
+        key = prefix + k
+        value = prefix + v
+
+        old = _urls.get(key, None)
+        if old is not None and old != value:
+            logger.warning("Asset url %s is fingerprinted as %s, overriding "
+                                        "the existing %s", key, value, old)
+
+        _urls[key] = value
+
+    logger.debug("Registered %d fingerprinted assets under %s",
+                                                         len(manifest), prefix)
+
+
+def get_asset_url(url):
+    """Returns the fingerprinted version of the given asset url, or the url
+    itself if it's not fingerprinted."""
+
+    return _urls.get(url, url)
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if len(argv) != 1:
+        print("Usage: python -m neurons.base.assets <path>", file=sys.stderr)
+        return 1
+
+    json.dump(gen_manifest(argv[0]), sys.stdout, indent=2, sort_keys=True)
+    print()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -48,6 +48,8 @@ from spyne.store.relational import get_pk_columns
 from spyne.util.dictdoc import get_object_as_simple_dict
 from spyne.util.six.moves.urllib.parse import urlencode
 
+from neurons.base.assets import get_asset_url
+
 
 SETUP_DATATABLES = """
 neurons.setup_datatables = function(selector, data, hide) {
@@ -390,7 +392,7 @@ class ScreenBase(ComplexModel):
             self.links = []
 
         class_name = self.__class__.get_type_name()
-        href = "%s/%s.css" % (base, class_name)
+        href = get_asset_url("%s/%s.css" % (base, class_name))
 
         if not (href in self._link_hrefs):
             self._link_hrefs.add(href)
@@ -37,6 +37,15 @@ logger = logging.getLogger(__name__)
 from collections import defaultdict
 
 
+SQLA_SESSION_KEY = 'neurons.context'
+"""Key of the :class:`ReadContext` that created a SQLAlchemy session in the
+session's ``info`` dict."""
+
+SQLA_STORE_KEY = 'neurons.store'
+"""Key of the store a SQLAlchemy session was created for in the session's
+``info`` dict."""
+
+
 class ReadContext(object):
     def __init__(self, parent):
         self.trusted = False
@@ -57,6 +66,9 @@ class ReadContext(object):
 
         self.sqla_sessions = defaultdict(list)
 
+        self.sql_time = 0.0
+        self.sql_count = 0
+
         self._initialized = True
 
     def __repr__(self):
@@ -86,7 +98,14 @@ class ReadContext(object):
             sessions = self.sqla_sessions[id(store)]
 
             if len(sessions) == 0:
+                # read-only sessions go to a replica, if there is one
+                replicas = getattr(store, 'replicas', None)
+                if self.is_read_only and replicas and 'bind' not in kwargs:
+                    kwargs['bind'] = store.get_read_engine(self.get_du())
+
                 session = store.Session(**kwargs)
+                session.info[SQLA_SESSION_KEY] = self
+                session.info[SQLA_STORE_KEY] = store
                 self.sqla_sessions[id(store)].append(session)
 
             else:
@@ -106,6 +125,8 @@ class ReadContext(object):
                 if no_error:
                     self.sqla_finalize(session)
                 session.close()
+                session.info.pop(SQLA_SESSION_KEY, None)
+                session.info.pop(SQLA_STORE_KEY, None)
 
         # TODO: Close LDAP sessions?
 
@@ -126,3 +147,7 @@ class WriteContext(ReadContext):
     def sqla_finalize(self, session):
         logger.debug("Committing transaction for ctx 0x%012X", id(self.parent))
         session.commit()
+
+        store = session.info.get(SQLA_STORE_KEY, None)
+        if store is not None and hasattr(store, 'record_write'):
+            store.record_write(self.get_du())
@@ -40,36 +40,102 @@ EXIT_ERR_LISTEN_TCP = 100000
 EXIT_ERR_LISTEN_UDP = 200000
 
 
-def get_package_version(pkg_name):
+_package_versions = {}
+
+
+def _get_package_version_impl(pkg_name):
+    # pkg_resources takes a good fraction of a second to import, so it's only
+    # used when importlib.metadata is not available.
     try:
+        try:
+            from importlib.metadata import version
+        except ImportError:  # Python < 3.8
+            from importlib_metadata import version
+
+    except ImportError:
         import pkg_resources
         return pkg_resources.get_distribution(pkg_name).version
+
+    return version(pkg_name)
+
+
+def get_package_version(pkg_name):
+    retval = _package_versions.get(pkg_name, None)
+    if retval is not None:
+        return retval
+
+    try:
+        retval = _get_package_version_impl(pkg_name)
     except Exception:
-        return 'unknown'
+        retval = 'unknown'
+
+    _package_versions[pkg_name] = retval
+
+    return retval
+
+
+import sys
+
+from neurons._base import gen_lazy_getattr
+
+# These pull in spyne and twisted, so they are imported on first access.
+_LAZY_ATTRS = {'main': 'neurons.daemon.main'}
+_LAZY_ATTRS.update((k, 'neurons.daemon.config') for k in (
+    'Service', 'Client', 'Server', 'SslServer', 'UdpServer', 'HttpServer',
+    'RateLimit', 'WsgiServer', 'HttpApplication', 'Compression',
+    'StaticFileServer', 'MetricsExporter',
+
+    'FileStore', 'LdapStore', 'RelationalStore', 'Replica',
+
+    'Daemon', 'ServiceDaemon', 'EmailAlert', 'AlertDestination',
+
+    'ServiceDefinition',
+))
+
+if sys.version_info >= (3, 7):
+    from types import ModuleType
+
+    class _DaemonModule(ModuleType):
+        def __setattr__(self, name, value):
+            # The import system sets the main attribute to the
+            # neurons.daemon.main module once it's imported, which would
+            # shadow the main function that __getattr__ returns.
+            if name == 'main' and isinstance(value, ModuleType):
+                return
+
+            ModuleType.__setattr__(self, name, value)
+
+    sys.modules[__name__].__class__ = _DaemonModule
 
+    __getattr__ = gen_lazy_getattr(__name__, _LAZY_ATTRS)
 
-from neurons.daemon.main import main
+else:
+    from neurons.daemon.main import main
 
-from neurons.daemon.config import Service
-from neurons.daemon.config import Client
-from neurons.daemon.config import Server
-from neurons.daemon.config import SslServer
-from neurons.daemon.config import HttpServer
-from neurons.daemon.config import WsgiServer
-from neurons.daemon.config import ServiceDaemon
-from neurons.daemon.config import HttpApplication
-from neurons.daemon.config import StaticFileServer
+    from neurons.daemon.config import Service
+    from neurons.daemon.config import Client
+    from neurons.daemon.config import Server
+    from neurons.daemon.config import SslServer
+    from neurons.daemon.config import UdpServer
+    from neurons.daemon.config import HttpServer
+    from neurons.daemon.config import RateLimit
+    from neurons.daemon.config import WsgiServer
+    from neurons.daemon.config import HttpApplication
+    from neurons.daemon.config import Compression
+    from neurons.daemon.config import StaticFileServer
+    from neurons.daemon.config import MetricsExporter
 
-from neurons.daemon.config import FileStore
-from neurons.daemon.config import LdapStore
-from neurons.daemon.config import RelationalStore
+    from neurons.daemon.config import FileStore
+    from neurons.daemon.config import LdapStore
+    from neurons.daemon.config import RelationalStore
+    from neurons.daemon.config import Replica
 
-from neurons.daemon.config import Daemon
-from neurons.daemon.config import ServiceDaemon
-from neurons.daemon.config import EmailAlert
-from neurons.daemon.config import AlertDestination
+    from neurons.daemon.config import Daemon
+    from neurons.daemon.config import ServiceDaemon
+    from neurons.daemon.config import EmailAlert
+    from neurons.daemon.config import AlertDestination
 
-from neurons.daemon.config import ServiceDefinition
+    from neurons.daemon.config import ServiceDefinition
 
 
 config_data = None
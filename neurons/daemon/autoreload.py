@@ -0,0 +1,279 @@
+# encoding: utf8
+#
+# This file is part of the Neurons project.
+# Copyright (c), Arskom Ltd. (arskom.com.tr),
+#                Burak Arslan <burak.arslan@arskom.com.tr>.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of the Arskom Ltd., the neurons project nor the names of
+#   its its contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""Restarts the daemon process when one of its source files changes.
+
+On Linux, the directories that contain the imported modules are watched with
+inotify, so an idle daemon doesn't do any work at all. Elsewhere, the module
+files are polled for modification times, like spyne's AutoReloader does.
+
+Changes are debounced: the process is re-executed only after no watched file
+has changed for :data:`AUTORELOAD_DEBOUNCE` seconds, so that a ``git checkout``
+or an editor that writes files in several steps triggers a single restart.
+
+The time of the first change is passed to the new process in the environment
+so that it can report the end-to-end reload latency once it's ready.
+"""
+
+from __future__ import absolute_import
+
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+
+from time import time
+from os.path import dirname
+
+from spyne.util.autorel import AutoReloader
+
+
+AUTORELOAD_DEBOUNCE = 0.2
+"""Seconds to wait for further changes before restarting."""
+
+AUTORELOAD_POLL_INTERVAL = 0.5
+"""Seconds between two runs of the polling reloader."""
+
+AUTORELOAD_RESCAN_INTERVAL = 5.0
+"""Seconds between two scans of ``sys.modules`` for modules imported after
+the reloader was started. This doesn't touch the file system."""
+
+ENV_CHANGE_TIME = 'NEURONS_AUTORELOAD_T'
+"""Environment variable that holds the time of the first change that caused
+the restart."""
+
+
+class DebouncedReloader(AutoReloader):
+    """Base class for reloaders that collect changed files for a while before
+    re-executing the process."""
+
+    def __init__(self, debounce=AUTORELOAD_DEBOUNCE):
+        super(DebouncedReloader, self).__init__()
+
+        self.debounce = debounce
+        self.changed = set()
+        self.first_change_t = None
+        self.delayed_call = None
+
+    def get_files(self):
+        retval = set()
+
+        for f in self.sysfiles() | self.files:
+            if not f:
+                continue
+
+            if f.endswith('.pyc'):
+                f = f[:-1]
+
+            retval.add(f)
+
+        return retval
+
+    def file_changed(self, file_name):
+        from twisted.internet import reactor
+
+        if self.first_change_t is None:
+            self.first_change_t = time()
+
+        self.changed.add(file_name)
+
+        if self.delayed_call is not None and self.delayed_call.active():
+            self.delayed_call.reset(self.debounce)
+        else:
+            self.delayed_call = reactor.callLater(self.debounce, self.restart)
+
+    def restart(self):
+        from twisted.internet import reactor
+
+        logger.info("Restarting because %d file(s) changed %.3fs ago: %s",
+                        len(self.changed), time() - self.first_change_t,
+                                              ', '.join(sorted(self.changed)))
+
+        os.environ[ENV_CHANGE_TIME] = repr(self.first_change_t)
+
+        reactor.stop()
+        self._do_execv()
+
+
+class PollingReloader(DebouncedReloader):
+    """Stats every watched file every :data:`AUTORELOAD_POLL_INTERVAL`
+    seconds."""
+
+    def start(self):
+        from twisted.internet.task import LoopingCall
+
+        for f in self.get_files():
+            self.mtimes[f] = self._get_mtime(f)
+
+        retval = LoopingCall(self.run)
+        retval.start(AUTORELOAD_POLL_INTERVAL, now=False)
+        return retval
+
+    @staticmethod
+    def _get_mtime(file_name):
+        try:
+            return os.stat(file_name).st_mtime
+        except OSError:
+            # Either a module with no .py file, or it's been deleted.
+            return None
+
+    def run(self):
+        for f in self.get_files():
+            if f in self.changed:
+                continue
+
+            if not (f in self.mtimes):
+                self.mtimes[f] = self._get_mtime(f)
+                continue
+
+            oldtime = self.mtimes[f]
+            if oldtime is None:
+                # Module with no .py file. Skip it.
+                continue
+
+            mtime = self._get_mtime(f)
+            if mtime is None or mtime > oldtime:
+                self.file_changed(f)
+
+    def get_num_watches(self):
+        return len(self.mtimes)
+
+
+class InotifyReloader(DebouncedReloader):
+    """Watches the directories of the imported modules with inotify. Linux
+    only."""
+
+    def __init__(self, *args, **kwargs):
+        super(InotifyReloader, self).__init__(*args, **kwargs)
+
+        from twisted.internet import inotify
+
+        self.notifier = inotify.INotify()
+        self.watched_files = set()
+        self.watched_dirs = set()
+
+        self.MASK = inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO \
+                       | inotify.IN_MOVED_FROM | inotify.IN_CREATE \
+                       | inotify.IN_DELETE | inotify.IN_MODIFY
+
+    def start(self):
+        from twisted.internet.task import LoopingCall
+
+        self.notifier.startReading()
+
+        retval = LoopingCall(self.run)
+        retval.start(AUTORELOAD_RESCAN_INTERVAL)
+        return retval
+
+    def run(self):
+        """Adds watches for the directories of modules that were imported
+        since the last run."""
+
+        from twisted.python.filepath import FilePath
+
+        new_files = self.get_files() - self.watched_files
+        if len(new_files) == 0:
+            return
+
+        self.watched_files.update(new_files)
+
+        for d in set(dirname(f) for f in new_files) - self.watched_dirs:
+            if not os.path.isdir(d):
+                # modules inside zip files etc.
+                continue
+
+            self.notifier.watch(FilePath(d), mask=self.MASK,
+                                                  callbacks=[self._on_event])
+            self.watched_dirs.add(d)
+
+        logger.debug("Watching %d files in %d directories",
+                                 len(self.watched_files), len(self.watched_dirs))
+
+    def _on_event(self, ignored, path, mask):
+        file_name = path.path
+        if not isinstance(file_name, str):
+            file_name = file_name.decode('utf8')
+
+        if file_name in self.watched_files:
+            self.file_changed(file_name)
+
+    def get_num_watches(self):
+        return len(self.watched_dirs)
+
+
+def _gen_reloader():
+    try:
+        from twisted.internet.inotify import INotifyError
+
+    except ImportError as e:
+        logger.info("inotify not available (%r), falling back to polling", e)
+        return PollingReloader()
+
+    try:
+        return InotifyReloader()
+
+    except INotifyError as e:
+        logger.info("inotify not available (%r), falling back to polling", e)
+        return PollingReloader()
+
+
+def start_autoreloader():
+    """Starts the inotify reloader when possible, and the polling reloader
+    otherwise. Returns the reloader instance."""
+
+    retval = _gen_reloader()
+    assert retval.start() is not None
+
+    logger.info("Auto reloader init success: %s watching %d files with %d "
+                     "watch(es).", retval.__class__.__name__,
+                     len(retval.get_files()), retval.get_num_watches())
+
+    return retval
+
+
+def log_reload_latency():
+    """Logs the time it took for the process to come back up after a source
+    file change. Does nothing if this process was not started by the
+    autoreloader."""
+
+    change_t = os.environ.pop(ENV_CHANGE_TIME, None)
+    if change_t is None:
+        return
+
+    try:
+        change_t = float(change_t)
+    except ValueError:
+        return
+
+    logger.info("Autoreload took %.2fs from the first change to ready.",
+                                                           time() - change_t)
@@ -0,0 +1,171 @@
+# encoding: utf8
+#
+# This file is part of the Neurons project.
+# Copyright (c), Arskom Ltd. (arskom.com.tr),
+#                Burak Arslan <burak.arslan@arskom.com.tr>.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of the Arskom Ltd., the neurons project nor the names of
+#   its its contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""Boot phase profiler.
+
+Every phase of the daemon boot sequence is wrapped in a
+:meth:`BootReport.phase` block, which records its wall clock duration and the
+change in resident set size. The report is logged once the daemon is ready
+and can optionally be written as a json document using the ``boot_report``
+daemon option.
+"""
+
+from __future__ import print_function, absolute_import
+
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import json
+import resource
+
+from time import time
+from contextlib import contextmanager
+
+from neurons import py_start_t
+
+
+def get_rss():
+    """Returns the current resident set size in bytes. Falls back to the
+    maximum resident set size when psutil is not available."""
+
+    from neurons.daemon.config import daemon
+
+    if daemon.meminfo is not None:
+        return daemon.meminfo().rss
+
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class BootPhase(object):
+    __slots__ = 'name', 'start_t', 'end_t', 'start_rss', 'end_rss'
+
+    def __init__(self, name):
+        self.name = name
+        self.start_t = time()
+        self.start_rss = get_rss()
+        self.end_t = None
+        self.end_rss = None
+
+    def end(self):
+        self.end_t = time()
+        self.end_rss = get_rss()
+
+    def end_cb(self, result):
+        """Same as :meth:`end` but can be used as a Deferred callback."""
+
+        self.end()
+        return result
+
+    @property
+    def duration(self):
+        if self.end_t is None:
+            return None
+        return self.end_t - self.start_t
+
+    @property
+    def rss_delta(self):
+        if self.end_rss is None:
+            return None
+        return self.end_rss - self.start_rss
+
+    def as_dict(self):
+        return dict(
+            name=self.name,
+            start=self.start_t - py_start_t,
+            duration=self.duration,
+            rss_delta=self.rss_delta,
+        )
+
+
+class BootReport(object):
+    """Collects :class:`BootPhase` instances in the order they are started."""
+
+    def __init__(self):
+        self.phases = []
+        self.done = False
+
+    def begin(self, name):
+        """Starts a phase that can't be expressed as a ``with`` block, like
+        asynchronous listener setup. Call ``.end()`` on the return value when
+        the phase is over. Phases started after the report was logged are not
+        recorded."""
+
+        retval = BootPhase(name)
+        if not self.done:
+            self.phases.append(retval)
+        return retval
+
+    @contextmanager
+    def phase(self, name):
+        retval = self.begin(name)
+        try:
+            yield retval
+        finally:
+            retval.end()
+
+    def as_dict(self, **kwargs):
+        retval = dict(
+            pid=os.getpid(),
+            import_time=self.phases[0].start_t - py_start_t
+                                                    if self.phases else None,
+            uptime=time() - py_start_t,
+            rss=get_rss(),
+            phases=[p.as_dict() for p in self.phases],
+        )
+
+        retval.update(kwargs)
+
+        return retval
+
+    def log(self):
+        self.done = True
+
+        for p in self.phases:
+            if p.end_t is None:
+                logger.info("Boot phase %-24s did not finish", p.name)
+                continue
+
+            logger.info("Boot phase %-24s took %7.3fs, rss %+.1fmb",
+                                   p.name, p.duration, p.rss_delta / 1e6)
+
+    def write(self, file_name, **kwargs):
+        with open(file_name, 'w') as f:
+            json.dump(self.as_dict(**kwargs), f, indent=2, sort_keys=True)
+
+        logger.info("Boot report written to '%s'", file_name)
+
+
+boot_report = BootReport()
+"""The boot report of the current process."""
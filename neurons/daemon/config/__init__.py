@@ -46,14 +46,19 @@ from neurons.daemon.config.endpoint import Service
 from neurons.daemon.config.endpoint import Client
 from neurons.daemon.config.endpoint import Server
 from neurons.daemon.config.endpoint import SslServer
+from neurons.daemon.config.endpoint import UdpServer
 from neurons.daemon.config.endpoint import HttpServer
+from neurons.daemon.config.endpoint import RateLimit
 from neurons.daemon.config.endpoint import WsgiServer
 from neurons.daemon.config.endpoint import HttpApplication
+from neurons.daemon.config.endpoint import Compression
 from neurons.daemon.config.endpoint import StaticFileServer
+from neurons.daemon.config.endpoint import MetricsExporter
 
 from neurons.daemon.config.store import FileStore
 from neurons.daemon.config.store import LdapStore
 from neurons.daemon.config.store import RelationalStore
+from neurons.daemon.config.store import Replica
 
 from neurons.daemon.config.daemon import Daemon
 from neurons.daemon.config.daemon import ServiceDaemon
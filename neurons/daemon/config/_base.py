@@ -43,6 +43,28 @@ from collections import namedtuple
 ServiceDefinition = namedtuple("ServiceDefinition", "init default force")
 ServiceDefinition.__new__.__defaults__ = (None,) * 3
 
+
+def get_changed_fields(old, new):
+    """Returns the set of names of the fields that differ between two config
+    objects, as they would appear in the config file."""
+
+    from spyne.protocol.yaml import YamlDocument
+
+    if old is None or new is None:
+        if old is new:
+            return set()
+        return set(['*'])
+
+    if old.__class__ is not new.__class__:
+        return set(['*'])
+
+    prot = YamlDocument(polymorphic=True)
+    old_doc = prot._object_to_doc(old.__class__, old)
+    new_doc = prot._object_to_doc(new.__class__, new)
+
+    return set(k for k in set(old_doc) | set(new_doc)
+                                           if old_doc.get(k) != new_doc.get(k))
+
 LOGLEVEL_MAP = dict(zip(
     ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
     [logging.DEBUG, logging.INFO, logging.WARNING, logging.ERROR,
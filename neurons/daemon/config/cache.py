@@ -0,0 +1,128 @@
+# encoding: utf8
+#
+# This file is part of the Neurons project.
+# Copyright (c), Arskom Ltd. (arskom.com.tr),
+#                Burak Arslan <burak.arslan@arskom.com.tr>.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of the Arskom Ltd., the neurons project nor the names of
+#   its its contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""Cache for parsed and migrated config files.
+
+Parsing and migrating a config file means running it through the pure-python
+yaml parser twice and dumping it once. The cache stores the migrated document
+as a pickle next to the config file, and is reused as long as the config file
+has the same mtime and size and neither neurons nor python were upgraded.
+"""
+
+from __future__ import print_function, absolute_import
+
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import sys
+
+from os.path import basename, dirname, join
+
+from spyne.util.six.moves import cPickle as pickle
+
+import neurons
+
+
+class ConfigCache(object):
+    """Handles the cache file of a single config file.
+
+    :param file_name: Absolute path to the config file.
+    :param cls: The :class:`neurons.daemon.config.Daemon` subclass the config
+        file is parsed as. Different classes use different cache keys.
+    """
+
+    def __init__(self, file_name, cls):
+        self.file_name = file_name
+        self.cls = cls
+        self.cache_file_name = join(dirname(file_name),
+                                          '.%s.cache' % basename(file_name))
+
+    def get_key(self):
+        st = os.stat(self.file_name)
+
+        return (
+            neurons.__version__,
+            tuple(sys.version_info[:2]),
+            '%s.%s' % (self.cls.__module__, self.cls.__name__),
+            st.st_mtime,
+            st.st_size,
+        )
+
+    def load(self):
+        """Returns the cached config document or None if the cache file
+        doesn't exist or is stale."""
+
+        try:
+            with open(self.cache_file_name, 'rb') as f:
+                key, retval = pickle.load(f)
+
+        except (IOError, OSError):
+            return None
+
+        except Exception as e:
+            logger.warning("Ignoring unreadable config cache %r: %r",
+                                                     self.cache_file_name, e)
+            return None
+
+        if key != self.get_key():
+            logger.debug("Config cache %r is stale", self.cache_file_name)
+            return None
+
+        logger.debug("Config loaded from cache %r", self.cache_file_name)
+        return retval
+
+    def store(self, config_dict):
+        # write to a temporary file and rename it so that concurrently booting
+        # processes never see a partial cache file
+        tmp_file_name = '%s.%d' % (self.cache_file_name, os.getpid())
+
+        try:
+            with open(tmp_file_name, 'wb') as f:
+                pickle.dump((self.get_key(), config_dict), f,
+                                                        pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_file_name, self.cache_file_name)
+
+        except (IOError, OSError) as e:
+            logger.warning("Could not write config cache %r: %r",
+                                                     self.cache_file_name, e)
+            try:
+                os.unlink(tmp_file_name)
+            except OSError:
+                pass
+
+    def remove(self):
+        try:
+            os.unlink(self.cache_file_name)
+        except OSError:
+            pass
@@ -0,0 +1,276 @@
+# encoding: utf8
+#
+# This file is part of the Neurons project.
+# Copyright (c), Arskom Ltd. (arskom.com.tr),
+#                Burak Arslan <burak.arslan@arskom.com.tr>.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of the Arskom Ltd., the neurons project nor the names of
+#   its its contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""On-the-fly compression of http responses."""
+
+from __future__ import absolute_import
+
+import logging
+logger = logging.getLogger(__name__)
+
+import zlib
+
+from spyne.util import memoize
+
+
+ENCODING_WBITS = {
+    b'gzip': 16 + zlib.MAX_WBITS,
+    b'deflate': zlib.MAX_WBITS,
+}
+"""zlib window bits parameter per supported content encoding."""
+
+UNCOMPRESSED_CODES = (204, 206, 304)
+"""Responses with these status codes are never compressed."""
+
+
+def get_accepted_encodings(request):
+    """Returns the set of content encodings the client accepts, according to
+    the Accept-Encoding header of the given request. Encodings with a q-value
+    of 0 are excluded."""
+
+    retval = set()
+
+    accept = request.getHeader(b'accept-encoding')
+    if accept is None:
+        return retval
+
+    for a in accept.split(b','):
+        params = a.split(b';')
+
+        q = 1.0
+        for param in params[1:]:
+            k, _, v = param.partition(b'=')
+            if k.strip() == b'q':
+                try:
+                    q = float(v)
+                except ValueError:
+                    q = 0.0
+
+        if q > 0:
+            retval.add(params[0].strip().lower())
+
+    return retval
+
+
+def add_vary(request, header):
+    """Adds the given header name to the Vary header of the response unless
+    it's already there."""
+
+    headers = request.responseHeaders
+    vary = headers.getRawHeaders(b'vary', [])
+    for v in vary:
+        if header in (h.strip().lower() for h in v.split(b',')):
+            return
+
+    headers.setRawHeaders(b'vary', vary + [header])
+
+
+class CompressingEncoder(object):
+    """Compresses the response body of a single request.
+
+    Whether to compress is decided on the first write, as the content type and
+    length of the response are not known before that. Compressed data is
+    flushed to the client once per reactor iteration, so responses that are
+    written incrementally arrive incrementally.
+
+    :param request: The ``twisted.web.server.Request`` instance.
+    :param encoding: The content encoding to use, or None if the client
+        doesn't accept any of the configured encodings.
+    :param compression: A :class:`neurons.daemon.config.Compression`
+        instance.
+    :param skipped_types: Content types that are not compressed, as returned
+        by ``compression.get_skipped_types()``.
+    """
+
+    def __init__(self, request, encoding, compression, skipped_types):
+        self.request = request
+        self.encoding = encoding
+        self.compression = compression
+        self.skipped_types = skipped_types
+
+        self.started = False
+        self.compressor = None
+
+        self._flush_call = None
+
+    def _is_compressible(self):
+        request = self.request
+        if request.method == b'HEAD':
+            return False
+
+        if request.code < 200 or request.code in UNCOMPRESSED_CODES:
+            return False
+
+        headers = request.responseHeaders
+        if headers.hasHeader(b'content-encoding') or \
+                                           headers.hasHeader(b'content-range'):
+            return False
+
+        content_type = headers.getRawHeaders(b'content-type', [b''])[0]
+        content_type = content_type.split(b';', 1)[0].strip().lower()
+        for t in self.skipped_types:
+            if content_type.startswith(t):
+                return False
+
+        return True
+
+    def _start(self):
+        self.started = True
+
+        if not self._is_compressible():
+            return
+
+        request = self.request
+
+        # the response differs per client from here on, whether we compress
+        # it or not
+        add_vary(request, b'accept-encoding')
+
+        if self.encoding is None:
+            return
+
+        headers = request.responseHeaders
+        length = headers.getRawHeaders(b'content-length', None)
+        if length is not None and int(length[0]) < self.compression.min_size:
+            return
+
+        headers.removeHeader(b'content-length')
+        headers.setRawHeaders(b'content-encoding', [self.encoding])
+
+        # a compressed body is a different representation
+        etag = headers.getRawHeaders(b'etag', None)
+        if etag is not None and not etag[0].startswith(b'W/'):
+            headers.setRawHeaders(b'etag', [b'W/' + etag[0]])
+
+        self.compressor = zlib.compressobj(self.compression.level,
+                                 zlib.DEFLATED, ENCODING_WBITS[self.encoding])
+
+    def encode(self, data):
+        if not self.started:
+            self._start()
+
+        if self.compressor is None:
+            return data
+
+        retval = self.compressor.compress(data)
+
+        if self._flush_call is None:
+            from twisted.internet import reactor
+            self._flush_call = reactor.callLater(0, self._flush)
+
+        return retval
+
+    def _flush(self):
+        from twisted.web.http import Request
+
+        self._flush_call = None
+
+        if self.compressor is None or self.request.finished:
+            return
+
+        data = self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            # bypass twisted.web.server.Request.write, it'd encode the data
+            # again
+            Request.write(self.request, data)
+
+    def finish(self):
+        if self._flush_call is not None:
+            self._flush_call.cancel()
+            self._flush_call = None
+
+        if self.compressor is None:
+            return b''
+
+        retval = self.compressor.flush()
+        self.compressor = None
+
+        return retval
+
+
+class CompressingEncoderFactory(object):
+    """Returns a :class:`CompressingEncoder` for every request, using the
+    first of the configured encodings that the client accepts."""
+
+    def __init__(self, compression):
+        self.compression = compression
+        self.encodings = compression.get_encodings()
+        self.skipped_types = compression.get_skipped_types()
+
+    def encoderForRequest(self, request):
+        accepted = get_accepted_encodings(request)
+
+        encoding = None
+        for e in self.encodings:
+            if e in accepted:
+                encoding = e
+                break
+
+        return CompressingEncoder(request, encoding, self.compression,
+                                                             self.skipped_types)
+
+
+@memoize
+def TCompressedResource():
+    from twisted.web.resource import EncodingResourceWrapper
+
+    class CompressedResource(EncodingResourceWrapper):
+        """Compresses the responses of the wrapped resource and of its
+        children.
+
+        Children that were added using ``putChild`` are not wrapped: In
+        neurons, those are other subapps that come with their own compression
+        settings.
+        """
+
+        def __init__(self, original, compression):
+            EncodingResourceWrapper.__init__(self, original,
+                                       [CompressingEncoderFactory(compression)])
+            self.compression = compression
+
+        def getChildWithDefault(self, path, request):
+            retval = self.original.getChildWithDefault(path, request)
+
+            if retval is self.original:
+                return self
+
+            children = getattr(self.original, 'children', {})
+            if children.get(path, None) is retval:
+                return retval
+
+            if isinstance(retval, EncodingResourceWrapper):
+                return retval
+
+            return CompressedResource(retval, self.compression)
+
+    return CompressedResource
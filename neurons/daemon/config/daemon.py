@@ -50,15 +50,16 @@ from grp import getgrnam
 from datetime import datetime
 
 from spyne import ComplexModel, Boolean, ByteArray, Uuid, Unicode, Array, \
-    String, UnsignedInteger16, M, Integer32, ComplexModelMeta, ComplexModelBase
+    String, UnsignedInteger16, UnsignedInteger32, M, Integer32, \
+    ComplexModelMeta, ComplexModelBase, Double
 from spyne.protocol import ProtocolBase
 from spyne.protocol.yaml import YamlDocument
 from spyne.util import six
-from spyne.util.dictdoc import get_object_as_yaml, get_yaml_as_object
+from spyne.util.dictdoc import get_object_as_yaml
 
 from neurons import is_reactor_thread, CONFIG_FILE_VERSION
 from neurons.daemon  import get_package_version
-from neurons.daemon.cli import spyne_to_argparse
+from neurons.daemon.cli import spyne_to_argparse, config_overrides
 from neurons.daemon.daemonize import daemonize_do
 
 from neurons.daemon.config import LOGLEVEL_STR_MAP
@@ -66,7 +67,8 @@ from neurons.daemon.config._wdict import wdict, Twdict
 from neurons.daemon.config.limits import LimitsChoice
 
 from neurons.daemon.config import FILE_VERSION_KEY
-from neurons.daemon.config.endpoint import Service, Server
+from neurons.daemon.config._base import get_changed_fields
+from neurons.daemon.config.endpoint import Service, Server, SslServer
 from neurons.daemon.config.logutils import Logger, Trecord_as_string, \
     TDynamicallyRotatedLog, TTwistedHandler
 from neurons.daemon.config.store import RelationalStore, StoreInfo
@@ -193,6 +195,36 @@ class Daemon(ConfigBase):
         ('limits', LimitsChoice.customize(not_wrapped=True,
             help="Process limits.")),
 
+        ('workers', UnsignedInteger16(
+            help="Number of worker processes. When greater than one, the "
+                 "listening sockets are bound by a supervisor process which "
+                 "then forks and supervises the given number of workers. "
+                 "Only takes effect when daemonized.")),
+
+        ('handoff', Boolean(
+            help="Take over the listening sockets of a running instance "
+                 "that listens on the same tcp ports instead of binding new "
+                 "ones, and make it exit once this one is ready. Needs to be "
+                 "enabled in the running instance as well. Linux only.")),
+
+        ('handoff_drain_timeout', UnsignedInteger32(default=30,
+            help="Maximum number of seconds to wait for open connections to "
+                 "be closed after the listening sockets were handed over to "
+                 "a new instance.")),
+
+        ('management', Boolean(
+            help="Serve runtime statistics over http on the loopback "
+                 "address computed from the process id. Listener management "
+                 "operations also need management_token to be set. See "
+                 "neurons.daemon.ipc for details.")),
+
+        ('management_token', Unicode(
+            no_cli=True,
+            help="Shared secret that enables the listener management "
+                 "operations of the management service. They are served "
+                 "under /control and only to POST requests that send this "
+                 "value in the X-Management-Token header.")),
+
         ('pid_file', String(
             help="The path to a text file that contains the pid of the "
                  "daemonized process.")),
@@ -241,6 +273,11 @@ class Daemon(ConfigBase):
         ('log_interface', Boolean(
             help="Log interface build process."
         )),
+        ('slow_request_threshold', Double(
+            help="Log method calls that take longer than this many seconds, "
+                 "along with the time spent in SQL queries and serialization "
+                 "and the number of bytes written. Disabled when not set."
+        )),
 
         ('write_config', Boolean(
             no_file=True,
@@ -259,13 +296,23 @@ class Daemon(ConfigBase):
         ('autoreload', Boolean(
             default=False,
             help="Auto-relaunch daemon process when one of "
-                 "the source files change.")),
+                 "the source files change. Uses inotify on Linux and falls "
+                 "back to polling elsewhere.")),
 
         ('dry_run', Boolean(
             no_file=True, default=False,
             help="Do everything up until the reactor start and "
                  "exit instead of starting the reactor.")),
 
+        ('boot_report', String(
+            help="Write a json report of the duration and memory usage of "
+                 "each boot phase to the given file. In pre-fork mode, the "
+                 "worker id is appended to the file name.")),
+
+        ('config_cache', Boolean(
+            help="Cache the parsed config file next to it and reuse the "
+                 "cache as long as the config file doesn't change.")),
+
         ('debug', Boolean(default=False)),
         ('debug_reactor', Boolean(default=False)),
 
@@ -278,6 +325,22 @@ class Daemon(ConfigBase):
     def __init__(self, *args, **kwargs):
         super(Daemon, self).__init__(*args, **kwargs)
         self._boot_messaged = False
+        self._uidgid_applied = False
+
+        self.worker_id = None
+        """Set to the worker number in worker processes. None otherwise."""
+
+        self.service_defs = None
+        """Maps service names to the ServiceDefinition instances returned by
+        the init function. Set by daemon.main."""
+
+        self.prewarm_deferred = None
+        """Fires when the data stores that need to be warmed up are ready.
+        Listeners don't accept connections until then. None when no store
+        needs to be warmed up."""
+
+        self._cli = {}
+        self._config_overrides = {}
 
         services = kwargs.get('services', None)
         if services is not None:
@@ -479,8 +542,6 @@ class Daemon(ConfigBase):
 
         import spyne
         import neurons
-        import twisted
-        import sqlalchemy
 
         myver = get_package_version(self.name)
         if myver != "unknown":
@@ -496,7 +557,8 @@ class Daemon(ConfigBase):
         logger.info("Booting daemon %s on python-%s with spyne-%s, neurons-%s, "
             "sqlalchemy-%s and twisted-%s at %s.", myname, pyversion,
                              spyne.__version__, neurons.__version__,
-                        sqlalchemy.__version__, twisted.version.short(),
+                        get_package_version('sqlalchemy'),
+                        get_package_version('twisted'),
                         datetime.now().replace(microsecond=0).isoformat(isosep))
 
     @staticmethod
@@ -518,11 +580,75 @@ class Daemon(ConfigBase):
         we to tell you what to do?.. :)"""
 
     def apply_limits(self):
+        if self.limits is None:
+            return
+
+        # rlimits are inherited from the supervisor process.
+        if self.worker_id is not None:
+            self.limits.apply_timed()
+            return
+
+        self.pre_limits_apply()
+        self.limits.apply()
+
+    def has_workers(self):
+        return self.workers is not None and self.workers > 1 \
+                                                        and not self.dry_run
+
+    def apply_workers(self):
+        """Binds all listening sockets, drops privileges and forks the worker
+        processes. Only returns in the worker processes."""
+
+        from neurons.daemon.prefork import WorkerSupervisor
+
+        # workers need to agree on these
+        if self.uuid is None or self.secret is None:
+            if self.uuid is None:
+                self.uuid = self.gen_uuid()
+
+            if self.secret is None:
+                self.secret = self.gen_secret()
+
+            self.do_write_config()
+            logger.info("Updating configuration file because "
+                                         "new uuid and/or secret was generated")
+
         if self.limits is not None:
             self.pre_limits_apply()
-            self.limits.apply()
+            self.limits.apply_rlimits()
+
+        if self.handoff:
+            from neurons.daemon.handoff import take_over_sockets
+            take_over_sockets(self)
+
+        for s in self._services:
+            if isinstance(s, Server):
+                if not s.disabled and s.socket is None:
+                    s.bind_socket()
+
+                # workers inherit the TLS context along with its session
+                # ticket keys
+                if not s.disabled and isinstance(s, SslServer):
+                    s.get_connection_creator()
+
+        self.apply_uidgid()
+
+        self.worker_id = WorkerSupervisor(self.workers, self.name).run()
+
+        # only the first worker tells the old process to go away
+        if self.handoff and self.worker_id != 0:
+            from neurons.daemon.handoff import close_handoff_connection
+            close_handoff_connection()
+
+        update_psutil_calls()
+        logger.info("Worker %d started with pid %d",
+                                                   self.worker_id, os.getpid())
 
     def apply_listeners(self):
+        if self.handoff and self.worker_id is None:
+            from neurons.daemon.handoff import take_over_sockets
+            take_over_sockets(self)
+
         dl = []
 
         for s in self._services:
@@ -553,6 +679,10 @@ class Daemon(ConfigBase):
         return uid
 
     def apply_uidgid(self):
+        if self._uidgid_applied:
+            return
+        self._uidgid_applied = True
+
         if self.gid is not None:
             gid = self.gid
             if not isinstance(gid, int):
@@ -623,12 +753,16 @@ class Daemon(ConfigBase):
         files.
         """
 
+        from neurons.daemon.bootreport import boot_report
+
         # FIXME: this should really be "may_daemonize"
         if daemonize:
-            self.apply_daemonize()
-            self.apply_pid_file()
+            with boot_report.phase('daemonize'):
+                self.apply_daemonize()
+                self.apply_pid_file()
 
-        self.apply_logging()
+        with boot_report.phase('logging'):
+            self.apply_logging()
 
         if self.debug:
             import twisted.internet.base
@@ -641,9 +775,18 @@ class Daemon(ConfigBase):
                  "twisted.internet.base.DelayedCall and twisted.internet.defer")
 
         if daemonize:
-            self.apply_limits()
-            self.apply_listeners()
-            self.apply_uidgid()
+            if self.has_workers():
+                with boot_report.phase('workers'):
+                    self.apply_workers()
+
+            with boot_report.phase('limits'):
+                self.apply_limits()
+
+            with boot_report.phase('listeners'):
+                self.apply_listeners()
+
+            with boot_report.phase('uidgid'):
+                self.apply_uidgid()
 
     def add_reactor_checks(self):
         """Logs warnings when stuff that could be better off in a dedicated
@@ -690,33 +833,148 @@ class Daemon(ConfigBase):
 
         exists = isfile(file_name) and os.access(file_name, os.R_OK)
         if exists and getsize(file_name) > 0:
-            s = open(file_name, 'rb').read()
+            config_dict = cls._load_config_dict(file_name, daemon_name,
+                                                   cli.get('config_cache'))
 
         else:
             if not access(dirname(file_name), os.R_OK | os.W_OK):
                 raise Exception("File %r can't be created in %r" %
                                                 (file_name, dirname(file_name)))
-            s = b""
+            config_dict = None
 
-        retval = cls.parse_config_string(s, daemon_name, cli)
+        # parse_config_dict consumes these
+        overrides = dict(config_overrides)
+
+        retval = cls.parse_config_dict(config_dict, daemon_name, cli)
         retval.config_file = file_name
+        retval._cli = cli
+        retval._config_overrides = overrides
+        return retval
+
+    def reparse_config(self):
+        """Parses the config file again, with the same command line arguments
+        as the running daemon. Returns a new config object, the current one is
+        not modified."""
+
+        config_overrides.update(self._config_overrides)
+
+        config_dict = self._load_config_dict(self.config_file, self.name,
+                                                 self._cli.get('config_cache'))
+
+        retval = self.parse_config_dict(config_dict, self.name, self._cli)
+        retval.name = self.name
+        retval.config_file = self.config_file
+        retval._cli = self._cli
+        retval._config_overrides = self._config_overrides
+
+        # parse_config_dict points this to the new instance
+        import neurons.daemon
+        neurons.daemon.config_data = self
+
+        return retval
+
+    def reload_loggers(self, new):
+        """Applies the logger configuration in ``new``, another instance of
+        this class, without touching the loggers that did not change."""
+
+        old_loggers = self.loggers or {}
+        new_loggers = new.loggers or {}
+
+        for path, l in old_loggers.items():
+            if not (path in new_loggers):
+                l.reset()
+
+        for path, l in new_loggers.items():
+            old = old_loggers.get(path, None)
+            if old is None or old.level != l.level:
+                l.set_parent(self)
+                l.apply()
+
+        for l in new_loggers.values():
+            l.set_parent(self)
+
+        self.loggers = new.loggers
+
+    def reload_limits(self, new):
+        """Applies the limits in ``new``, another instance of this class, if
+        they are different from the current ones."""
+
+        if len(get_changed_fields(self.limits, new.limits)) == 0:
+            return
+
+        logger.info("Reloading process limits")
+
+        if self.limits is not None:
+            self.limits.stop_timed()
+
+        self.limits = new.limits
+        if self.limits is None:
+            return
+
+        try:
+            self.limits.apply_rlimits()
+
+        except (ValueError, OSError) as e:
+            # eg. when trying to raise a hard limit after dropping privileges
+            logger.error("Error applying rlimits: %r", e)
+
+        self.limits.apply_timed()
+
+    @classmethod
+    def _load_config_dict(cls, file_name, daemon_name, use_cache=None):
+        """Returns the migrated config document from the config cache if it's
+        fresh, from the config file otherwise. The cache is (re)generated
+        when enabled either in the config file or by ``use_cache``."""
+
+        from neurons.daemon.config.cache import ConfigCache
+
+        def _cache_enabled(config_dict):
+            config_root, = config_dict.values()
+            return use_cache or config_root.get('config_cache', False)
+
+        cache = ConfigCache(file_name, cls)
+
+        retval = cache.load()
+        if retval is not None and _cache_enabled(retval):
+            return retval
+
+        s = open(file_name, 'rb').read()
+        retval = cls.get_default(daemon_name)._migrate_dict_impl(s)
+
+        if _cache_enabled(retval):
+            cache.store(retval)
+        else:
+            cache.remove()
+
         return retval
 
     @classmethod
     def parse_config_string(cls, s, daemon_name, cli=None):
+        config_dict = None
+        if len(s) > 0:
+            config_dict = cls.get_default(daemon_name)._migrate_dict_impl(s)
+
+        return cls.parse_config_dict(config_dict, daemon_name, cli)
+
+    @classmethod
+    def parse_config_dict(cls, config_dict, daemon_name, cli=None):
+        """Builds the config object from the config document, ie. what the
+        config file looks like after being parsed and migrated."""
+
         if cli is None:
             cli = {}
 
         retval = cls.get_default(daemon_name)
-        if len(s) > 0:
-            s = retval._migrate_impl(s)
+        if config_dict is not None:
+            prot = YamlDocument(ignore_wrappers=False, validator='soft',
+                                                               polymorphic=True)
             try:
-                retval = get_yaml_as_object(s, cls,
-                                             validator='soft', polymorphic=True)
+                retval = prot._doc_to_object(None, cls, config_dict,
+                                                       validator=prot.validator)
             except Exception as e:
                 logger.error("Error parsing %s", repr(e))
                 logger.exception(e)
-                logger.error("File: %s", s)
+                logger.error("File: %r", config_dict)
                 raise
 
         retval._parse_overrides()
@@ -752,6 +1010,14 @@ class Daemon(ConfigBase):
         want add migration
         """
 
+        import yaml
+        config_dict = self._migrate_dict_impl(s)
+        return yaml.dump(config_dict, indent=4, default_flow_style=False)
+
+    def _migrate_dict_impl(self, s):
+        """Same as :meth:`_migrate_impl` but returns the parsed document
+        instead of serializing it back to yaml."""
+
         import yaml
         config_dict = yaml.safe_load(s)
         key, = config_dict.keys()
@@ -816,7 +1082,7 @@ class Daemon(ConfigBase):
                                               "successful." % (config_version,))
 
         config_root[FILE_VERSION_KEY] = CONFIG_FILE_VERSION
-        return yaml.dump(config_dict, indent=4, default_flow_style=False)
+        return config_dict
 
 
 class ServiceDaemon(Daemon):
@@ -848,6 +1114,10 @@ class ServiceDaemon(Daemon):
         ('log_sqlalchemy', Boolean(
             help="Log SQLAlchemy messages in debug level"
         )),
+        ('log_pool_stats', UnsignedInteger32(
+            help="Log database connection pool statistics every this many "
+                 "seconds. Disabled when not set."
+        )),
 
         ('drop_all_tables', Boolean(
             no_file=True,
@@ -938,6 +1208,7 @@ class ServiceDaemon(Daemon):
         from twisted.internet.defer import maybeDeferred, DeferredList
 
         dl = []
+        prewarm_dl = []
         for store in self.stores.values():
             try:
 
@@ -947,12 +1218,29 @@ class ServiceDaemon(Daemon):
                 logger.exception(e)
                 raise
 
+            if isinstance(store, RelationalStore) and store.prewarm:
+                prewarm_dl.append(d)
+
+            if self.slow_request_threshold is not None and \
+                      isinstance(store, RelationalStore) and store.sync_pool:
+                from neurons.daemon.slowlog import install_sql_hooks
+                install_sql_hooks(store.itself)
+
             if self.main_store == store.name:
                 engine = store.itself.engine
 
                 import neurons
                 neurons.TableModel.Attributes.sqla_metadata.bind = engine
 
+        if len(prewarm_dl) > 0:
+            self.prewarm_deferred = DeferredList(prewarm_dl)
+
+        if self.log_pool_stats:
+            from twisted.internet.task import LoopingCall
+
+            self._pool_stats_logger = LoopingCall(self.log_store_pool_stats)
+            self._pool_stats_logger.start(self.log_pool_stats, now=False)
+
         if self.log_dbconn:
             handler = logging.getLogger().handlers[0]
             _mr = handler._modify_record
@@ -964,6 +1252,12 @@ class ServiceDaemon(Daemon):
 
         return DeferredList(dl)
 
+    def log_store_pool_stats(self):
+        for store in self.stores.values():
+            pool_stats = getattr(store.itself, 'pool_stats', None)
+            if pool_stats is not None:
+                pool_stats.log()
+
     def _parse_overrides(self):
         super(ServiceDaemon, self)._parse_overrides()
 
@@ -977,9 +1271,12 @@ class ServiceDaemon(Daemon):
 
         # FIXME: apply_storage could return a deferred due to txpool init.
 
+        from neurons.daemon.bootreport import boot_report
+
         super(ServiceDaemon, self).apply(daemonize=daemonize)
 
-        self.apply_storage()
+        with boot_report.phase('storage'):
+            self.apply_storage()
 
         return self
 
@@ -39,15 +39,18 @@ logger = logging.getLogger(__name__)
 
 import os
 import re
+import errno
 
+from math import ceil
+from time import time
 from threading import Lock
 from os.path import abspath, join, isfile
 
 from colorama import Fore, Style
 
 from spyne import Application, UnsignedInteger, ComplexModel, Unicode, \
-    UnsignedInteger16, Boolean, String, Array, ComplexModelBase, M, \
-    ValidationError, Integer32
+    UnsignedInteger16, UnsignedInteger32, Boolean, String, Array, \
+    ComplexModelBase, M, ValidationError, Integer32, Double
 
 from spyne.const.http import HTTP_404
 
@@ -59,6 +62,7 @@ from neurons.daemon import EXIT_ERR_LISTEN_TCP, EXIT_ERR_LISTEN_UDP, \
                                                                 EXIT_ERR_UNKNOWN
 from neurons.daemon.cli import config_overrides
 from neurons.daemon.config._wdict import wdict, Twdict
+from neurons.daemon.config.tls import get_file_stamp
 
 class Service(ComplexModel):
     name = M(Unicode)
@@ -90,15 +94,26 @@ class Service(ComplexModel):
 
 # noinspection PyPep8Naming
 def _TFactoryProxy():
-    from twisted.internet.protocol import ServerFactory
+    from twisted.internet.protocol import ServerFactory, Protocol
+    from twisted.protocols.policies import ProtocolWrapper
+
+    class RejectedConnection(Protocol):
+        # Returning None from buildProtocol would be simpler, but the tls
+        # wrapper factory doesn't support that.
+        def connectionMade(self):
+            self.transport.abortConnection()
 
     class FactoryProxy(ServerFactory):
-        def __init__(self):
+        def __init__(self, server=None):
             self.run_start_factory = False
             # real_factory is set by neurons.daemon.main
             self.real_factory = None
             self.noisy = False
 
+            # connection counts are kept in the Server config object so that
+            # they survive re-listens
+            self.server = server
+
         @classmethod
         def forProtocol(cls, *args, **kwargs):
             raise NotImplementedError()
@@ -128,11 +143,252 @@ def _TFactoryProxy():
                 return self.real_factory.stopFactory()
 
         def buildProtocol(self, addr):
-            return self.real_factory.buildProtocol(addr)
+            if self.real_factory is None:
+                logger.warning("Connection from %r refused: Service not "
+                                                           "ready yet.", addr)
+                return RejectedConnection()
+
+            if self.server is not None and not self.server.admit():
+                return RejectedConnection()
+
+            retval = self.real_factory.buildProtocol(addr)
+            if retval is None or self.server is None:
+                return retval
+
+            return ProtocolWrapper(self, retval)
+
+        # the following two are called by ProtocolWrapper
+        def registerProtocol(self, p):
+            self.server.connection_made()
+
+        def unregisterProtocol(self, p):
+            self.server.connection_lost()
 
     return FactoryProxy
 
 
+UDP_MAX_BATCH = 256
+"""Default maximum number of datagrams read from a udp socket per reactor
+iteration."""
+
+UDP_MAX_PACKET_SIZE = 8192
+"""Default size of the buffer each datagram is read into. Longer datagrams
+are truncated."""
+
+PENDING_LOW_WATER_RATIO = 0.8
+"""A server that stopped accepting connections because ``max_pending`` was
+reached resumes once the number of pending requests falls below this fraction
+of ``max_pending``."""
+
+UDP_DROP_CHECK_INTERVAL = 10
+"""Seconds between two checks of the kernel's drop counter for udp sockets."""
+
+
+# noinspection PyPep8Naming
+def _TDatagramProxy():
+    from twisted.internet.protocol import DatagramProtocol
+
+    class DatagramProxy(DatagramProtocol):
+        """The datagram counterpart of FactoryProxy. Datagrams that arrive
+        before the real protocol is set are dropped.
+
+        Real protocols that implement ``datagramsReceived(datagrams)`` get
+        every batch read from the socket as a list of ``(data, addr)``
+        tuples. Others get the usual ``datagramReceived(data, addr)`` calls.
+        """
+
+        # It's called real_factory and not real_protocol so that
+        # daemon.main._set_real_factory can treat both proxies the same.
+        def __init__(self, server=None):
+            self.__rf = None
+            self.server = server
+            self.noisy = False
+
+        @property
+        def real_factory(self):
+            return self.__rf
+
+        @real_factory.setter
+        def real_factory(self, what):
+            self.__rf = what
+            if what is not None and self.transport is not None:
+                what.makeConnection(self.transport)
+
+        def logPrefix(self):
+            if self.real_factory is not None:
+                return self.real_factory.logPrefix()
+            return "EmptyDatagramProxy"
+
+        def stopProtocol(self):
+            if self.real_factory is not None \
+                                     and self.real_factory.transport is not None:
+                self.real_factory.doStop()
+
+        def datagramReceived(self, data, addr):
+            self.datagramsReceived([(data, addr)])
+
+        def datagramsReceived(self, datagrams):
+            server = self.server
+            if server is not None:
+                server.num_datagrams_total += len(datagrams)
+
+            rp = self.real_factory
+            if rp is None:
+                if server is not None:
+                    server.num_datagrams_dropped += len(datagrams)
+                return
+
+            if hasattr(rp, 'datagramsReceived'):
+                rp.datagramsReceived(datagrams)
+                return
+
+            for data, addr in datagrams:
+                try:
+                    rp.datagramReceived(data, addr)
+                except Exception:
+                    logger.exception("Error processing datagram from %r", addr)
+
+    return DatagramProxy
+
+
+# noinspection PyPep8Naming
+def _TUdpPort():
+    import socket
+
+    from twisted.internet import udp
+
+    class UdpPort(udp.Port):
+        """A udp port that limits the number of datagrams and not the number
+        of bytes read per reactor iteration and hands them over to the
+        protocol in one batch."""
+
+        max_batch = UDP_MAX_BATCH
+
+        def doRead(self):
+            batch = []
+
+            try:
+                while len(batch) < self.max_batch:
+                    try:
+                        data, addr = self.socket.recvfrom(self.maxPacketSize)
+
+                    except socket.error as se:
+                        no = se.args[0]
+                        if no in udp._sockErrReadIgnore:
+                            break
+
+                        if no in udp._sockErrReadRefuse:
+                            if self._connectedAddr:
+                                self.protocol.connectionRefused()
+                            break
+
+                        raise
+
+                    if self.addressFamily == socket.AF_INET6:
+                        # see twisted.internet.udp.Port.doRead
+                        addr = addr[:2]
+
+                    batch.append((data, addr))
+
+            finally:
+                if len(batch) > 0:
+                    try:
+                        self.protocol.datagramsReceived(batch)
+                    except Exception:
+                        logger.exception("Error processing datagrams")
+
+    return UdpPort
+
+
+# noinspection PyPep8Naming
+def _TUnixPort():
+    from twisted.internet import tcp, unix
+
+    class UnixPort(unix.Port):
+        """A unix port that removes the socket file when it stops listening
+        only if it's in the process that bound the socket. Pre-forked workers
+        share the socket of the supervisor, so they must leave it alone."""
+
+        bound_pid = None
+
+        def connectionLost(self, reason):
+            if self.bound_pid == os.getpid():
+                unix.Port.connectionLost(self, reason)
+                return
+
+            if self.lockFile is not None:
+                self.lockFile.unlock()
+
+            tcp.Port.connectionLost(self, reason)
+
+    return UnixPort
+
+
+def remove_stale_unix_socket(path):
+    """Removes the unix socket at the given path if nobody listens on it.
+    Raises socket.error when the path exists and is either not a socket or a
+    live one."""
+
+    import stat
+    import socket
+
+    try:
+        st = os.stat(path)
+
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return False
+        raise
+
+    if not stat.S_ISSOCK(st.st_mode):
+        raise socket.error(errno.EEXIST, "%r exists and is not a socket" % path)
+
+    skt = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        skt.connect(path)
+
+    except socket.error as e:
+        if e.args[0] != errno.ECONNREFUSED:
+            raise
+
+        os.unlink(path)
+        logger.info("Removed stale unix socket %r", path)
+        return True
+
+    finally:
+        skt.close()
+
+    raise socket.error(errno.EADDRINUSE, "%r is in use" % path)
+
+
+def get_udp_drops(skt):
+    """Returns the number of datagrams the kernel dropped because the receive
+    buffer of the given socket was full. Needs Linux' procfs, returns None
+    when that's not available."""
+
+    import socket
+
+    file_name = '/proc/net/udp'
+    if skt.family == socket.AF_INET6:
+        file_name = '/proc/net/udp6'
+
+    try:
+        inode = os.fstat(skt.fileno()).st_ino
+
+        with open(file_name) as f:
+            next(f)  # skip header
+
+            for line in f:
+                fields = line.split()
+                if int(fields[9]) == inode:
+                    return int(fields[12])
+
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+
+    return None
+
+
 _lock_factory_proxy = Lock()
 
 
@@ -173,16 +429,95 @@ class Server(Service):
     type = M(Unicode(values=('tcp4', 'tcp6', 'udp4', 'udp6', 'unix'),
                                                                 default='tcp4'))
 
+    path = Unicode(
+        help="Path of the socket file. Only used when type is 'unix'.")
+
+    mode = Unicode(pattern='0?[0-7]{3}',
+        help="Permissions of the socket file as an octal string, eg. '0660'. "
+             "Only used when type is 'unix'.")
+
+    owner = Unicode(
+        help="Owner of the socket file. Defaults to the daemon's uid. Only "
+             "used when type is 'unix'.")
+
+    group = Unicode(
+        help="Group of the socket file. Defaults to the daemon's gid. Only "
+             "used when type is 'unix'.")
+
+    max_connections = UnsignedInteger32(
+        help="Stop accepting new connections while this many connections are "
+             "open. Unlimited when not set.")
+
+    max_accept_rate = UnsignedInteger32(
+        help="Maximum number of new connections accepted per second. "
+             "Unlimited when not set.")
+
+    max_pending = UnsignedInteger32(
+        help="Stop accepting new connections while this many requests are "
+             "being processed. Only http servers count requests. Unlimited "
+             "when not set.")
+
     FactoryProxy = None
+    DatagramProxy = None
+    UdpPort = None
+    UnixPort = None
 
     def __init__(self, *args, **kwargs):
         super(Server, self).__init__(*args, **kwargs)
 
         self.d = None
+        self.socket = None
         self.listener = None
         self.failed = False
         self.color = Fore.YELLOW  # set to G by daemon.main._set_real_factory
 
+        self.factory = None
+        """The factory returned by the service's init function. Set by
+        daemon.main._set_real_factory"""
+
+        self.num_connections = 0
+        """Number of currently open connections."""
+
+        self.num_connections_total = 0
+        """Number of connections accepted since boot."""
+
+        self.num_datagrams_total = 0
+        """Number of datagrams received since boot. Udp only."""
+
+        self.num_datagrams_dropped = 0
+        """Number of datagrams dropped because the service was not ready.
+        Udp only."""
+
+        self.num_kernel_drops = None
+        """Kernel's drop counter at the last check. Udp only."""
+
+        self.drop_monitor = None
+
+        self.num_pending = 0
+        """Number of requests being processed."""
+
+        self.num_rejected = 0
+        """Number of connections closed right after being accepted because a
+        limit was exceeded."""
+
+        self.num_paused = 0
+        """Number of times the server stopped accepting connections because a
+        limit was reached."""
+
+        self.paused = False
+        self._resume_call = None
+        self._accept_tokens = None
+        self._accept_t = None
+
+        self.warming = False
+        """Keeps the server from accepting connections while True. See
+        :meth:`start_warming`."""
+
+        self.bound_pid = None
+        """Pid of the process that bound the listening socket. Only that
+        process removes the socket file of a unix server when it stops
+        listening."""
+
     def gen_endpoint(self, reactor):
         # FIXME: We might not need endpoints after all..
         if self.type == 'tcp4':
@@ -194,19 +529,259 @@ class Server(Service):
             from twisted.internet.endpoints import TCP6ServerEndpoint
             return TCP6ServerEndpoint(reactor, port=self.port,
                                       backlog=self.backlog, interface=self.host)
-        elif self.type == 'udp4':
-            # TODO
-            raise NotImplementedError(self.type)
-            #return UDP4ServerEndpoint(reactor, port=self.port,
-            #                         backlog=self.backlog, interface=self.host)
-        elif self.type == 'udp6':
-            # TODO
+        elif self.is_udp:
+            # Twisted has no udp server endpoints. See listen_udp()
             raise NotImplementedError(self.type)
-            #return UDP6ServerEndpoint(reactor, port=self.port,
-            #                         backlog=self.backlog, interface=self.host)
+
+        elif self.is_unix:
+            # Server.listen() doesn't use this, see _bind_socket()
+            from twisted.internet.endpoints import UNIXServerEndpoint
+            return UNIXServerEndpoint(reactor, self.path, backlog=self.backlog,
+                     mode=int(self.mode, 8) if self.mode is not None else 0o666)
+
+        raise ValidationError(self.type)
+
+    @property
+    def is_udp(self):
+        return self.type in ('udp4', 'udp6')
+
+    @property
+    def is_unix(self):
+        return self.type == 'unix'
+
+    def get_address_family(self):
+        import socket
+
+        if self.type in ('tcp4', 'udp4'):
+            return socket.AF_INET
+
+        if self.type in ('tcp6', 'udp6'):
+            return socket.AF_INET6
+
+        if self.type == 'unix':
+            return socket.AF_UNIX
 
         raise ValidationError(self.type)
 
+    def get_socket_type(self):
+        import socket
+
+        if self.is_udp:
+            return socket.SOCK_DGRAM
+
+        return socket.SOCK_STREAM
+
+    def bind_socket(self, reuse_port=False):
+        """Binds the listening socket without touching the reactor, so that
+        it can be shared with forked worker processes. :meth:`listen` adopts
+        this socket instead of creating a new one. Terminates the process on
+        error.
+
+        :param reuse_port: Set ``SO_REUSEPORT`` so that every worker process
+            can bind its own socket to the same address.
+        """
+
+        import socket
+
+        try:
+            skt = self._bind_socket(reuse_port)
+
+        except (socket.error, ValidationError):
+            from twisted.python.failure import Failure
+            self._eb_listen(Failure())
+
+        logger.info("%s bound to %s", self.colored_name, self.lstr)
+
+        return skt
+
+    def _bind_socket(self, reuse_port=False):
+        import socket
+
+        if self.is_unix:
+            remove_stale_unix_socket(self.path)
+
+        skt = socket.socket(self.get_address_family(), self.get_socket_type())
+        bound = False
+
+        try:
+            if self.is_unix:
+                skt.bind(self.path)
+                bound = True
+                self._set_unix_socket_permissions()
+
+            else:
+                skt.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                if reuse_port:
+                    skt.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+                skt.bind((self.host, self.port))
+
+            if not self.is_udp:
+                skt.listen(self.backlog)
+            skt.setblocking(False)
+
+        except (socket.error, OSError, ValidationError):
+            skt.close()
+
+            # don't leave a socket file that nobody listens on behind
+            if bound:
+                os.unlink(self.path)
+
+            raise
+
+        self.socket = skt
+        self.bound_pid = os.getpid()
+
+        return skt
+
+    def _set_unix_socket_permissions(self):
+        from grp import getgrnam
+        from pwd import getpwnam
+
+        if self.mode is not None:
+            os.chmod(self.path, int(self.mode, 8))
+
+        uid = gid = -1
+        if self._parent is not None:
+            uid = self._parent.get_uid()
+            gid = self._parent.get_gid()
+
+        if self.owner is not None:
+            try:
+                uid = getpwnam(self.owner).pw_uid
+            except KeyError:
+                raise ValidationError(self.owner, "Unknown user %%r in the "
+                                      "'owner' option of %s" % (self.name,))
+
+        if self.group is not None:
+            try:
+                gid = getgrnam(self.group).gr_gid
+            except KeyError:
+                raise ValidationError(self.group, "Unknown group %%r in the "
+                                      "'group' option of %s" % (self.name,))
+
+        # the socket is bound before dropping privileges, so it needs to be
+        # handed over to the daemon user to be usable afterwards.
+        if uid != -1 or gid != -1:
+            os.chown(self.path, uid, gid)
+
+    def wrap_factory(self, factory):
+        """Wraps the given factory the way the endpoint returned from
+        :meth:`gen_endpoint` would. Only used when adopting a socket bound by
+        :meth:`bind_socket`."""
+
+        return factory
+
+    def adopt_socket(self, reactor, factory):
+        if self.is_udp:
+            UdpPort = self.get_udp_port_class()
+
+            retval = UdpPort._fromListeningDescriptor(reactor,
+                         self.socket.fileno(), self.socket.family, factory,
+                                   maxPacketSize=self.get_udp_max_packet_size())
+            retval.startListening()
+
+            return self.setup_udp_port(retval)
+
+        if self.is_unix:
+            # adoptStreamPort would chmod the socket file to 0666
+            UnixPort = self.get_unix_port_class()
+            retval = UnixPort._fromListeningDescriptor(reactor,
+                                                  self.socket.fileno(), factory)
+            retval.bound_pid = self.bound_pid
+            if self.mode is not None:
+                retval.mode = int(self.mode, 8)
+            retval.startListening()
+
+            return retval
+
+        return reactor.adoptStreamPort(self.socket.fileno(),
+                                                    self.socket.family, factory)
+
+    # UdpServer has config fields for these. Plain Servers of type udp4 or
+    # udp6 get the defaults.
+    def get_udp_max_batch(self):
+        return getattr(self, 'max_batch', None) or UDP_MAX_BATCH
+
+    def get_udp_max_packet_size(self):
+        return getattr(self, 'max_packet_size', None) or UDP_MAX_PACKET_SIZE
+
+    def get_udp_rcvbuf(self):
+        return getattr(self, 'rcvbuf', None)
+
+    def listen_udp(self, reactor, protocol):
+        UdpPort = self.get_udp_port_class()
+
+        retval = UdpPort(self.port, protocol, interface=self.host,
+                     maxPacketSize=self.get_udp_max_packet_size(),
+                                                                reactor=reactor)
+        retval.startListening()
+
+        return self.setup_udp_port(retval)
+
+    def setup_udp_port(self, port):
+        import socket
+
+        port.max_batch = self.get_udp_max_batch()
+
+        rcvbuf = self.get_udp_rcvbuf()
+        if rcvbuf:
+            port.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+
+            # linux doubles the value and caps it at net.core.rmem_max
+            actual = port.socket.getsockopt(socket.SOL_SOCKET,
+                                                              socket.SO_RCVBUF)
+            logger.debug("%s Receive buffer size set to %d, got %d",
+                                             self.colored_name, rcvbuf, actual)
+
+        self.num_kernel_drops = get_udp_drops(port.socket)
+        if self.num_kernel_drops is not None:
+            from twisted.internet.task import LoopingCall
+
+            self.drop_monitor = LoopingCall(self._check_drops, port)
+            self.drop_monitor.start(UDP_DROP_CHECK_INTERVAL, now=False)
+
+        return port
+
+    def _check_drops(self, port):
+        drops = get_udp_drops(port.socket)
+        if drops is None:
+            return
+
+        # workers share the socket and thus the counter, so only one of them
+        # complains.
+        parent = self._parent
+        is_first = parent is None or parent.worker_id in (None, 0)
+
+        if is_first and self.num_kernel_drops is not None \
+                                              and drops > self.num_kernel_drops:
+            logger.warning("%s %d datagrams dropped by the kernel in the last "
+                       "%ds. Consider increasing rcvbuf.", self.colored_name,
+                       drops - self.num_kernel_drops, UDP_DROP_CHECK_INTERVAL)
+
+        self.num_kernel_drops = drops
+
+    def get_udp_port_class(self):
+        with _lock_factory_proxy:
+            if Server.UdpPort is None:
+                Server.UdpPort = _TUdpPort()
+
+        return Server.UdpPort
+
+    def get_unix_port_class(self):
+        with _lock_factory_proxy:
+            if Server.UnixPort is None:
+                Server.UnixPort = _TUnixPort()
+
+        return Server.UnixPort
+
+    def get_datagram_proxy(self):
+        with _lock_factory_proxy:
+            if Server.DatagramProxy is None:
+                Server.DatagramProxy = _TDatagramProxy()
+
+        return Server.DatagramProxy
+
     def get_factory_proxy(self):
         # Why thread-safe application of daemon configuration? I say why not :)
         with _lock_factory_proxy:
@@ -215,24 +790,281 @@ class Server(Service):
 
         return Server.FactoryProxy
 
+    @property
+    def state(self):
+        """One of ``'disabled'``, ``'failed'``, ``'listening'`` or
+        ``'stopped'``."""
+
+        if self.listener is not None:
+            return 'listening'
+        if self.disabled:
+            return 'disabled'
+        if self.failed:
+            return 'failed'
+        return 'stopped'
+
     @property
     def lstr(self):
+        if self.is_unix:
+            return "UNIX:{}".format(self.path)
         return "{}:{}:{}".format(self.type.upper(), self.host, self.port)
 
-    def listen(self):
+    def listen(self, exit_on_error=True):
+        """Starts listening. Returns a Deferred that fires with the listening
+        port.
+
+        :param exit_on_error: When False, a listen error is only logged and
+            the returned Deferred fires with None instead of terminating the
+            process.
+        """
+
         from twisted.internet import reactor
+        from neurons.daemon.bootreport import boot_report
+
+        phase = boot_report.begin('listen:%s' % self.name)
+
+        # services that were not in the config file when the supervisor bound
+        # the listening sockets need to be bound by each worker.
+        if self.socket is None and self._parent is not None \
+                                        and self._parent.worker_id is not None:
+            self.bind_socket(reuse_port=True)
+
+        from twisted.internet.defer import maybeDeferred
+
+        if self.is_udp:
+            proxy = self.get_datagram_proxy()(self)
 
-        FactoryProxy = self.get_factory_proxy()
+            if self.socket is None:
+                d = maybeDeferred(self.listen_udp, reactor, proxy)
+            else:
+                d = maybeDeferred(self.adopt_socket, reactor, proxy)
+
+        elif self.is_unix and self.socket is None:
+            # Binding the socket ourselves lets us clean up stale socket files
+            # and set ownership. It also lets SslServer wrap the factory the
+            # same way for every socket type.
+            proxy = self.get_factory_proxy()(self)
+            d = maybeDeferred(self._bind_socket) \
+                .addCallback(lambda _: self.adopt_socket(reactor,
+                                                      self.wrap_factory(proxy)))
 
-        retval = self.d = self.gen_endpoint(reactor) \
-            .listen(FactoryProxy()) \
+        elif self.socket is None:
+            proxy = self.get_factory_proxy()(self)
+            d = self.gen_endpoint(reactor).listen(proxy)
+
+        else:
+            proxy = self.get_factory_proxy()(self)
+            d = maybeDeferred(self.adopt_socket, reactor,
+                                                       self.wrap_factory(proxy))
+
+        retval = self.d = d \
+                .addBoth(phase.end_cb) \
                 .addCallback(self.set_listening_port) \
-                .addCallback(lambda _: logger.info("%s listening on %s",
-                                                self.colored_name, self.lstr)) \
-                .addErrback(self._eb_listen)
+                .addErrback(self._eb_listen if exit_on_error
+                                                   else self._eb_listen_no_exit)
 
         return retval
 
+    def admit(self):
+        """Called by the factory proxy for every accepted connection. Returns
+        False if the connection is to be closed right away.
+
+        Connections that exceed a limit can still get accepted because the
+        reactor accepts connections in batches. Otherwise, the server stops
+        accepting connections before any of the limits is exceeded and the
+        kernel keeps new connections in the listen backlog.
+        """
+
+        if self.max_connections \
+                              and self.num_connections >= self.max_connections:
+            self.num_rejected += 1
+            self.pause_accepting()
+            return False
+
+        if self.max_accept_rate:
+            now = time()
+            rate = self.max_accept_rate
+
+            # token bucket that holds at most one second worth of connections
+            if self._accept_t is None:
+                self._accept_tokens = float(rate)
+            else:
+                self._accept_tokens = min(float(rate), self._accept_tokens
+                                                  + (now - self._accept_t) * rate)
+            self._accept_t = now
+
+            if self._accept_tokens < 1:
+                self.num_rejected += 1
+                self.pause_accepting((1 - self._accept_tokens) / rate)
+                return False
+
+            self._accept_tokens -= 1
+            if self._accept_tokens < 1:
+                self.pause_accepting((1 - self._accept_tokens) / rate)
+
+        return True
+
+    def connection_made(self):
+        self.num_connections += 1
+        self.num_connections_total += 1
+
+        if self.max_connections \
+                              and self.num_connections >= self.max_connections:
+            self.pause_accepting()
+
+    def connection_lost(self):
+        self.num_connections -= 1
+
+        if self.paused:
+            self.resume_accepting()
+
+    def request_started(self):
+        """To be called by the service when it starts processing a request.
+        Used to enforce ``max_pending``."""
+
+        self.num_pending += 1
+
+        if self.max_pending and self.num_pending >= self.max_pending:
+            self.pause_accepting()
+
+    def request_finished(self, _=None):
+        """To be called by the service when it's done processing a request.
+        Can be used as a Deferred callback."""
+
+        self.num_pending -= 1
+
+        if self.paused:
+            self.resume_accepting()
+
+    def _should_pause(self):
+        if self.warming:
+            return True
+
+        if self.max_connections \
+                              and self.num_connections >= self.max_connections:
+            return True
+
+        if self.max_pending and self.num_pending \
+                                > self.max_pending * PENDING_LOW_WATER_RATIO:
+            return True
+
+        # waiting for the accept rate limiter
+        if self._resume_call is not None and self._resume_call.active():
+            return True
+
+        return False
+
+    def pause_accepting(self, resume_after=None):
+        """Stops accepting connections. If ``resume_after`` is given, tries to
+        resume after that many seconds. Otherwise, it's tried whenever a
+        connection is closed or a request finishes."""
+
+        if self.listener is None or self.is_udp:
+            return
+
+        if not self.paused:
+            self.paused = True
+            self.num_paused += 1
+            self.listener.stopReading()
+
+            logger.debug("%s Stopped accepting connections. connections: %d "
+                            "pending: %d", self.colored_name,
+                                          self.num_connections, self.num_pending)
+
+        if resume_after is not None:
+            if self._resume_call is None or not self._resume_call.active():
+                from twisted.internet import reactor
+
+                self._resume_call = reactor.callLater(resume_after,
+                                                          self.resume_accepting)
+
+    def start_warming(self):
+        """Stops accepting connections until :meth:`stop_warming` is called,
+        e.g. while database connections are being warmed up. The kernel keeps
+        new connections in the listen backlog in the meantime."""
+
+        self.warming = True
+        self.pause_accepting()
+
+    def stop_warming(self):
+        self.warming = False
+        self.resume_accepting()
+
+    def resume_accepting(self):
+        """Starts accepting connections again unless a limit is still in
+        effect."""
+
+        if not self.paused or self.listener is None:
+            return
+
+        if self._should_pause():
+            return
+
+        self.paused = False
+        self.listener.startReading()
+
+        logger.debug("%s Resumed accepting connections. connections: %d "
+                            "pending: %d", self.colored_name,
+                                          self.num_connections, self.num_pending)
+
+    def _limit_accept_batch(self):
+        # The port accepts up to numberAccepts connections per wakeup, and
+        # doesn't stop halfway when told to stop reading. It also rescales
+        # this number after every batch, so it's capped before every batch.
+        if not hasattr(self.listener, 'numberAccepts'):
+            return
+
+        headroom = []
+        if self.max_connections:
+            headroom.append(self.max_connections - self.num_connections)
+        if self.max_accept_rate and self._accept_tokens is not None:
+            headroom.append(int(self._accept_tokens))
+
+        if len(headroom) > 0:
+            self.listener.numberAccepts = max(1, min(headroom))
+
+    def unlisten(self):
+        """Stops listening. Returns a Deferred that fires when the listening
+        port is closed."""
+
+        from twisted.internet.defer import maybeDeferred, succeed
+
+        listener = self.listener
+        self.listener = None
+        self.d = None
+        self.paused = False
+
+        if self._resume_call is not None:
+            if self._resume_call.active():
+                self._resume_call.cancel()
+            self._resume_call = None
+
+        if self.drop_monitor is not None:
+            if self.drop_monitor.running:
+                self.drop_monitor.stop()
+            self.drop_monitor = None
+
+        if self.socket is not None:
+            # the listener has its own copy of the file descriptor
+            self.socket.close()
+            self.socket = None
+
+        if listener is None:
+            return succeed(None)
+
+        self.color = Fore.YELLOW
+        logger.info("%s Stopped listening on %s", self.colored_name,
+                                                                     self.lstr)
+
+        return maybeDeferred(listener.stopListening)
+
+    def _eb_listen_no_exit(self, err):
+        self.failed = True
+
+        self.color = Fore.RED
+        logger.error("%s Error listening to %s\n%s",
+                               self.colored_name, self.lstr, err.getTraceback())
+
     def _eb_listen(self, err):
         self.failed = True
 
@@ -251,6 +1083,21 @@ class Server(Service):
     def set_listening_port(self, listening_port):
         assert not (listening_port is None)
         self.listener = listening_port
+        self.failed = False
+
+        if hasattr(listening_port, 'numberAccepts'):
+            do_read = listening_port.doRead
+
+            def _do_read():
+                self._limit_accept_batch()
+                return do_read()
+
+            listening_port.doRead = _do_read
+
+        logger.info("%s listening on %s", self.colored_name, self.lstr)
+
+        # passed on to daemon.main._set_real_factory
+        return listening_port
 
     def _parse_overrides(self):
         super(Server, self)._parse_overrides()
@@ -274,6 +1121,25 @@ class Server(Service):
                 continue
 
 
+class UdpServer(Server):
+    """A udp server. The service's init function is expected to return a
+    DatagramProtocol instance instead of a factory."""
+
+    type = M(Unicode(values=('udp4', 'udp6'), default='udp4'))
+
+    rcvbuf = UnsignedInteger32(
+        help="Receive buffer size in bytes. The system default is used when "
+             "not set. Note that Linux caps this at net.core.rmem_max.")
+
+    max_batch = UnsignedInteger16(default=UDP_MAX_BATCH,
+        help="Maximum number of datagrams read from the socket per reactor "
+             "iteration.")
+
+    max_packet_size = UnsignedInteger16(default=UDP_MAX_PACKET_SIZE,
+        help="Size of the buffer each datagram is read into. Longer "
+             "datagrams are truncated.")
+
+
 def _listfiles(dirpath):
     for f in os.listdir(dirpath):
         fp = join(dirpath, f)
@@ -289,8 +1155,41 @@ class SslServer(Server):
         ('key', Unicode),
         ('verify', Boolean(default=False)),
         ('verdepth', Integer32(default=9)),  # taken from twisted default
+        ('http2', Boolean(default=False,
+            help="Advertise HTTP/2 via ALPN, falling back to HTTP/1.1 for "
+                 "clients that don't support it. Only makes sense for http "
+                 "services. Needs the h2 and priority packages.")),
+        ('session_cache', Boolean(default=False,
+            help="Keep a cache of TLS sessions so that reconnecting clients "
+                 "can do an abbreviated handshake.")),
+        ('session_timeout', UnsignedInteger32(default=300,
+            help="Seconds a TLS session can be resumed for.")),
+        ('session_tickets', Boolean(default=False,
+            help="Enable RFC 5077 session tickets. In pre-fork mode, all "
+                 "workers start with the same ticket keys so that clients can "
+                 "resume sessions on any worker.")),
+        ('tls_context_lifetime', UnsignedInteger32(default=0,
+            help="Rebuild the TLS context every this many seconds, which "
+                 "replaces its session ticket keys. Tickets and cached "
+                 "sessions of the old context can't be resumed afterwards, so "
+                 "all clients do a full handshake once. In pre-fork mode, "
+                 "workers generate their own keys from then on. 0 disables "
+                 "rebuilds.")),
+        ('tls_check_interval', UnsignedInteger32(default=60,
+            help="Seconds between checks of the certificate and key files "
+                 "for changes. Changed files are reloaded without dropping "
+                 "existing connections. 0 disables the checks.")),
     ]
 
+    def __init__(self, *args, **kwargs):
+        super(SslServer, self).__init__(*args, **kwargs)
+
+        self.connection_creator = None
+        """Hands out TLS connections to the listener. See
+        :meth:`get_connection_creator`"""
+
+        self.tls_monitor = None
+
     @staticmethod
     def get_path(s):
         if s.startswith("rsc:"):
@@ -298,7 +1197,7 @@ class SslServer(Server):
             return get_resource_path(package, file_name)
         return s
 
-    def gen_endpoint(self, reactor):
+    def gen_ssl_options(self):
         from OpenSSL import crypto
 
         cert = None
@@ -322,14 +1221,14 @@ class SslServer(Server):
 
         cacerts = []
         if self.cacert is not None:
-            fn = self.get_path(self.key)
+            fn = self.get_path(self.cacert)
             logger.debug("%s Loading cacert from: %s", self.colored_name, fn)
             fdata = open(fn, 'rb').read()
             cacert = crypto.load_certificate(crypto.FILETYPE_PEM, fdata)
             cacerts.append(cacert)
 
         if self.cacert_path is not None:
-            cacert_path = self.get_path(self.key)
+            cacert_path = self.get_path(self.cacert_path)
             # TODO: ignore errors
             for fn in _listfiles(cacert_path):
                 fdata = open(fn, 'rb').read()
@@ -338,6 +1237,11 @@ class SslServer(Server):
                 cacert = crypto.load_certificate(crypto.FILETYPE_PEM, fdata)
                 cacerts.append(cacert)
 
+        kwargs = {}
+        alpn_protocols = self.get_alpn_protocols()
+        if alpn_protocols is not None:
+            kwargs['acceptableProtocols'] = alpn_protocols
+
         from twisted.internet.ssl import CertificateOptions
         options = CertificateOptions(
             privateKey=key,
@@ -345,9 +1249,173 @@ class SslServer(Server):
             caCerts=cacerts,
             verify=self.verify,
             verifyDepth=self.verdepth,
+            enableSessions=self.session_cache,
+            enableSessionTickets=self.session_tickets,
+            **kwargs
         )
 
-        assert options.getContext()
+        ctx = options.getContext()
+        assert ctx
+
+        if self.session_cache:
+            ctx.set_timeout(self.session_timeout)
+
+        return options
+
+    def get_tls_file_stamps(self):
+        """Returns the stamps of the certificate, key and CA files, to be
+        compared to later ones to detect changes. For ``cacert_path``, the
+        directory itself is stamped to notice added or removed files, and so
+        is every file in it."""
+
+        paths = [self.get_path(fn) for fn in (self.cert, self.key, self.cacert)
+                                                             if fn is not None]
+
+        if self.cacert_path is not None:
+            cacert_path = self.get_path(self.cacert_path)
+            paths.append(cacert_path)
+
+            if os.path.isdir(cacert_path):
+                paths.extend(sorted(_listfiles(cacert_path)))
+
+        return tuple(get_file_stamp(fn) for fn in paths)
+
+    def tls_files_changed(self):
+        """Returns True if the certificate, key or CA files were modified since
+        they were loaded. Files that are missing, e.g. because they are being
+        replaced, don't count as modified."""
+
+        if self.connection_creator is None:
+            return False
+
+        stamps = self.get_tls_file_stamps()
+        if None in stamps:
+            return False
+
+        return stamps != self.connection_creator.stamps
+
+    def get_connection_creator(self):
+        """Returns the object that creates TLS connections for this server,
+        creating it if necessary. Its ``CertificateOptions`` instance is
+        replaced by :meth:`reload_tls`.
+
+        Doesn't need the reactor, so that the pre-fork supervisor can call it
+        to have all workers share the same session ticket keys."""
+
+        from neurons.daemon.config.tls import TTlsConnectionCreator
+
+        if self.connection_creator is None:
+            stamps = self.get_tls_file_stamps()
+            self.connection_creator = \
+                         TTlsConnectionCreator()(self.gen_ssl_options(), stamps)
+
+        return self.connection_creator
+
+    def reload_tls(self):
+        """Loads the certificate and key files again and builds a new TLS
+        context with the current settings, to be used for new connections.
+        Existing connections are left alone. Keeps the current context and
+        returns False if loading fails."""
+
+        if self.connection_creator is None:
+            return False
+
+        stamps = self.get_tls_file_stamps()
+
+        try:
+            options = self.gen_ssl_options()
+
+        except Exception as e:
+            logger.error("%s Error reloading TLS context, keeping the "
+                              "current one: %r", self.colored_name, e)
+            return False
+
+        self.connection_creator.swap(options, stamps)
+        logger.info("%s Reloaded TLS context", self.colored_name)
+
+        # in case its interval was changed
+        self.stop_tls_monitor()
+        self.start_tls_monitor()
+
+        return True
+
+    def start_tls_monitor(self):
+        if self.tls_monitor is not None:
+            return
+
+        intervals = [i for i in (self.tls_check_interval,
+                                             self.tls_context_lifetime) if i]
+        if len(intervals) == 0:
+            return
+
+        from twisted.internet.task import LoopingCall
+
+        self.tls_monitor = LoopingCall(self._check_tls)
+        self.tls_monitor.start(min(intervals), now=False)
+
+    def stop_tls_monitor(self):
+        if self.tls_monitor is not None:
+            if self.tls_monitor.running:
+                self.tls_monitor.stop()
+            self.tls_monitor = None
+
+    def _check_tls(self):
+        creator = self.connection_creator
+        if creator is None:
+            return
+
+        if self.tls_check_interval and self.tls_files_changed():
+            logger.info("%s Certificate files changed", self.colored_name)
+            self.reload_tls()
+            return
+
+        if self.tls_context_lifetime:
+            if time() - creator.loaded_at >= self.tls_context_lifetime:
+                logger.debug("%s Rebuilding TLS context", self.colored_name)
+                self.reload_tls()
+
+    def unlisten(self):
+        self.stop_tls_monitor()
+
+        return super(SslServer, self).unlisten()
+
+    def get_alpn_protocols(self):
+        """Returns the list of protocols to advertise via ALPN, in order of
+        preference, or None to not do ALPN at all."""
+
+        if not self.http2:
+            return None
+
+        from twisted.web.http import H2_ENABLED
+        if not H2_ENABLED:
+            logger.warning("%s HTTP/2 support needs the h2 and priority "
+                         "packages, falling back to HTTP/1.1", self.colored_name)
+            return None
+
+        from twisted.internet.ssl import protocolNegotiationMechanisms, \
+                                                    ProtocolNegotiationSupport
+        if not (protocolNegotiationMechanisms() &
+                                              ProtocolNegotiationSupport.ALPN):
+            logger.warning("%s OpenSSL does not support ALPN, falling back "
+                                         "to HTTP/1.1", self.colored_name)
+            return None
+
+        logger.debug("%s Advertising HTTP/2 via ALPN", self.colored_name)
+
+        return [b'h2', b'http/1.1']
+
+    def wrap_factory(self, factory):
+        from twisted.protocols.tls import TLSMemoryBIOFactory
+
+        retval = TLSMemoryBIOFactory(self.get_connection_creator(), False,
+                                                                        factory)
+        self.start_tls_monitor()
+
+        return retval
+
+    def gen_endpoint(self, reactor):
+        options = self.get_connection_creator()
+        self.start_tls_monitor()
 
         if self.type == 'tcp4':
             from twisted.internet.endpoints import SSL4ServerEndpoint
@@ -362,14 +1430,87 @@ class SslServer(Server):
         raise ValidationError(self.type)
 
 
+class Compression(ComplexModel):
+    DEFAULT_SKIPPED_TYPES = (
+        'image/png', 'image/jpeg', 'image/gif', 'image/webp', 'image/avif',
+        'video/', 'audio/', 'font/woff', 'application/zip', 'application/gzip',
+        'application/x-gzip', 'application/x-bzip2', 'application/x-xz',
+        'application/x-7z-compressed', 'application/pdf',
+        'application/octet-stream',
+    )
+
+    encodings = Array(Unicode(values=['gzip', 'deflate']),
+        help="Content encodings to use, in order of preference. Defaults to "
+             "gzip and deflate.")
+
+    level = Integer32(default=6, ge=1, le=9,
+        help="zlib compression level. 1 is the fastest, 9 compresses best.")
+
+    min_size = UnsignedInteger32(default=1024,
+        help="Responses smaller than this many bytes are not compressed. "
+             "Responses of unknown length are always compressed.")
+
+    skipped_types = Array(Unicode,
+        help="Content types that are not compressed, matched by prefix. "
+             "Defaults to common media and archive types that are already "
+             "compressed.")
+
+    def get_encodings(self):
+        if not self.encodings:
+            return [b'gzip', b'deflate']
+        return [e.encode('ascii') for e in self.encodings]
+
+    def get_skipped_types(self):
+        skipped_types = self.skipped_types
+        if skipped_types is None:
+            skipped_types = self.DEFAULT_SKIPPED_TYPES
+
+        return [t.lower().encode('ascii') for t in skipped_types]
+
+
+class RateLimit(ComplexModel):
+    key = M(Unicode(values=['ip', 'user', 'subapp'],
+        help="What to count requests by: the client ip address, the "
+             "authenticated user name (ReadContext.username) or the subapp "
+             "url. User limits only apply to spyne methods and only to "
+             "authenticated clients."))
+
+    rate = M(Double(gt=0,
+        help="Number of requests allowed per second, on average."))
+
+    burst = UnsignedInteger32(
+        help="Number of requests allowed in a row before the rate kicks in. "
+             "Defaults to the rate, rounded up.")
+
+    subapp = Unicode(
+        help="Only count requests to the subapp with this url. Counts all "
+             "requests when not set.")
+
+    def get_burst(self):
+        if self.burst:
+            return self.burst
+
+        return max(1, int(ceil(self.rate)))
+
+
 class HttpApplication(ComplexModel):
     url = Unicode
 
+    compression = Compression.customize(
+        help="Compress responses on the fly when the client supports it. "
+             "Disabled when not set.")
+
     def __init__(self, app=None, url=None):
         super(HttpApplication, self).__init__(url=url)
         self.app = app
 
-    def gen_resource(self):
+    def gen_resource(self, threadpool=None):
+        """Returns a twisted.web resource for the app.
+
+        :param threadpool: The thread pool to run wsgi apps in. The reactor
+            thread pool is used when None.
+        """
+
         from spyne.server.twisted import TwistedWebResource
         from spyne.server.wsgi import WsgiApplication
         from spyne.util.wsgi_wrapper import WsgiMounter
@@ -385,7 +1526,10 @@ class HttpApplication(ComplexModel):
             retval = TwistedWebResource(self.app)
 
         elif isinstance(self.app, (WsgiApplication, WsgiMounter)):
-            retval = WSGIResource(reactor, reactor.getThreadPool(), self.app)
+            if threadpool is None:
+                threadpool = reactor.getThreadPool()
+
+            retval = WSGIResource(reactor, threadpool, self.app)
 
         else:
             raise ValueError(self.app)
@@ -394,18 +1538,122 @@ class HttpApplication(ComplexModel):
         return retval
 
 
+class CacheControl(ComplexModel):
+    exts = Array(Unicode,
+        help="File extensions without the leading dot. '*' matches all "
+             "files that are not matched otherwise.")
+
+    value = Unicode(help="Value of the Cache-Control header.")
+
+
 class StaticFileServer(HttpApplication):
     path = String
     list_contents = Boolean(default=False)
     disallowed_exts = Array(Unicode, default_factory=tuple)
 
+    fast = Boolean(default=False,
+        help="Cache small files in memory, serve big files from memory maps, "
+             "serve precompressed files and answer conditional requests "
+             "using ETags. Ignored when list_contents is set.")
+
+    precompressed = Boolean(default=True,
+        help="Serve foo.css.br or foo.css.gz instead of foo.css when they "
+             "exist and the client accepts the encoding. Only in fast mode.")
+
+    cache_size = UnsignedInteger32(default=16 * 1024 * 1024,
+        help="Maximum total size of files cached in memory, in bytes. Only "
+             "in fast mode.")
+
+    cache_max_file_size = UnsignedInteger32(default=256 * 1024,
+        help="Files bigger than this many bytes are not cached in memory. "
+             "Only in fast mode.")
+
+    cache_control = Array(CacheControl,
+        help="Cache-Control header values per file extension. Only in fast "
+             "mode.")
+
+    fingerprint = Boolean(default=False,
+        help="Also serve files under names that contain a hash of their "
+             "contents, with an immutable Cache-Control header. Screens use "
+             "these names in asset urls. Files are hashed at startup unless "
+             "a manifest is given, so they must not change while the daemon "
+             "is running.")
+
+    manifest = String(
+        help="Path to a manifest generated by running "
+             "'python -m neurons.base.assets <path>' at build time. Used "
+             "instead of hashing files at startup when fingerprint is set.")
+
     def __init__(self, *args, **kwargs):
         # We need the default ComplexModelBase ctor and not HttpApplication's
         # custom ctor here
 
         ComplexModelBase.__init__(self, *args, **kwargs)
 
+        self.file_cache = None
+        self.fingerprints = None
+
+    def get_fingerprints(self):
+        """Returns the fingerprint map of the files under :attr:`path` and
+        registers their fingerprinted urls for :func:`get_asset_url`. The
+        result is memoized."""
+
+        if self.fingerprints is not None:
+            return self.fingerprints
+
+        from neurons.base.assets import gen_manifest, load_manifest, \
+                                                                register_assets
+        from neurons.daemon.config.static_file import get_fingerprint_map
+
+        path = abspath(self.path)
+
+        if self.manifest is not None and isfile(self.manifest):
+            manifest = load_manifest(self.manifest)
+            logger.debug("Loaded %d fingerprints for %s from %s",
+                                           len(manifest), path, self.manifest)
+
+        else:
+            if self.manifest is not None:
+                logger.warning("Manifest %s not found, hashing files under "
+                                                "%s", self.manifest, path)
+
+            manifest = gen_manifest(path, self.disallowed_exts)
+            logger.debug("Hashed %d files under %s", len(manifest), path)
+
+        register_assets(self.url, manifest)
+        self.fingerprints = get_fingerprint_map(path, manifest)
+
+        return self.fingerprints
+
+    def get_cache_control_map(self):
+        retval = {}
+
+        if self.cache_control is not None:
+            for cc in self.cache_control:
+                for ext in (cc.exts or ()):
+                    retval[ext.lstrip('.')] = cc.value
+
+        return retval
+
     def gen_resource(self):
+        fingerprints = None
+        if self.fingerprint and not self.list_contents:
+            fingerprints = self.get_fingerprints()
+
+        if self.fast and not self.list_contents:
+            from neurons.daemon.config.static_file import FileCache, \
+                                                                TFastStaticFile
+
+            if self.file_cache is None:
+                self.file_cache = FileCache(self.cache_size,
+                                                       self.cache_max_file_size)
+
+            FastStaticFile = TFastStaticFile(self.disallowed_exts, self.url,
+                             self.file_cache, self.precompressed,
+                             self.get_cache_control_map(), fingerprints)
+
+            return FastStaticFile(abspath(self.path))
+
         if self.list_contents:
             from neurons.daemon.config.static_file import TCheckedFile
             CheckedFile = TCheckedFile(self.disallowed_exts, self.url)
@@ -413,15 +1661,45 @@ class StaticFileServer(HttpApplication):
             return CheckedFile(abspath(self.path))
 
         from neurons.daemon.config.static_file import TStaticFile
-        StaticFile = TStaticFile(self.disallowed_exts, self.url)
+        StaticFile = TStaticFile(self.disallowed_exts, self.url, fingerprints)
 
         return StaticFile(abspath(self.path))
 
 
+class MetricsExporter(HttpApplication):
+    """Serves the request metrics recorded by :class:`HttpServer` instances
+    in the Prometheus text format. In pre-fork mode, each request gets the
+    metrics of a random worker, so scrape the management port of every
+    worker instead."""
+
+    def __init__(self, *args, **kwargs):
+        # We need the default ComplexModelBase ctor and not HttpApplication's
+        # custom ctor here
+
+        ComplexModelBase.__init__(self, *args, **kwargs)
+
+    def gen_resource(self):
+        from neurons.daemon.metrics import TMetricsResource
+
+        retval = TMetricsResource()()
+        retval.prepath = quote(self.url).encode('ascii')
+
+        return retval
+
+
 class HttpServer(Server):
     _type_info = [
         ('static_dir', Unicode),
         ('_subapps', Array(HttpApplication, sub_name='subapps')),
+        ('metrics', Boolean(default=True,
+            help="Record request counts and latencies per subapp and per "
+                 "spyne method. See MetricsExporter.")),
+        ('rate_limits', Array(RateLimit,
+            help="Reject requests that exceed any of these limits with "
+                 "429 Too Many Requests.")),
+        ('rate_limit_eviction_interval', UnsignedInteger32(default=60,
+            help="Interval in seconds between sweeps that drop the rate "
+                 "limit state of idle clients.")),
     ]
 
     def _push_asset_dir_overrides(self, obj):
@@ -442,6 +1720,9 @@ class HttpServer(Server):
     def __init__(self, *args, **kwargs):
         super(HttpServer, self).__init__(*args, **kwargs)
 
+        self.rate_limiter = None
+        self.rate_limit_evictor = None
+
     def gen_site(self):
         from twisted.web.server import Site
 
@@ -489,20 +1770,160 @@ class HttpServer(Server):
             root = TwistedResource()
             root.prepath = b'/'
         else:
-            root = root_app.gen_resource()
+            root = self._gen_subapp_resource(root_app)
 
         for subapp in self._subapps:
             url = subapp.url
             if isinstance(url, six.text_type):
                 url = quote(url).encode('ascii')
             if url != b'':
-                root.putChild(url, subapp.gen_resource())
+                root.putChild(url, self._gen_subapp_resource(subapp))
 
         retval = Site(root)
 
         retval.displayTracebacks = self._parent.debug
+        return self.track_requests(retval)
+
+    def get_threadpool(self):
+        """Returns the thread pool to run wsgi apps in. None means the
+        reactor thread pool."""
+
+        return None
+
+    def _gen_subapp_resource(self, subapp):
+        # StaticFileServer etc. don't take a thread pool. Unbound methods are
+        # created anew on every attribute access in Python 2, so functions
+        # need to be compared instead.
+        gen_resource = six.get_unbound_function(type(subapp).gen_resource)
+        if gen_resource is \
+                     six.get_unbound_function(HttpApplication.gen_resource):
+            retval = subapp.gen_resource(threadpool=self.get_threadpool())
+        else:
+            retval = subapp.gen_resource()
+
+        if subapp.compression is not None:
+            from neurons.daemon.config.compression import TCompressedResource
+            retval = TCompressedResource()(retval, subapp.compression)
+
+        self._instrument_subapp(subapp)
+
+        return retval
+
+    def _instrument_subapp(self, subapp):
+        app = getattr(subapp, 'app', None)
+
+        # wsgi applications wrap the spyne application
+        if not isinstance(app, Application):
+            app = getattr(app, 'app', None)
+
+        if not isinstance(app, Application):
+            return
+
+        if self.metrics:
+            from neurons.daemon.metrics import instrument_application
+            instrument_application(app, subapp.url)
+
+        threshold = getattr(self._parent, 'slow_request_threshold', None)
+        if threshold is not None:
+            from neurons.daemon import slowlog
+            slowlog.instrument_application(app, threshold)
+
+        if self.rate_limits:
+            from neurons.daemon import ratelimit
+            ratelimit.instrument_application(app, self.get_rate_limiter(),
+                                                                    subapp.url)
+
+    def get_subapp_urls(self):
+        retval = set()
+
+        if self.subapps is not None:
+            for url in self.subapps.keys():
+                if isinstance(url, six.text_type):
+                    url = quote(url).encode('ascii')
+                retval.add(url)
+
         return retval
 
+    def get_rate_limiter(self):
+        """Returns the :class:`neurons.daemon.ratelimit.RateLimiter` that
+        enforces :attr:`rate_limits`, creating it when necessary."""
+
+        if self.rate_limiter is None:
+            from neurons.daemon.ratelimit import RateLimiter
+
+            self.rate_limiter = RateLimiter(self.rate_limits,
+                                                      self.get_subapp_urls())
+
+        return self.rate_limiter
+
+    def start_rate_limit_evictor(self):
+        if self.rate_limit_evictor is not None:
+            return
+
+        if not self.rate_limit_eviction_interval:
+            return
+
+        from twisted.internet.task import LoopingCall
+
+        self.rate_limit_evictor = LoopingCall(self.get_rate_limiter().evict)
+        self.rate_limit_evictor.start(self.rate_limit_eviction_interval,
+                                                                     now=False)
+
+    def stop_rate_limit_evictor(self):
+        if self.rate_limit_evictor is not None:
+            if self.rate_limit_evictor.running:
+                self.rate_limit_evictor.stop()
+            self.rate_limit_evictor = None
+
+    def track_requests(self, site):
+        """Makes the given ``twisted.web.server.Site`` report requests to
+        :meth:`request_started` and :meth:`request_finished` so that
+        ``max_pending`` is enforced, and to the metrics registry when
+        :attr:`metrics` is set. Also rejects requests that exceed
+        :attr:`rate_limits`. :meth:`gen_site` does this already."""
+
+        from neurons.daemon.metrics import observe_http_request
+        from neurons.daemon.ratelimit import deny_request
+
+        server = self
+        base = site.requestFactory
+        subapp_urls = self.get_subapp_urls()
+
+        limiter = None
+        if self.rate_limits:
+            limiter = self.get_rate_limiter()
+            self.start_rate_limit_evictor()
+
+        def _observe(_, request, start_t):
+            subapp = u''
+            if request.prepath and request.prepath[0] in subapp_urls:
+                subapp = request.prepath[0].decode('utf8')
+
+            observe_http_request(server.name, subapp, request.code,
+                                                            time() - start_t)
+
+        class PendingTrackingRequest(base):
+            def process(self):
+                if limiter is not None:
+                    wait = limiter.check_request(self)
+                    if wait > 0:
+                        if server.metrics:
+                            self.notifyFinish().addBoth(_observe, self, time())
+                        return deny_request(self, wait)
+
+                server.request_started()
+
+                d = self.notifyFinish()
+                d.addBoth(server.request_finished)
+                if server.metrics:
+                    d.addBoth(_observe, self, time())
+
+                return base.process(self)
+
+        site.requestFactory = PendingTrackingRequest
+
+        return site
+
     @property
     def _subapps(self):
         if self.subapps is not None:
@@ -533,5 +1954,27 @@ class HttpServer(Server):
 
 
 class WsgiServer(HttpServer):
-    thread_min = UnsignedInteger
-    thread_max = UnsignedInteger
+    """An HttpServer that runs its wsgi apps in its own thread pool instead of
+    the reactor thread pool, so that a slow app can't starve others."""
+
+    thread_min = UnsignedInteger(
+        help="Minimum number of threads in the server's thread pool. "
+             "Twisted's default when not set.")
+
+    thread_max = UnsignedInteger(
+        help="Maximum number of threads in the server's thread pool. "
+             "Twisted's default when not set.")
+
+    def __init__(self, *args, **kwargs):
+        super(WsgiServer, self).__init__(*args, **kwargs)
+
+        self.threadpool = None
+
+    def get_threadpool(self):
+        if self.threadpool is None:
+            from neurons.daemon.threadpool import gen_threadpool
+
+            self.threadpool = gen_threadpool('wsgi-%s' % self.name,
+                                       min=self.thread_min, max=self.thread_max)
+
+        return self.threadpool
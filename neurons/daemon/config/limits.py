@@ -173,12 +173,21 @@ class TimedLimits(ComplexModel):
     ]
 
     def apply(self):
+        """Starts the checks. Returns the list of LoopingCall instances that
+        run them."""
+
+        retval = []
+
         for k, v in self.get_flat_type_info(self.__class__).items():
             val = getattr(self, k, None)
             if val is None:
                 continue
 
-            val.apply(k)
+            lc = val.apply(k)
+            if lc is not None:
+                retval.append(lc)
+
+        return retval
 
 
 
@@ -189,7 +198,7 @@ class LimitsChoice(ComplexModel):
         ('timed', TimedLimits.customize(not_wrapped=True)),
     ]
 
-    def apply(self):
+    def apply_rlimits(self):
         # Remember:
         #     soft, hard = resource.getrlimit(whatever)
         SOFT = 0
@@ -201,8 +210,20 @@ class LimitsChoice(ComplexModel):
         if self.hard is not None:
             self.hard.apply(HARD)
 
+    def apply_timed(self):
         if self.timed is not None:
-            self.timed.apply()
+            self.timed_checks = self.timed.apply()
+
+    def stop_timed(self):
+        for lc in getattr(self, 'timed_checks', None) or ():
+            if lc.running:
+                lc.stop()
+
+        self.timed_checks = None
+
+    def apply(self):
+        self.apply_rlimits()
+        self.apply_timed()
 
 
 def enforce_timed_limit(name, limconf, rlimit):
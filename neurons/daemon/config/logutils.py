@@ -107,6 +107,17 @@ class Logger(ComplexModel):
         else:
             logger.info("Logger level override %s = %s", self.path, self.level)
 
+    def reset(self):
+        """Reverts what :meth:`apply` did."""
+
+        if self.path in (None, '', '.'):
+            logging.getLogger().setLevel(logging.WARNING)
+            logger.info("Root logger level reset to WARNING")
+
+        else:
+            logging.getLogger(self.path).setLevel(logging.NOTSET)
+            logger.info("Logger level override %s removed", self.path)
+
 
 def TTwistedHandler(config, loggers, _meminfo, _fdinfo):
     from twisted.logger import LogLevel
@@ -32,16 +32,37 @@
 #
 
 
-from twisted.web.static import File
+import os
+import mmap
+import errno
+
+from collections import OrderedDict
+
+from twisted.web import http, server
+from twisted.web.static import File, getTypeAndEncoding
 from twisted.web.resource import ForbiddenResource
 from twisted.python.filepath import InsecurePath
 
 from spyne.server.twisted.http import get_twisted_child_with_default
 from spyne.util.six.moves.urllib.parse import quote
 
+from neurons.base.assets import IMMUTABLE_CACHE_CONTROL
+from neurons.daemon.config.compression import get_accepted_encodings
+
+
+def TCheckedFile(disallowed_exts, url, fingerprints=None):
+    """Returns a File subclass that refuses to serve files with the given
+    extensions.
+
+    :param fingerprints: A dict that maps absolute paths of fingerprinted
+        files to absolute paths of the actual files, as generated from a
+        manifest by :func:`get_fingerprint_map`. Fingerprinted files are
+        served with an immutable Cache-Control header.
+    """
 
-def TCheckedFile(disallowed_exts, url):
     class CheckedFile(File):
+        immutable = False
+
         def __init__(self, *args, **kwargs):
             File.__init__(self, *args, **kwargs)
 
@@ -50,6 +71,35 @@ def TCheckedFile(disallowed_exts, url):
         def getChildWithDefault(self, path, request):
             return get_twisted_child_with_default(self, path, request)
 
+        def getChild(self, path, request):
+            if not fingerprints:
+                return File.getChild(self, path, request)
+
+            name = path
+            if isinstance(name, bytes):
+                try:
+                    name = name.decode('utf8')
+                except UnicodeDecodeError:
+                    return File.getChild(self, path, request)
+
+            real_path = fingerprints.get(os.path.join(self.path, name), None)
+            if real_path is None:
+                return File.getChild(self, path, request)
+
+            retval = File.getChild(self, os.path.basename(real_path), request)
+            if isinstance(retval, CheckedFile):
+                retval.immutable = True
+
+            return retval
+
+        def render_GET(self, request):
+            if self.immutable:
+                request.setHeader(b'cache-control', IMMUTABLE_CACHE_CONTROL)
+
+            return File.render_GET(self, request)
+
+        render_HEAD = render_GET
+
         def child(self, path):
             retval = File.child(self, path)
 
@@ -61,9 +111,290 @@ def TCheckedFile(disallowed_exts, url):
     return CheckedFile
 
 
-def TStaticFile(disallowed_exts, url):
-    class StaticFile(TCheckedFile(disallowed_exts, url)):
+def TStaticFile(disallowed_exts, url, fingerprints=None):
+    class StaticFile(TCheckedFile(disallowed_exts, url, fingerprints)):
         def directoryListing(self):
             return ForbiddenResource()
 
     return StaticFile
+
+
+def get_fingerprint_map(path, manifest):
+    """Converts the given manifest to the format :func:`TCheckedFile`
+    expects.
+
+    :param path: The directory the manifest was generated from.
+    :param manifest: A dict as returned by
+        :func:`neurons.base.assets.gen_manifest`.
+    """
+
+    retval = {}
+
+    for k, v in manifest.items():
+        retval[os.path.join(path, *v.split('/'))] = \
+                                               os.path.join(path, *k.split('/'))
+
+    return retval
+
+
+PRECOMPRESSED_VARIANTS = (
+    (b'br', '.br'),
+    (b'gzip', '.gz'),
+)
+"""Content encodings that can be served from precompressed sibling files, in
+order of preference."""
+
+MMAP_CHUNK_SIZE = 64 * 1024
+"""Number of bytes written to the transport at once when serving a file that
+is too big to be cached."""
+
+
+class FileCache(object):
+    """A size-bounded LRU cache of file contents, keyed by path. Entries are
+    invalidated when the file's mtime, size or inode changes."""
+
+    def __init__(self, max_size, max_file_size):
+        self.max_size = max_size
+        self.max_file_size = max_file_size
+
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+
+    def get(self, path, stamp):
+        entry = self._entries.pop(path, None)
+
+        if entry is None or entry[0] != stamp:
+            if entry is not None:
+                self.size -= len(entry[1])
+
+            self.misses += 1
+            return None
+
+        # put it back to the end as it's now the most recently used entry
+        self._entries[path] = entry
+        self.hits += 1
+
+        return entry[1]
+
+    def put(self, path, stamp, data):
+        if len(data) > self.max_file_size or len(data) > self.max_size:
+            return
+
+        old = self._entries.pop(path, None)
+        if old is not None:
+            self.size -= len(old[1])
+
+        self._entries[path] = (stamp, data)
+        self.size += len(data)
+
+        while self.size > self.max_size:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class MmapProducer(object):
+    """Writes the given memory map to the request in chunks of
+    :data:`MMAP_CHUNK_SIZE` bytes, whenever the transport asks for more.
+    Closes the map when done."""
+
+    def __init__(self, request, map):
+        self.request = request
+        self.map = map
+        self.size = len(map)
+        self.offset = 0
+
+    def start(self):
+        self.request.registerProducer(self, False)
+
+    def resumeProducing(self):
+        if self.request is None:
+            return
+
+        end = min(self.offset + MMAP_CHUNK_SIZE, self.size)
+        if end > self.offset:
+            self.request.write(self.map[self.offset:end])
+            self.offset = end
+
+        if self.offset >= self.size:
+            self.request.unregisterProducer()
+            self.request.finish()
+            self.stopProducing()
+
+    def pauseProducing(self):
+        pass
+
+    def stopProducing(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+        self.request = None
+
+
+def _get_stamp(st):
+    return st.st_mtime, st.st_size, st.st_ino
+
+
+def _gen_etag(st, suffix):
+    return ('"%x-%x-%x%s"' % (int(st.st_mtime * 1e6), st.st_size, st.st_ino,
+                                                   suffix)).encode('ascii')
+
+
+def _is_not_modified(request, etag, mtime):
+    # If-None-Match takes precedence over If-Modified-Since, see RFC 7232
+    inm = request.getHeader(b'if-none-match')
+    if inm is not None:
+        # If-None-Match uses weak comparison. Responses compressed on the fly
+        # get weak ETags.
+        tags = [t.strip() for t in inm.split(b',')]
+        tags = [t[2:] if t.startswith(b'W/') else t for t in tags]
+        return etag in tags or b'*' in tags
+
+    ims = request.getHeader(b'if-modified-since')
+    if ims is not None:
+        try:
+            return int(mtime) <= http.stringToDatetime(ims.split(b';', 1)[0])
+        except ValueError:
+            return False
+
+    return False
+
+
+def TFastStaticFile(disallowed_exts, url, cache, precompressed=True,
+                                         cache_control=None, fingerprints=None):
+    """Returns a File subclass that caches small files in memory, serves big
+    files from memory maps, serves precompressed siblings of files, and
+    supports conditional requests using strong ETags.
+
+    :param cache: A :class:`FileCache` instance.
+    :param precompressed: Whether to look for ``.br`` and ``.gz`` siblings
+        when the client accepts those encodings.
+    :param cache_control: A dict that maps file extensions (without the dot)
+        to ``Cache-Control`` header values. The value for the ``'*'`` key is
+        used for extensions that are not in the dict. Fingerprinted files are
+        always served with an immutable Cache-Control header.
+    :param fingerprints: See :func:`TCheckedFile`.
+    """
+
+    if cache_control is None:
+        cache_control = {}
+
+    StaticFile = TStaticFile(disallowed_exts, url, fingerprints)
+
+    class FastStaticFile(StaticFile):
+        def _get_variant(self, request):
+            if not precompressed or self.encoding is not None:
+                return self.path, None, ''
+
+            accepted = get_accepted_encodings(request)
+            for encoding, suffix in PRECOMPRESSED_VARIANTS:
+                if not (encoding in accepted):
+                    continue
+
+                path = self.path + suffix
+                if os.path.isfile(path):
+                    return path, encoding, suffix
+
+            return self.path, None, ''
+
+        def _get_cache_control(self):
+            if self.immutable:
+                return IMMUTABLE_CACHE_CONTROL
+
+            ext = self.basename().rsplit('.', 1)[-1]
+            retval = cache_control.get(ext, None)
+            if retval is None:
+                retval = cache_control.get('*', None)
+            return retval
+
+        def render_GET(self, request):
+            self.restat(False)
+
+            # let twisted deal with directories, errors and range requests
+            if not self.exists() or self.isdir() \
+                                     or request.getHeader(b'range') is not None:
+                return StaticFile.render_GET(self, request)
+
+            if self.type is None:
+                self.type, self.encoding = getTypeAndEncoding(
+                    self.basename(),
+                    self.contentTypes,
+                    self.contentEncodings,
+                    self.defaultType,
+                )
+
+            path, encoding, suffix = self._get_variant(request)
+
+            # everything, including the Content-Length header, comes from the
+            # open file so that a file that is replaced or truncated while
+            # we're at it can't make the headers disagree with the body.
+            try:
+                f = open(path, 'rb')
+
+            except (IOError, OSError) as e:
+                if e.errno == errno.EACCES:
+                    return self.forbidden.render(request)
+                raise
+
+            with f:
+                return self._render_file(request, f, encoding, suffix)
+
+        render_HEAD = render_GET
+
+        def _render_file(self, request, f, encoding, suffix):
+            st = os.fstat(f.fileno())
+
+            etag = _gen_etag(st, suffix)
+            request.setHeader(b'etag', etag)
+            request.setHeader(b'last-modified',
+                                            http.datetimeToString(st.st_mtime))
+
+            if precompressed:
+                request.setHeader(b'vary', b'accept-encoding')
+
+            value = self._get_cache_control()
+            if value is not None:
+                request.setHeader(b'cache-control', value)
+
+            if _is_not_modified(request, etag, st.st_mtime):
+                request.setResponseCode(http.NOT_MODIFIED)
+                return b''
+
+            if self.type:
+                request.setHeader(b'content-type', self.type)
+
+            if encoding is not None:
+                request.setHeader(b'content-encoding', encoding)
+            elif self.encoding:
+                request.setHeader(b'content-encoding', self.encoding)
+
+            if request.method == b'HEAD':
+                request.setHeader(b'content-length', b'%d' % st.st_size)
+                return b''
+
+            stamp = _get_stamp(st)
+            data = cache.get(f.name, stamp)
+            if data is None and st.st_size <= cache.max_file_size:
+                data = f.read()
+                cache.put(f.name, stamp, data)
+
+            if data is not None:
+                request.setHeader(b'content-length', b'%d' % len(data))
+                return data
+
+            # Twisted transports don't do sendfile(). A memory map at least
+            # saves us a read() call per chunk.
+            producer = MmapProducer(request,
+                              mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            request.setHeader(b'content-length', b'%d' % producer.size)
+            producer.start()
+
+            return server.NOT_DONE_YET
+
+    return FastStaticFile
@@ -43,7 +43,7 @@ import errno
 from os.path import abspath
 
 from spyne import ComplexModel, Boolean, Unicode, UnsignedInteger16, M, \
-    Decimal, UnsignedInteger
+    Decimal, UnsignedInteger, Double, Array
 from spyne.util import get_version
 
 from neurons.daemon.cli import config_overrides
@@ -146,6 +146,28 @@ class FileStore(StoreInfo):
                 raise
 
 
+class Replica(ComplexModel):
+    """A read replica of a :class:`RelationalStore`. Pool settings that are
+    not set are taken from the store."""
+
+    conn_str = M(Unicode)
+
+    pool_size = UnsignedInteger
+    pool_recycle = UnsignedInteger
+    pool_timeout = UnsignedInteger
+    max_overflow = UnsignedInteger
+
+    def get_engine_kwargs(self, defaults):
+        retval = dict(defaults)
+
+        for k in ('pool_size', 'pool_recycle', 'pool_timeout', 'max_overflow'):
+            v = getattr(self, k)
+            if v is not None:
+                retval[k] = v
+
+        return retval
+
+
 class RelationalStore(StoreInfo):
     # this is not supposed to be mandatory because it's overrideable by cli args
     conn_str = Unicode
@@ -173,6 +195,50 @@ class RelationalStore(StoreInfo):
 
     async_pool = Boolean(default=True)
 
+    async_pool_min = UnsignedInteger(default=1,
+        help="Number of connections the txpostgres pool opens at startup. "
+             "It never shrinks below this.")
+
+    async_pool_max = UnsignedInteger(
+        help="Maximum number of connections of the txpostgres pool. Defaults "
+             "to async_pool_min, which means the pool never grows. With "
+             "async_pool_threaded, this is the number of threads that run "
+             "async queries, which defaults to pool_size.")
+
+    async_pool_threaded = Boolean(default=False,
+        help="txpostgres only supports PostgreSQL, so async_pool is ignored "
+             "for other databases unless this is set. When set, such stores "
+             "get a txpool that runs queries in a dedicated thread pool "
+             "instead.")
+
+    async_pool_grow_threshold = UnsignedInteger(default=1,
+        help="Open a new txpostgres connection when at least this many "
+             "queries are waiting for one.")
+
+    async_pool_idle_timeout = UnsignedInteger(default=60,
+        help="Close txpostgres connections above async_pool_min that were "
+             "idle for this many seconds.")
+
+    prewarm = Boolean(default=False,
+        help="Open pool_size connections per sync pool and async_pool_min "
+             "txpostgres connections at boot and validate them in parallel "
+             "before listeners start accepting connections, so that the "
+             "first requests don't pay for connection setup.")
+
+    replicas = Array(Replica,
+        help="Read replicas. Sessions of read-only contexts are bound to a "
+             "replica, those of write contexts to the primary.")
+
+    replica_policy = Unicode(default='round_robin',
+        values=['round_robin', 'least_checked_out'],
+        help="How to pick the replica for a new read-only session.")
+
+    read_your_writes = Double(
+        help="Bind read-only sessions of a user to the primary for this "
+             "many seconds after that user committed a write, so that they "
+             "see their own writes despite replication lag. Disabled when "
+             "not set.")
+
     def _parse_overrides(self):
         super(RelationalStore, self)._parse_overrides()
 
@@ -217,22 +283,50 @@ class RelationalStore(StoreInfo):
         if get_version('sqlalchemy')[0:2] >= (1, 3):
             kwargs['pool_use_lifo'] = self.pool_use_lifo
 
-        self.itself = SqlDataStore(self.name, self.conn_str, **kwargs)
+        self.itself = SqlDataStore(self.name, self.conn_str, **dict(kwargs))
+
+        if self.sync_pool and self.replicas:
+            for i, replica in enumerate(self.replicas):
+                kwargs['logging_name'] = '%s.replica%d' % (self.name, i)
+                self.itself.add_replica(replica.conn_str,
+                                            **replica.get_engine_kwargs(kwargs))
+
+            self.itself.replica_policy = self.replica_policy
+            self.itself.read_your_writes = self.read_your_writes
 
         if not (self.async_pool or self.sync_pool):
             logger.debug("Store '%s' is disabled.", self.name)
 
+        threaded_txpool = False
         if self.async_pool:
             if self.conn_str.startswith('postgres'):
+                self.itself.txpool_min = self.async_pool_min
+                self.itself.txpool_max = self.async_pool_max
+                self.itself.txpool_grow_threshold = \
+                                                 self.async_pool_grow_threshold
+                self.itself.txpool_idle_timeout = self.async_pool_idle_timeout
+
                 retval = self.itself.add_txpool()
+
+            elif self.async_pool_threaded:
+                threaded_txpool = True
+                retval = self.itself.add_threaded_txpool(
+                                        self.async_pool_max or self.pool_size)
+
             else:
                 self.async_pool = False
 
         if not self.sync_pool:
             self.itself.Session = None
             self.itself.metadata = None
-            self.itself.engine.dispose()
-            self.itself.engine = None
+
+            # the threaded txpool runs its queries on the engine
+            if not threaded_txpool:
+                self.itself.engine.dispose()
+                self.itself.engine = None
+
+        if self.prewarm:
+            retval = self.itself.prewarm(self.pool_size)
 
         return retval
 
@@ -241,9 +335,13 @@ class RelationalStore(StoreInfo):
             self.itself.txpool.close()
 
         if self.sync_pool:
+            self.itself.dispose_replicas()
             self.itself.Session = None
             self.itself.metadata = None
+
+        if self.itself.engine is not None:
             self.itself.engine.dispose()
             self.itself.engine = None
 
+        self.itself.pool_stats.close()
         self.itself = None
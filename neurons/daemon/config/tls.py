@@ -0,0 +1,96 @@
+# encoding: utf8
+#
+# This file is part of the Neurons project.
+# Copyright (c), Arskom Ltd. (arskom.com.tr),
+#                Burak Arslan <burak.arslan@arskom.com.tr>.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of the Arskom Ltd., the neurons project nor the names of
+#   its its contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""Swappable TLS contexts."""
+
+from __future__ import absolute_import
+
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+
+from time import time
+
+from spyne.util import memoize
+
+
+def get_file_stamp(path):
+    """Returns a tuple that changes when the file at the given path is
+    replaced or modified, or None if it can't be stat()'ed."""
+
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+
+    return st.st_mtime, st.st_size, st.st_ino
+
+
+@memoize
+def TTlsConnectionCreator():
+    from zope.interface import implementer
+    from twisted.internet.interfaces import IOpenSSLServerConnectionCreator
+
+    @implementer(IOpenSSLServerConnectionCreator)
+    class TlsConnectionCreator(object):
+        """Creates server-side TLS connections using the current
+        ``CertificateOptions`` instance. Replacing it with :meth:`swap` only
+        affects connections that are accepted afterwards, existing ones keep
+        using the old ``SSL.Context``.
+
+        :param options: A ``twisted.internet.ssl.CertificateOptions``
+            instance.
+        :param stamps: File stamps of the certificate and key files the
+            options were loaded from, as returned by :func:`get_file_stamp`.
+        """
+
+        def __init__(self, options, stamps):
+            self.options = options
+            self.stamps = stamps
+            self.loaded_at = time()
+            self.num_reloads = 0
+
+        def swap(self, options, stamps):
+            self.options = options
+            self.stamps = stamps
+            self.loaded_at = time()
+            self.num_reloads += 1
+
+        def serverConnectionForTLS(self, tlsProtocol):
+            return self.options.serverConnectionForTLS(tlsProtocol)
+
+        def getContext(self):
+            return self.options.getContext()
+
+    return TlsConnectionCreator
@@ -0,0 +1,378 @@
+# encoding: utf8
+#
+# This file is part of the Neurons project.
+# Copyright (c), Arskom Ltd. (arskom.com.tr),
+#                Burak Arslan <burak.arslan@arskom.com.tr>.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of the Arskom Ltd., the neurons project nor the names of
+#   its its contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""Zero-downtime upgrades by handing listening sockets over to a new process.
+
+When the ``handoff`` option is set, a running daemon serves its listening
+sockets over a unix socket whose address is computed from its pid by
+:func:`neurons.daemon.ipc.gen_handoff_address_for_pid`. A new instance with the
+same option finds the old one by looking at who is listening on its tcp
+ports, receives the listening file descriptors with ``SCM_RIGHTS`` and adopts
+them instead of binding new ones. When the new instance is ready to accept
+connections, it tells the old one, which then stops accepting, waits for its
+open connections to finish and exits.
+
+The protocol is line based:
+
+ 1. New: ``SOCKETS``
+ 2. Old: a json list of ``{"type", "host", "port"}`` dicts, along with one
+    file descriptor per list entry, in the same order.
+ 3. New: ``READY``, once it's listening.
+"""
+
+from __future__ import print_function, absolute_import
+
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import json
+import errno
+import socket
+import struct
+
+from array import array
+from time import time
+
+from neurons.daemon.config.endpoint import Server
+
+
+HANDOFF_TIMEOUT = 10
+"""Seconds to wait for the old process to respond."""
+
+HANDOFF_MAX_FDS = 256
+"""Maximum number of file descriptors that can be received."""
+
+DRAIN_CHECK_PERIOD = 0.5
+"""Seconds between checks for open connections while draining."""
+
+_handoff_conn = None
+"""Connection to the old process, kept open until the new one is ready."""
+
+
+def _get_handoff_servers(config):
+    for s in config._services:
+        if not isinstance(s, Server) or s.disabled:
+            continue
+
+        if not s.type.startswith('tcp'):
+            continue
+
+        yield s
+
+
+def _server_key(type, host, port):
+    return type, host, port
+
+
+def _recv_line_and_fds(conn):
+    data = b''
+    fds = []
+
+    try:
+        while not data.endswith(b'\n'):
+            msg, ancdata, flags, addr = conn.recvmsg(4096,
+                                    socket.CMSG_SPACE(HANDOFF_MAX_FDS * 4))
+
+            for level, type_, cdata in ancdata:
+                if level == socket.SOL_SOCKET and type_ == socket.SCM_RIGHTS:
+                    fds.extend(array('i',
+                                       cdata[:len(cdata) - len(cdata) % 4]))
+
+            if len(msg) == 0:
+                raise EOFError("Old process closed the handoff connection")
+
+            data += msg
+
+    except BaseException:
+        _close_fds(fds)
+        raise
+
+    return data, fds
+
+
+def _close_fds(fds):
+    for fd in fds:
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+
+def _take_over_from(pid, servers):
+    from neurons.daemon.ipc import gen_handoff_address_for_pid
+
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.settimeout(HANDOFF_TIMEOUT)
+
+    try:
+        conn.connect(gen_handoff_address_for_pid(pid))
+
+    except socket.error as e:
+        conn.close()
+        if e.errno in (errno.ECONNREFUSED, errno.ENOENT):
+            logger.warning("Process %d listens on our ports but does not "
+                                           "offer socket handoff", pid)
+            return None
+
+        raise
+
+    try:
+        conn.sendall(b'SOCKETS\n')
+        data, fds = _recv_line_and_fds(conn)
+
+        sockets = {}
+        try:
+            entries = json.loads(data.decode('utf8'))
+
+            if len(entries) != len(fds):
+                raise ValueError("Got %d file descriptors for %d sockets" %
+                                                     (len(fds), len(entries)))
+
+            for entry, fd in zip(entries, fds):
+                key = _server_key(entry['type'], entry['host'], entry['port'])
+                server = servers.get(key, None)
+
+                if server is None or key in sockets:
+                    logger.warning("Ignoring socket %s:%s:%s from "
+                                 "process %d", entry['type'], entry['host'],
+                                                           entry['port'], pid)
+                    continue
+
+                skt = socket.fromfd(fd, server.get_address_family(),
+                                                           socket.SOCK_STREAM)
+                sockets[key] = skt
+                skt.setblocking(False)
+
+        except BaseException:
+            for skt in sockets.values():
+                skt.close()
+            raise
+
+        finally:
+            # socket.fromfd() duplicates the file descriptors
+            _close_fds(fds)
+
+    except BaseException:
+        conn.close()
+        raise
+
+    for key, skt in sockets.items():
+        server = servers.pop(key)
+        server.socket = skt
+        logger.info("%s Took over %s from process %d", server.colored_name,
+                                                             server.lstr, pid)
+
+    return conn
+
+
+def take_over_sockets(config):
+    """Receives the listening sockets of the servers in ``config`` from the
+    old process(es) that listen on the same ports and sets them as
+    ``Server.socket``, so that :meth:`Server.listen` adopts them."""
+
+    global _handoff_conn
+
+    from neurons.daemon.ipc import get_pids_for_tcp_port
+
+    if not hasattr(socket.socket, 'recvmsg'):
+        logger.warning("Socket handoff needs Python 3, not taking over")
+        return
+
+    servers = dict((_server_key(s.type, s.host, s.port), s)
+                       for s in _get_handoff_servers(config) if s.socket is None)
+
+    pids = set()
+    for type, host, port in servers:
+        pids.update(get_pids_for_tcp_port(port))
+
+    for pid in sorted(pids):
+        try:
+            conn = _take_over_from(pid, servers)
+
+        except Exception as e:
+            logger.error("Error taking over sockets from process %d: %r",
+                                                                       pid, e)
+            continue
+
+        if conn is not None:
+            if _handoff_conn is not None:
+                logger.warning("Sockets taken over from more than one process, "
+                         "only process %d will be told to exit", pid)
+                _handoff_conn.close()
+
+            _handoff_conn = conn
+
+        if len(servers) == 0:
+            break
+
+
+def handoff_ready():
+    """Tells the old process that the new one is accepting connections."""
+
+    global _handoff_conn
+
+    if _handoff_conn is None:
+        return
+
+    try:
+        _handoff_conn.sendall(b'READY\n')
+        logger.info("Told the old process to stop accepting connections")
+
+    except socket.error as e:
+        logger.error("Error notifying the old process: %r", e)
+
+    _handoff_conn.close()
+    _handoff_conn = None
+
+
+def close_handoff_connection():
+    """Closes the handoff connection without notifying the old process, eg.
+    in pre-fork workers that should not."""
+
+    global _handoff_conn
+
+    if _handoff_conn is not None:
+        _handoff_conn.close()
+        _handoff_conn = None
+
+
+def drain_and_stop(config):
+    """Stops accepting connections, waits for the open ones to be closed for
+    at most ``config.handoff_drain_timeout`` seconds, then stops the
+    reactor."""
+
+    from twisted.internet import reactor
+    from twisted.internet.task import LoopingCall
+
+    servers = []
+    for s in _get_handoff_servers(config):
+        if s.listener is None:
+            continue
+
+        servers.append(s)
+
+        # twisted calls shutdown() on listening sockets it created itself,
+        # which would stop the new process from accepting as well.
+        s.listener._shouldShutdown = False
+        s.unlisten()
+
+    timeout = config.handoff_drain_timeout
+    deadline = time() + timeout
+
+    def _check():
+        num_conns = sum(s.num_connections for s in servers)
+        if num_conns > 0 and time() < deadline:
+            logger.debug("Waiting for %d connection(s) to close", num_conns)
+            return
+
+        if num_conns > 0:
+            logger.warning("Drain timeout of %ds reached with %d open "
+                        "connection(s), stopping anyway", timeout, num_conns)
+        else:
+            logger.info("All connections are closed, stopping")
+
+        lc.stop()
+        reactor.stop()
+
+    logger.info("Handed sockets over, draining connections for at most %ds",
+                                                                      timeout)
+    lc = LoopingCall(_check)
+    lc.start(DRAIN_CHECK_PERIOD)
+
+
+def THandoffProtocol(config):
+    from twisted.protocols.basic import LineOnlyReceiver
+
+    class HandoffProtocol(LineOnlyReceiver):
+        delimiter = b'\n'
+
+        def _get_peer_uid(self):
+            creds = self.transport.getHandle().getsockopt(socket.SOL_SOCKET,
+                                 socket.SO_PEERCRED, struct.calcsize('3i'))
+            pid, uid, gid = struct.unpack('3i', creds)
+            return pid, uid
+
+        def connectionMade(self):
+            pid, uid = self._get_peer_uid()
+            if not (uid in (0, os.getuid())):
+                logger.warning("Refusing socket handoff to process %d "
+                                                       "of uid %d", pid, uid)
+                self.transport.loseConnection()
+                return
+
+            self.peer_pid = pid
+
+        def lineReceived(self, line):
+            if line == b'SOCKETS':
+                entries = []
+                for s in _get_handoff_servers(config):
+                    if s.listener is None:
+                        continue
+
+                    self.transport.sendFileDescriptor(s.listener.fileno())
+                    entries.append(dict(type=s.type, host=s.host,
+                                                                port=s.port))
+
+                logger.info("Handing %d listening socket(s) over to "
+                                      "process %d", len(entries), self.peer_pid)
+                self.sendLine(json.dumps(entries).encode('utf8'))
+
+            elif line == b'READY':
+                logger.info("Process %d is ready", self.peer_pid)
+                self.transport.loseConnection()
+                drain_and_stop(config)
+
+            else:
+                logger.warning("Unknown handoff command %r", line)
+                self.transport.loseConnection()
+
+    return HandoffProtocol
+
+
+def start_handoff_server(config):
+    """Starts offering the listening sockets of this process to its
+    successor."""
+
+    from twisted.internet import reactor
+    from twisted.internet.protocol import Factory
+    from neurons.daemon.ipc import gen_handoff_address_for_pid
+
+    address = gen_handoff_address_for_pid(os.getpid())
+    factory = Factory.forProtocol(THandoffProtocol(config))
+    factory.noisy = False
+
+    retval = reactor.listenUNIX(address, factory)
+    logger.debug("Socket handoff service listening on %r", address)
+
+    return retval
@@ -31,12 +31,22 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 
+import logging
+logger = logging.getLogger(__name__)
+
 import os
+import hmac
 import socket
 import struct
 import psutil
 
-from spyne import rpc, UnsignedInteger16, Unicode
+from time import time
+
+from spyne import rpc, Fault, ComplexModel, Array, Boolean, Double, \
+    Integer32, UnsignedInteger, UnsignedInteger16, UnsignedInteger64, Unicode
+from spyne.error import ResourceNotFoundError, RequestNotAllowed, \
+                                                         InvalidCredentialsError
+
 from neurons.base.service import TReaderService
 
 
@@ -52,6 +62,10 @@ def _gen_addr(base, num):
 
 MGMT_ADDR_BASE =   0x7f0100010400 # 127.1.0.1:1024
 
+MGMT_TOKEN_HEADER = b'x-management-token'
+"""Http header that carries the ``management_token`` of the daemon in calls
+to :class:`DaemonControlServices`."""
+
 
 def gen_mgmt_address_for_pid(pid):
     """Computes management service address from process id.
@@ -111,7 +125,407 @@ def gen_own_mgmt_address():
     return gen_mgmt_address_for_pid(os.getpid())
 
 
+def gen_handoff_address_for_pid(pid):
+    """Computes the address of the listening socket handoff service from
+    process id. It's a unix socket in the abstract namespace, so it's only
+    available on Linux."""
+
+    return '\0neurons-handoff-%d' % pid
+
+
+def get_pids_for_tcp_port(port):
+    """Returns the set of ids of the processes that listen on the given tcp
+    port, except the current one."""
+
+    own_pid = os.getpid()
+
+    return set(conn.pid for conn in psutil.net_connections('tcp')
+                        if conn.status == 'LISTEN' and conn.pid is not None
+                                 and conn.pid != own_pid and conn.laddr[1] == port)
+
+
+class ListenerStats(ComplexModel):
+    name = Unicode
+    type = Unicode
+    host = Unicode
+    port = UnsignedInteger16
+    path = Unicode
+    state = Unicode(values=['disabled', 'failed', 'listening', 'stopped'])
+    connections = UnsignedInteger
+    connections_total = UnsignedInteger64
+    pending = UnsignedInteger
+    rejected = UnsignedInteger64
+    paused = UnsignedInteger64
+    accepting = Boolean
+    datagrams_total = UnsignedInteger64
+    datagrams_dropped = UnsignedInteger64
+    kernel_drops = UnsignedInteger64
+    tls_age = Double
+    tls_reloads = UnsignedInteger
+
+
+class ConnectionPoolStats(ComplexModel):
+    name = Unicode
+    size = Integer32
+    in_use = Integer32
+    idle = Integer32
+    waiting = Integer32
+    checkouts = UnsignedInteger64
+    wait_avg = Double
+    wait_max = Double
+    hold_avg = Double
+    hold_max = Double
+    overflow_max = Integer32
+    timeouts = UnsignedInteger64
+    connects = UnsignedInteger64
+    disconnects = UnsignedInteger64
+    reconnects = UnsignedInteger64
+
+
+class StoreStats(ComplexModel):
+    name = Unicode
+    type = Unicode
+    pool_size = Integer32
+    pool_checked_in = Integer32
+    pool_checked_out = Integer32
+    pool_overflow = Integer32
+    txpool_min = Integer32
+    txpool_size = Integer32
+    pools = Array(ConnectionPoolStats)
+
+
+class ThreadPoolStats(ComplexModel):
+    name = Unicode
+    min = Integer32
+    max = Integer32
+    workers = Integer32
+    working = Integer32
+    waiters = Integer32
+    queue = Integer32
+    tasks = UnsignedInteger64
+    wait_avg = Double
+    wait_max = Double
+
+
+class DaemonStats(ComplexModel):
+    pid = UnsignedInteger
+    worker_id = Integer32
+    rss = UnsignedInteger64
+    num_fds = Integer32
+    threadpool = ThreadPoolStats
+    threadpools = Array(ThreadPoolStats)
+    listeners = Array(ListenerStats)
+    stores = Array(StoreStats)
+
+
+def _call_or_none(obj, name):
+    # not every sqlalchemy pool class implements every statistics method
+    f = getattr(obj, name, None)
+    if f is None:
+        return None
+    return f()
+
+
+def _get_listener_stats(server):
+    tls_age = tls_reloads = None
+
+    creator = getattr(server, 'connection_creator', None)
+    if creator is not None:
+        tls_age = time() - creator.loaded_at
+        tls_reloads = creator.num_reloads
+
+    return ListenerStats(
+        name=server.name,
+        type=server.type,
+        host=server.host,
+        port=server.port,
+        path=server.path,
+        state=server.state,
+        connections=server.num_connections,
+        connections_total=server.num_connections_total,
+        pending=server.num_pending,
+        rejected=server.num_rejected,
+        paused=server.num_paused,
+        accepting=server.listener is not None and not server.paused,
+        datagrams_total=server.num_datagrams_total if server.is_udp else None,
+        datagrams_dropped=server.num_datagrams_dropped
+                                                   if server.is_udp else None,
+        kernel_drops=server.num_kernel_drops,
+        tls_age=tls_age,
+        tls_reloads=tls_reloads,
+    )
+
+
+def get_listener_stats(config):
+    from neurons.daemon.config import Server
+
+    for s in config._services:
+        if not isinstance(s, Server):
+            continue
+
+        yield _get_listener_stats(s)
+
+
+def get_connection_pool_stats(pool_stats):
+    with pool_stats.lock:
+        counters = [(name, c.copy())
+                             for name, c in sorted(pool_stats.counters.items())]
+
+    for name, c in counters:
+        in_use, idle, waiting = pool_stats.get_connection_counts(name)
+
+        size = None
+        if in_use is not None and idle is not None:
+            size = in_use + idle
+
+        yield ConnectionPoolStats(
+            name=name,
+            size=size,
+            in_use=in_use,
+            idle=idle,
+            waiting=waiting,
+            checkouts=c.checkouts,
+            wait_avg=c.wait_avg,
+            wait_max=c.wait_max,
+            hold_avg=c.hold_avg,
+            hold_max=c.hold_max,
+            overflow_max=c.overflow_max,
+            timeouts=c.timeouts,
+            connects=c.connects,
+            disconnects=c.disconnects,
+            reconnects=c.reconnects,
+        )
+
+
+def get_store_stats(config):
+    from neurons.daemon.store import ThreadedTxPool
+
+    stores = getattr(config, 'stores', None)
+    if stores is None:
+        return
+
+    for name, store in stores.items():
+        itself = getattr(store, 'itself', None)
+        retval = StoreStats(name=name, type=getattr(itself, 'type', None))
+
+        engine = getattr(itself, 'engine', None)
+        if engine is not None:
+            pool = engine.pool
+            retval.pool_size = _call_or_none(pool, 'size')
+            retval.pool_checked_in = _call_or_none(pool, 'checkedin')
+            retval.pool_checked_out = _call_or_none(pool, 'checkedout')
+            retval.pool_overflow = _call_or_none(pool, 'overflow')
+
+        # the txpool property complains when accessed from outside the reactor
+        # thread, which is not something we need to care about here.
+        txpool = getattr(itself, '_txpool', None)
+        if isinstance(txpool, ThreadedTxPool):
+            retval.txpool_size = txpool.size
+
+        # connections only has the idle ones, the semaphore limit is the
+        # current size of a txpostgres pool.
+        elif txpool is not None and hasattr(txpool, '_semaphore'):
+            retval.txpool_min = txpool.min
+            retval.txpool_size = txpool._semaphore.limit
+
+        pool_stats = getattr(itself, 'pool_stats', None)
+        if pool_stats is not None:
+            retval.pools = list(get_connection_pool_stats(pool_stats))
+
+        yield retval
+
+
+def _get_threadpool_stats(tp):
+    retval = ThreadPoolStats(
+        name=tp.name,
+        min=tp.min,
+        max=tp.max,
+        workers=tp.workers,
+        working=len(tp.working),
+        waiters=len(tp.waiters),
+        queue=tp._queue.qsize(),
+    )
+
+    # only MeteredThreadPool instances have these
+    if hasattr(tp, 'wait_time_avg'):
+        retval.tasks = tp.num_tasks
+        retval.wait_avg = tp.wait_time_avg
+        retval.wait_max = tp.wait_time_max
+
+    return retval
+
+
+def get_threadpool_stats():
+    from twisted.internet import reactor
+
+    # don't create a thread pool just to report that it's empty
+    tp = getattr(reactor, 'threadpool', None)
+    if tp is None:
+        return None
+
+    return _get_threadpool_stats(tp)
+
+
+def get_server_threadpool_stats(config):
+    for s in config._services:
+        tp = getattr(s, 'threadpool', None)
+        if tp is not None:
+            yield _get_threadpool_stats(tp)
+
+
+def get_daemon_stats(config):
+    proc = psutil.Process()
+
+    return DaemonStats(
+        pid=proc.pid,
+        worker_id=config.worker_id,
+        rss=proc.memory_info().rss,
+        num_fds=proc.num_fds() if hasattr(proc, 'num_fds') else None,
+        threadpool=get_threadpool_stats(),
+        threadpools=list(get_server_threadpool_stats(config)),
+        listeners=list(get_listener_stats(config)),
+        stores=list(get_store_stats(config)),
+    )
+
+
+def _get_server(config, host, port):
+    from neurons.daemon.config import Server
+
+    for s in config._services:
+        if not isinstance(s, Server):
+            continue
+
+        if s.port == port and (host is None or s.host == host):
+            return s
+
+    raise ResourceNotFoundError("%s:%s" % (host, port))
+
+
 class DaemonServices(TReaderService()):
-    @rpc(Unicode, UnsignedInteger16)
-    def unlisten(self, host, port):
-        pass
+    @rpc(_returns=DaemonStats)
+    def stats(ctx):
+        return get_daemon_stats(ctx.app.config)
+
+    @rpc(_returns=Unicode)
+    def health(ctx):
+        """Returns 'OK' when all enabled listeners are listening, responds
+        with a server error otherwise. Meant for load balancer health checks.
+        """
+
+        for l in get_listener_stats(ctx.app.config):
+            if l.state in ('failed', 'stopped'):
+                raise Fault('Server.Unavailable',
+                                           "%s is %s" % (l.name, l.state))
+
+        return u'OK'
+
+
+def _check_control_request(ctx):
+    # The management service is reachable by every local process, including
+    # browsers, so operations that change state need more than a GET request.
+    request = ctx.transport.req
+    if request.method != b'POST':
+        raise RequestNotAllowed("Management operations need a POST request")
+
+    token = request.getHeader(MGMT_TOKEN_HEADER)
+    expected = ctx.app.config.management_token.encode('utf8')
+    if token is None or not hmac.compare_digest(token, expected):
+        raise InvalidCredentialsError("Invalid management token")
+
+
+class DaemonControlServices(TReaderService()):
+    """Management operations that change the state of the daemon. Only
+    served when the ``management_token`` option is set. See
+    :func:`start_management_server`."""
+
+    @rpc(Unicode, UnsignedInteger16(min_occurs=1), _returns=ListenerStats)
+    def listen(ctx, host, port):
+        from neurons.daemon.main import listen_service
+
+        config = ctx.app.config
+        server = _get_server(config, host, port)
+
+        return listen_service(config, server) \
+                         .addCallback(lambda _: _get_listener_stats(server))
+
+    @rpc(Unicode, UnsignedInteger16(min_occurs=1), _returns=ListenerStats)
+    def unlisten(ctx, host, port):
+        server = _get_server(ctx.app.config, host, port)
+
+        return server.unlisten() \
+                         .addCallback(lambda _: _get_listener_stats(server))
+
+    @rpc(Unicode, UnsignedInteger16(min_occurs=1), _returns=ListenerStats)
+    def reload_tls(ctx, host, port):
+        """Loads the certificate and key files of the given SslServer again.
+        New connections use the new TLS context, existing ones are not
+        affected. Only affects the worker that serves the call."""
+
+        from neurons.daemon.config import SslServer
+
+        server = _get_server(ctx.app.config, host, port)
+        if not isinstance(server, SslServer):
+            raise Fault('Client.NotTls', "%s is not a TLS server" % server.name)
+
+        if server.connection_creator is None:
+            raise Fault('Client.NotListening',
+                                       "%s is not listening" % server.name)
+
+        if not server.reload_tls():
+            raise Fault('Server.TlsError', "Error reloading TLS context for "
+                                        "%s, see the log" % server.name)
+
+        return _get_listener_stats(server)
+
+
+def gen_management_resource(config):
+    """Returns the twisted resource that serves :class:`DaemonServices` along
+    with request metrics under ``/metrics``. When the ``management_token``
+    option is set, :class:`DaemonControlServices` are served under
+    ``/control``, only to POST requests that carry the token in the
+    :data:`MGMT_TOKEN_HEADER` header."""
+
+    from spyne import Application
+    from spyne.protocol.http import HttpRpc
+    from spyne.protocol.json import JsonDocument
+    from spyne.server.twisted import TwistedWebResource
+
+    app = Application([DaemonServices], 'neurons.daemon.ipc',
+                        in_protocol=HttpRpc(validator='soft'),
+                        out_protocol=JsonDocument(ignore_wrappers=True))
+    app.config = config
+
+    from neurons.daemon.metrics import TMetricsResource
+
+    retval = TwistedWebResource(app)
+    retval.putChild(b'metrics', TMetricsResource()())
+
+    if config.management_token:
+        control_app = Application([DaemonControlServices],
+                        'neurons.daemon.ipc.control',
+                        in_protocol=HttpRpc(validator='soft'),
+                        out_protocol=JsonDocument(ignore_wrappers=True))
+        control_app.config = config
+        control_app.event_manager.add_listener('method_call',
+                                                         _check_control_request)
+
+        retval.putChild(b'control', TwistedWebResource(control_app))
+
+    return retval
+
+
+def start_management_server(config):
+    """Serves the resource returned by :func:`gen_management_resource` over
+    http on the address returned by :func:`gen_own_mgmt_address`. Call this
+    from the reactor thread. Returns the listening port."""
+
+    from twisted.internet import reactor
+    from twisted.web.server import Site
+
+    host, port = gen_own_mgmt_address()
+    retval = reactor.listenTCP(port, Site(gen_management_resource(config)),
+                                                                 interface=host)
+
+    logger.info("Management service listening on http://%s:%d", host, port)
+
+    return retval
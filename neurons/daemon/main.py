@@ -37,25 +37,24 @@ import logging
 logger = logging.getLogger(__name__)
 
 import os
+import signal
 import threading
 import warnings
 import inspect
 
 from time import time
+from functools import partial
 from os.path import isfile, join, dirname
 
-from colorama import Fore
-
 from spyne.util.six import StringIO
 from spyne.util.color import DARK_R
-from spyne.store.relational.util import database_exists, create_database
-
-from sqlalchemy import MetaData
 
 from neurons import py_start_t
 from neurons.daemon import get_package_version
+from neurons.daemon.bootreport import boot_report
 from neurons.daemon.config import FileStore, ServiceDaemon, \
-    RelationalStore, LdapStore, Server
+    RelationalStore, LdapStore, Server, SslServer
+from neurons.daemon.config._base import get_changed_fields
 
 
 def _print_version(config):
@@ -212,26 +211,224 @@ def _do_start_shell(config):
         return IPython.embed_kernel()
 
 
+def _set_real_factory_after_prewarm(prewarm_deferred, lp, subconfig,
+                                                                      factory):
+    # The kernel queues incoming connections while the server is not
+    # accepting them, which is better than rejecting them as the factory proxy
+    # would do.
+    subconfig.start_warming()
+
+    def _ready(result):
+        _set_real_factory(lp, subconfig, factory)
+        subconfig.stop_warming()
+        return result
+
+    prewarm_deferred.addCallback(_ready)
+
+
 def _set_real_factory(lp, subconfig, factory):
     # lp = listening port -- what endpoint.listen()'s return value ends up as
-    if hasattr(lp.factory, 'wrappedFactory'):
+    if subconfig.is_udp:
+        target_factory = lp.protocol
+        assert isinstance(target_factory, Server.DatagramProxy)
+
+    elif hasattr(lp.factory, 'wrappedFactory'):
         import twisted.protocols.tls
 
         assert isinstance(lp.factory, twisted.protocols.tls.TLSMemoryBIOFactory)
         target_factory = lp.factory.wrappedFactory
+        assert isinstance(target_factory, Server.FactoryProxy)
 
     else:
         target_factory = lp.factory
+        assert isinstance(target_factory, Server.FactoryProxy)
 
+    from colorama import Fore
     subconfig.color = Fore.GREEN
 
-    assert isinstance(target_factory, Server.FactoryProxy)
+    if getattr(subconfig, 'http2', False):
+        from twisted.web.http import HTTPFactory
+
+        if not isinstance(factory, HTTPFactory):
+            logger.warning("%s HTTP/2 is enabled but %r is not an http "
+                      "factory, h2 clients will fail to connect",
+                                                subconfig.colored_name, factory)
+
     target_factory.real_factory = factory
+    subconfig.factory = factory
 
     logger.info("%s Service ready with factory %r",
                                                 subconfig.colored_name, factory)
 
 
+LISTENER_FIELDS = {'host', 'port', 'type', 'backlog', 'disabled', 'path',
+                                                     'mode', 'owner', 'group'}
+"""Server fields that can be changed without a restart."""
+
+ADMISSION_FIELDS = {'max_connections', 'max_accept_rate', 'max_pending'}
+"""Server fields that are applied in place, without even a relisten."""
+
+TLS_FIELDS = {'cacert_path', 'cacert', 'cert', 'key', 'verify', 'verdepth',
+              'http2', 'session_cache', 'session_timeout', 'session_tickets',
+                                'tls_context_lifetime', 'tls_check_interval'}
+"""SslServer fields that are applied by swapping the TLS context for new
+connections."""
+
+
+def listen_service(config, subconfig):
+    """Starts listening on an already configured, currently not listening
+    server service. Initializes the service first if it was disabled at boot.
+    Returns a Deferred that fires once the service is ready."""
+
+    from twisted.internet.defer import succeed
+
+    if subconfig.listener is not None:
+        return succeed(subconfig.listener)
+
+    factory = subconfig.factory
+
+    # services that were disabled at boot were never initialized
+    if factory is None:
+        service_def = (config.service_defs or {}).get(subconfig.name, None)
+        if service_def is None:
+            logger.error("%s Service definition not found, can't enable",
+                                                         subconfig.colored_name)
+            return succeed(None)
+
+        factory = service_def.init(config)
+
+    def _cb_listen(lp):
+        if lp is not None:
+            _set_real_factory(lp, subconfig, factory)
+        return lp
+
+    return subconfig.listen(exit_on_error=False).addCallback(_cb_listen)
+
+
+def _relisten(config, subconfig, values):
+    d = subconfig.unlisten()
+
+    for k, v in values.items():
+        setattr(subconfig, k, v)
+
+    if subconfig.disabled:
+        logger.info("%s Service disabled.", DARK_R('[%s]' % (subconfig.name,)))
+        return d
+
+    return d.addCallback(lambda _: listen_service(config, subconfig)) \
+            .addErrback(lambda err: logger.error("%s Error reloading service: "
+                               "%s", subconfig.colored_name, err.getTraceback()))
+
+
+def _reload_services(config, new):
+    dl = []
+
+    for k, new_subconfig in new.services.items():
+        subconfig = config.services.get(k, None)
+        if subconfig is None:
+            logger.warning("%s New service needs a restart to be "
+                                                    "initialized", DARK_R(k))
+            continue
+
+        changed = get_changed_fields(subconfig, new_subconfig)
+
+        if isinstance(subconfig, SslServer):
+            tls = changed & TLS_FIELDS
+            for f in tls:
+                setattr(subconfig, f, getattr(new_subconfig, f))
+
+            # SIGHUP also picks up renewed certificates
+            if len(tls) > 0 or subconfig.tls_files_changed():
+                logger.info("%s Reloading TLS context, changed: %s",
+                                           subconfig.colored_name, sorted(tls))
+                subconfig.reload_tls()
+
+            changed -= tls
+
+        if len(changed) == 0:
+            continue
+
+        if not isinstance(subconfig, Server) or '*' in changed:
+            logger.warning("%s Service changes need a restart: %s",
+                                     subconfig.colored_name, sorted(changed))
+            continue
+
+        admission = changed & ADMISSION_FIELDS
+        if len(admission) > 0:
+            for f in admission:
+                setattr(subconfig, f, getattr(new_subconfig, f))
+
+            logger.info("%s Applied admission limit changes: %s",
+                                     subconfig.colored_name, sorted(admission))
+
+            subconfig.resume_accepting()
+            changed -= admission
+
+
+        if len(changed - LISTENER_FIELDS) > 0:
+            logger.warning("%s Service changes need a restart: %s",
+                   subconfig.colored_name, sorted(changed - LISTENER_FIELDS))
+
+        changed &= LISTENER_FIELDS
+        if len(changed) == 0:
+            continue
+
+        if config.worker_id is not None:
+            logger.warning("%s Listener changes need a restart in pre-fork "
+                                         "mode: %s", subconfig.colored_name,
+                                                                 sorted(changed))
+            continue
+
+        logger.info("%s Applying listener changes: %s",
+                                         subconfig.colored_name, sorted(changed))
+
+        dl.append(_relisten(config, subconfig,
+                          dict((f, getattr(new_subconfig, f)) for f in changed)))
+
+    for k, subconfig in config.services.items():
+        if k in new.services or subconfig.disabled:
+            continue
+
+        logger.info("%s Service removed from config file",
+                                                         subconfig.colored_name)
+        if isinstance(subconfig, Server):
+            dl.append(_relisten(config, subconfig, dict(disabled=True)))
+
+    return dl
+
+
+def _reload_config(config):
+    """Parses the config file again and applies the changes to loggers,
+    limits and listeners to the running daemon. Everything else is left as it
+    is. Returns a DeferredList that fires when listeners are (re)started."""
+
+    from twisted.internet.defer import DeferredList, succeed
+
+    logger.info("%s Reloading configuration from '%s'", config.name,
+                                                             config.config_file)
+
+    try:
+        new = config.reparse_config()
+
+    except Exception as e:
+        logger.error("Error parsing '%s', keeping the current configuration",
+                                                             config.config_file)
+        logger.exception(e)
+        return succeed(None)
+
+    config.reload_loggers(new)
+    config.reload_limits(new)
+    dl = _reload_services(config, new)
+
+    changed = get_changed_fields(config, new) \
+                                         - {'loggers', 'limits', 'services'}
+    if len(changed) > 0:
+        logger.warning("%s Changes need a restart: %s", config.name,
+                                                                sorted(changed))
+
+    return DeferredList(dl)
+
+
 def _inner_main(config, init, bootstrap, bootstrapper):
     # if requested, print version and exit
     if config.version:
@@ -271,11 +468,20 @@ def _inner_main(config, init, bootstrap, bootstrapper):
         else:
             logger.debug('No sql data store configured.')
 
+    # services start accepting connections once database connections are warm
+    set_real_factory = _set_real_factory
+    if config.prewarm_deferred is not None:
+        set_real_factory = partial(_set_real_factory_after_prewarm,
+                                                    config.prewarm_deferred)
+
     # initialize applications
     items = init(config)
     if hasattr(items, 'items'):  # if it's a dict
         items = items.items()
 
+    items = list(items)
+    config.service_defs = dict(items)
+
     # apply app-specific config
     for k, v in items:
         disabled = False
@@ -323,21 +529,22 @@ def _inner_main(config, init, bootstrap, bootstrapper):
             logger.info("%s Service disabled.", DARK_R('[%s]' % (k,)))
             continue
 
-        factory = v.init(config)
+        with boot_report.phase('init:%s' % (k,)):
+            factory = v.init(config)
 
         if not isinstance(subconfig, Server):
             continue
 
         if subconfig.d is not None:
             if subconfig.listener is None:
-                subconfig.d.addCallback(_set_real_factory, subconfig, factory)
+                subconfig.d.addCallback(set_real_factory, subconfig, factory)
 
             else:
-                _set_real_factory(subconfig.listener, subconfig, factory)
+                set_real_factory(subconfig.listener, subconfig, factory)
 
         elif not subconfig.disabled:
             subconfig.listen() \
-                .addCallback(_set_real_factory, subconfig, factory)
+                .addCallback(set_real_factory, subconfig, factory)
 
     # if requested, write interface documents and exit
     if isinstance(config, ServiceDaemon):
@@ -354,7 +561,8 @@ def _inner_main(config, init, bootstrap, bootstrapper):
     if not config.skip_migration:
         # Perform schema migrations
         from neurons.version import Version
-        Version.migrate_all(config)
+        with boot_report.phase('migrate_all'):
+            Version.migrate_all(config)
 
     # if requested, drop to shell
     if config.shell or config.ikernel:
@@ -367,6 +575,8 @@ class Bootstrapper(object):
     """Creates all databases"""
 
     def __init__(self, init):
+        from sqlalchemy import MetaData
+
         self.init = init
         self.meta_reflect = MetaData()
 
@@ -377,6 +587,9 @@ class Bootstrapper(object):
         pass
 
     def create_relational(self, store):
+        from spyne.store.relational.util import database_exists, \
+                                                                create_database
+
         if database_exists(store.conn_str):
             print(store.conn_str, "already exists.")
             return
@@ -447,7 +660,8 @@ def _set_reactor_thread():
 def _compile_mappers():
     logger.info("Compiling object mappers...")
     from sqlalchemy.orm import compile_mappers
-    compile_mappers()
+    with boot_report.phase('compile_mappers'):
+        compile_mappers()
 
 
 def boot(config_name, argv, init, bootstrap=None,
@@ -469,7 +683,9 @@ def boot(config_name, argv, init, bootstrap=None,
         daemon.
     """
 
-    config = cls.parse_config(config_name, argv)
+    with boot_report.phase('parse_config'):
+        config = cls.parse_config(config_name, argv)
+
     if config.help:
         from neurons.daemon.cli import spyne_to_argparse
 
@@ -502,37 +718,40 @@ def boot(config_name, argv, init, bootstrap=None,
             return retcode, config
 
     finally:
-        if not isfile(config.config_file):
-            config.do_write_config()
-            logger.info("Writing configuration to: '%s'", config.config_file)
-
-        elif has_services and services != config._services:
-            config.do_write_config()
-            logger.info("Updating configuration file because "
+        # in pre-fork mode, only the first worker updates the config file.
+        if config.worker_id is None or config.worker_id == 0:
+            if not isfile(config.config_file):
+                config.do_write_config()
+                logger.info("Writing configuration to: '%s'",
+                                                            config.config_file)
+
+            elif has_services and services != config._services:
+                config.do_write_config()
+                logger.info("Updating configuration file because "
                                                    "new services were detected")
 
-        elif has_stores and stores != config._stores:
-            config.do_write_config()
-            logger.info(
-                "Updating configuration file because new stores were detected")
+            elif has_stores and stores != config._stores:
+                config.do_write_config()
+                logger.info("Updating configuration file because "
+                                                     "new stores were detected")
 
-        # FIXME: could someone need these during bootstrap above?
-        if config.uuid is None:
-            config.uuid = config.gen_uuid()
-            config.do_write_config()
-            logger.info("Updating configuration file because "
+            # FIXME: could someone need these during bootstrap above?
+            if config.uuid is None:
+                config.uuid = config.gen_uuid()
+                config.do_write_config()
+                logger.info("Updating configuration file because "
                                                        "new uuid was generated")
 
-        if config.secret is None:
-            config.secret = config.gen_secret()
-            config.do_write_config()
-            logger.info("Updating configuration file because "
+            if config.secret is None:
+                config.secret = config.gen_secret()
+                config.do_write_config()
+                logger.info("Updating configuration file because "
                                                      "new secret was generated")
 
     return None, config
 
 
-def _log_ready(config_name, orig_stack, py_start_t, func_start_t):
+def _log_ready(config, config_name, orig_stack, py_start_t, func_start_t):
     import resource
 
     try:
@@ -562,6 +781,27 @@ def _log_ready(config_name, orig_stack, py_start_t, func_start_t):
         time() - func_start_t,
     )
 
+    boot_report.log()
+
+    if config.autoreload:
+        from neurons.daemon.autoreload import log_reload_latency
+        log_reload_latency()
+
+    if config.handoff:
+        from neurons.daemon.handoff import handoff_ready
+        handoff_ready()
+
+    if config.boot_report is not None:
+        file_name = config.boot_report
+        if config.worker_id is not None:
+            file_name = '%s.%d' % (file_name, config.worker_id)
+
+        try:
+            boot_report.write(file_name, name=config.name,
+                                                   worker_id=config.worker_id)
+        except (IOError, OSError) as e:
+            logger.error("Error writing boot report to '%s': %r", file_name, e)
+
 
 def main(config_name, argv, init, bootstrap=None,
                 bootstrapper=Bootstrapper, cls=ServiceDaemon, daemon_name=None):
@@ -601,23 +841,36 @@ def main(config_name, argv, init, bootstrap=None,
     deferLater(reactor, 0, _set_reactor_thread) \
         .addErrback(lambda err: logger.error("%s", err.getTraceback()))
 
-    deferLater(reactor, 0, _log_ready,
+    deferLater(reactor, 0, _log_ready, config,
                        config_name, inspect.stack(), py_start_t, func_start_t) \
         .addErrback(lambda err: logger.error("%s", err.getTraceback()))
 
     # this needs to be done as late as possible to capture the highest number of
     # watched (ie imported) modules.
     if config.autoreload:
-        from spyne.util.autorel import AutoReloader
-        frequency = 0.5
-        autorel = AutoReloader(frequency=frequency)
-        assert autorel.start() is not None
-        num_files = len(autorel.sysfiles() | autorel.files)
-        logger.info("Auto reloader init success: Watching %d files "
-                                    "every %g second(s).", num_files, frequency)
+        from neurons.daemon.autoreload import start_autoreloader
+        start_autoreloader()
 
     if config.dry_run:
         return 0
 
+    if config.handoff:
+        if config.worker_id is None:
+            from neurons.daemon.handoff import start_handoff_server
+            start_handoff_server(config)
+
+        elif config.worker_id == 0:
+            logger.warning("Listening sockets can't be handed over to a new "
+                                                "instance in pre-fork mode.")
+
+    if config.management:
+        from neurons.daemon.ipc import start_management_server
+        start_management_server(config)
+
+    # the pre-fork supervisor relays SIGHUP to workers
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda signum, frame:
+                                 reactor.callFromThread(_reload_config, config))
+
     logger.debug("Starting reactor.")
     return reactor.run()
@@ -0,0 +1,341 @@
+# encoding: utf8
+#
+# This file is part of the Neurons project.
+# Copyright (c), Arskom Ltd. (arskom.com.tr),
+#                Burak Arslan <burak.arslan@arskom.com.tr>.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of the Arskom Ltd., the neurons project nor the names of
+#   its its contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""Request counters and latency histograms, exported in the Prometheus text
+format.
+
+Metrics are kept per process. In pre-fork mode, every worker has its own
+management port that serves its own metrics under ``/metrics``.
+"""
+
+from __future__ import absolute_import
+
+import logging
+logger = logging.getLogger(__name__)
+
+from bisect import bisect_left
+from threading import Lock
+from weakref import WeakKeyDictionary
+
+from spyne.util import memoize
+
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+"""Upper bounds of latency histogram buckets, in seconds."""
+
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+"""Upper bounds of histogram buckets for small counts."""
+
+CONTENT_TYPE = b'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(s):
+    return s.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = ['%s="%s"' % (k, _escape(v)) for k, v in zip(names, values)]
+    if extra is not None:
+        pairs.append(extra)
+
+    if len(pairs) == 0:
+        return ''
+
+    return '{%s}' % ','.join(pairs)
+
+
+def _format_float(f):
+    if f == float('inf'):
+        return '+Inf'
+    return repr(float(f))
+
+
+class Counter(object):
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def render(self, name, label_str):
+        yield '%s%s %d' % (name, label_str, self.value)
+
+
+class Gauge(object):
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def render(self, name, label_str):
+        yield '%s%s %s' % (name, label_str, _format_float(self.value))
+
+
+class Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self, name, label_str):
+        # label_str is either empty or looks like '{a="b"}'
+        prefix = label_str[:-1] + ',' if label_str else '{'
+
+        total = 0
+        for le, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield '%s_bucket%sle="%s"} %d' % (name, prefix, _format_float(le),
+                                                                         total)
+
+        yield '%s_sum%s %s' % (name, label_str, _format_float(self.sum))
+        yield '%s_count%s %d' % (name, label_str, total)
+
+
+class MetricFamily(object):
+    """A metric with a fixed set of label names. Call :meth:`labels` to get
+    the :class:`Counter` or :class:`Histogram` instance for a given set of
+    label values. Callers need to hold :attr:`Registry.lock`."""
+
+    def __init__(self, name, help, type, label_names, factory):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.label_names = label_names
+
+        self._factory = factory
+        self._children = {}
+
+    def labels(self, *values):
+        retval = self._children.get(values, None)
+        if retval is None:
+            retval = self._children[values] = self._factory()
+
+        return retval
+
+    def remove(self, *values):
+        """Forgets the child for the given label values, if any."""
+
+        self._children.pop(values, None)
+
+    def render(self):
+        yield '# HELP %s %s' % (self.name, self.help)
+        yield '# TYPE %s %s' % (self.name, self.type)
+
+        for values, child in sorted(self._children.items()):
+            label_str = _format_labels(self.label_names, values)
+            for line in child.render(self.name, label_str):
+                yield line
+
+
+class Registry(object):
+    def __init__(self):
+        self.families = []
+
+        self.lock = Lock()
+        """Spyne methods of wsgi apps finish in worker threads, so every
+        update needs to hold this."""
+
+        self.collectors = []
+        """Callables that update gauges right before the metrics are
+        rendered. They need to take :attr:`lock` themselves and should be
+        removed when what they report on goes away."""
+
+    def counter(self, name, help, label_names=()):
+        retval = MetricFamily(name, help, 'counter', label_names, Counter)
+        self.families.append(retval)
+        return retval
+
+    def gauge(self, name, help, label_names=()):
+        retval = MetricFamily(name, help, 'gauge', label_names, Gauge)
+        self.families.append(retval)
+        return retval
+
+    def histogram(self, name, help, label_names=(), buckets=DEFAULT_BUCKETS):
+        buckets = tuple(buckets)
+        retval = MetricFamily(name, help, 'histogram', label_names,
+                                                    lambda: Histogram(buckets))
+        self.families.append(retval)
+        return retval
+
+    def render(self):
+        """Returns all metrics in the Prometheus text format, as bytes."""
+
+        for collector in self.collectors:
+            collector()
+
+        lines = []
+        with self.lock:
+            for family in self.families:
+                lines.extend(family.render())
+
+        lines.append('')
+
+        return '\n'.join(lines).encode('utf8')
+
+
+registry = Registry()
+
+http_requests = registry.counter('neurons_http_requests_total',
+    "Number of http requests, per server, subapp and status code.",
+    ('server', 'subapp', 'code'))
+
+http_request_duration = registry.histogram(
+    'neurons_http_request_duration_seconds',
+    "Time between receiving an http request and sending the last byte of "
+    "the response.", ('server', 'subapp'))
+
+method_calls = registry.counter('neurons_method_calls_total',
+    "Number of spyne method calls.", ('subapp', 'method'))
+
+method_errors = registry.counter('neurons_method_errors_total',
+    "Number of spyne method calls that resulted in an error.",
+    ('subapp', 'method'))
+
+method_duration = registry.histogram('neurons_method_duration_seconds',
+    "Time spent processing spyne method calls, including serialization.",
+    ('subapp', 'method'))
+
+
+pool_checkout_wait = registry.histogram(
+    'neurons_db_pool_checkout_wait_seconds',
+    "Time spent waiting for a database connection.", ('store', 'pool'))
+
+pool_hold = registry.histogram('neurons_db_pool_hold_seconds',
+    "Time a database connection stayed checked out.", ('store', 'pool'))
+
+pool_overflow = registry.histogram('neurons_db_pool_overflow',
+    "Number of overflow connections in use, sampled at every checkout.",
+    ('store', 'pool'), buckets=COUNT_BUCKETS)
+
+pool_timeouts = registry.counter('neurons_db_pool_timeouts_total',
+    "Number of checkouts that timed out.", ('store', 'pool'))
+
+pool_connects = registry.counter('neurons_db_pool_connects_total',
+    "Number of database connections opened.", ('store', 'pool'))
+
+pool_disconnects = registry.counter('neurons_db_pool_disconnects_total',
+    "Number of database connections found to be broken.", ('store', 'pool'))
+
+pool_reconnects = registry.counter('neurons_db_pool_reconnects_total',
+    "Number of broken database connections that recovered.",
+    ('store', 'pool'))
+
+pool_connections = registry.gauge('neurons_db_pool_connections',
+    "Number of pooled database connections, in use or idle.",
+    ('store', 'pool', 'state'))
+
+pool_size = registry.gauge('neurons_db_pool_size',
+    "Number of pooled database connections.", ('store', 'pool'))
+
+pool_waiting = registry.gauge('neurons_db_pool_waiting',
+    "Number of requests waiting for a database connection.",
+    ('store', 'pool'))
+
+
+def observe_http_request(server, subapp, code, duration):
+    with registry.lock:
+        http_requests.labels(server, subapp, str(code)).inc()
+        http_request_duration.labels(server, subapp).observe(duration)
+
+
+UNKNOWN_METHOD = '<unknown>'
+
+
+def get_method_name(ctx):
+    """Returns the name of the method that was called in the given context.
+
+    The requested method name comes from the client, so it is only trusted
+    once it resolves to a method descriptor. Otherwise, ``UNKNOWN_METHOD`` is
+    returned so that clients can't create arbitrarily many label sets."""
+
+    if ctx.descriptor is None:
+        return UNKNOWN_METHOD
+
+    return ctx.descriptor.name
+
+
+def _on_method_context_closed(subapp, ctx):
+    method = get_method_name(ctx)
+    duration = ctx.call_end - ctx.call_start
+
+    with registry.lock:
+        method_calls.labels(subapp, method).inc()
+        method_duration.labels(subapp, method).observe(duration)
+        if ctx.out_error is not None:
+            method_errors.labels(subapp, method).inc()
+
+
+_instrumented = WeakKeyDictionary()
+
+
+def instrument_application(app, subapp):
+    """Records calls to the methods of the given spyne application under the
+    given subapp label. Does nothing if the application was instrumented
+    before."""
+
+    if app in _instrumented:
+        return
+
+    if isinstance(subapp, bytes):
+        subapp = subapp.decode('utf8')
+
+    def _cb(ctx):
+        _on_method_context_closed(subapp, ctx)
+
+    app.event_manager.add_listener('method_context_closed', _cb)
+    _instrumented[app] = subapp
+
+
+@memoize
+def TMetricsResource():
+    from twisted.web.resource import Resource
+
+    class MetricsResource(Resource):
+        """Serves the metrics in the given registry."""
+
+        isLeaf = True
+
+        def __init__(self, registry=registry):
+            Resource.__init__(self)
+            self.registry = registry
+
+        def render_GET(self, request):
+            request.setHeader(b'content-type', CONTENT_TYPE)
+            return self.registry.render()
+
+    return MetricsResource
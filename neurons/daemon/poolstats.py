@@ -0,0 +1,347 @@
+# encoding: utf8
+#
+# This file is part of the Neurons project.
+# Copyright (c), Arskom Ltd. (arskom.com.tr),
+#                Burak Arslan <burak.arslan@arskom.com.tr>.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of the Arskom Ltd., the neurons project nor the names of
+#   its its contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""Connection pool telemetry for :class:`neurons.daemon.store.SqlDataStore`.
+
+Every store has a :class:`PoolStats` instance that keeps one
+:class:`PoolCounters` per pool. The primary SQLAlchemy pool is called
+``sync``, replica pools are called ``replica0``, ``replica1``, etc. and the
+txpool is called ``async``. Every observation also goes to the metrics
+registry, see :mod:`neurons.daemon.metrics`.
+"""
+
+from __future__ import absolute_import
+
+import logging
+logger = logging.getLogger(__name__)
+
+from time import time
+from threading import Lock
+
+from neurons.daemon import metrics
+
+
+class PoolCounters(object):
+    """Cumulative statistics of a single connection pool."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.checkins = 0
+        self.hold_total = 0.0
+        self.hold_max = 0.0
+        self.overflow_max = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.disconnects = 0
+        self.reconnects = 0
+
+        # maximums since the last PoolStats.log() call
+        self.recent_wait_max = 0.0
+        self.recent_hold_max = 0.0
+        self.recent_overflow_max = 0
+
+    @property
+    def wait_avg(self):
+        if self.checkouts == 0:
+            return 0.0
+        return self.wait_total / self.checkouts
+
+    @property
+    def hold_avg(self):
+        if self.checkins == 0:
+            return 0.0
+        return self.hold_total / self.checkins
+
+    def copy(self):
+        retval = PoolCounters()
+        retval.__dict__.update(self.__dict__)
+        return retval
+
+
+class PoolStats(object):
+    def __init__(self, store_name):
+        self.store_name = store_name
+        self.lock = Lock()
+
+        self.counters = {}
+        """Maps pool names to :class:`PoolCounters` instances."""
+
+        self.connection_getters = {}
+        """Maps pool names to callables that return the number of
+        connections in use, the number of idle connections and the number
+        of requests waiting for a connection."""
+
+        self._last_logged = {}
+
+        metrics.registry.collectors.append(self.collect)
+
+    def close(self):
+        """Stops reporting connection counts of the store's pools.
+        Cumulative counters are kept, as a store with the same name picks
+        them up where this one left off."""
+
+        if self.collect in metrics.registry.collectors:
+            metrics.registry.collectors.remove(self.collect)
+
+        with metrics.registry.lock:
+            for pool in self.connection_getters:
+                for state in ('in_use', 'idle'):
+                    metrics.pool_connections \
+                                         .remove(self.store_name, pool, state)
+                metrics.pool_waiting.remove(self.store_name, pool)
+                metrics.pool_size.remove(self.store_name, pool)
+
+        self.connection_getters.clear()
+
+    def _get_counters(self, pool):
+        retval = self.counters.get(pool, None)
+        if retval is None:
+            retval = self.counters[pool] = PoolCounters()
+        return retval
+
+    def observe_checkout(self, pool, wait, overflow=None):
+        with self.lock:
+            c = self._get_counters(pool)
+            c.checkouts += 1
+            c.wait_total += wait
+            if wait > c.wait_max:
+                c.wait_max = wait
+            if wait > c.recent_wait_max:
+                c.recent_wait_max = wait
+            if overflow is not None:
+                if overflow > c.overflow_max:
+                    c.overflow_max = overflow
+                if overflow > c.recent_overflow_max:
+                    c.recent_overflow_max = overflow
+
+        with metrics.registry.lock:
+            metrics.pool_checkout_wait.labels(self.store_name, pool) \
+                                                                 .observe(wait)
+            if overflow is not None:
+                metrics.pool_overflow.labels(self.store_name, pool) \
+                                                             .observe(overflow)
+
+    def observe_checkin(self, pool, hold):
+        with self.lock:
+            c = self._get_counters(pool)
+            c.checkins += 1
+            c.hold_total += hold
+            if hold > c.hold_max:
+                c.hold_max = hold
+            if hold > c.recent_hold_max:
+                c.recent_hold_max = hold
+
+        with metrics.registry.lock:
+            metrics.pool_hold.labels(self.store_name, pool).observe(hold)
+
+    def inc(self, pool, name):
+        """Increments one of the ``timeouts``, ``connects``, ``disconnects``
+        or ``reconnects`` counters of the given pool."""
+
+        with self.lock:
+            c = self._get_counters(pool)
+            setattr(c, name, getattr(c, name) + 1)
+
+        family = getattr(metrics, 'pool_' + name)
+        with metrics.registry.lock:
+            family.labels(self.store_name, pool).inc()
+
+    def get_connection_counts(self, pool):
+        getter = self.connection_getters.get(pool, None)
+        if getter is None:
+            return None, None, None
+
+        return getter()
+
+    def collect(self):
+        counts = [(pool, self.get_connection_counts(pool))
+                                            for pool in self.connection_getters]
+
+        with metrics.registry.lock:
+            for pool, (in_use, idle, waiting) in counts:
+                metrics.pool_connections \
+                  .labels(self.store_name, pool, 'in_use').set(in_use or 0)
+                metrics.pool_connections \
+                  .labels(self.store_name, pool, 'idle').set(idle or 0)
+                metrics.pool_waiting \
+                  .labels(self.store_name, pool).set(waiting or 0)
+                metrics.pool_size \
+                  .labels(self.store_name, pool) \
+                  .set(_get_size(in_use, idle) or 0)
+
+    def instrument_engine(self, engine, pool):
+        """Records checkout waits, hold times, overflow usage, timeouts and
+        connection failures of the given SQLAlchemy engine's pool."""
+
+        from sqlalchemy import event
+        from sqlalchemy.exc import TimeoutError
+
+        # there is no event before a checkout, so we need to wrap the pool's
+        # connect methods to measure how long checkouts wait.
+        # Engine.raw_connection() uses unique_connection() in older
+        # SQLAlchemy versions. Engine.dispose() replaces the pool, so the new
+        # one is wrapped again.
+        def wrap(connect):
+            def timed_connect():
+                start_t = time()
+                try:
+                    return connect()
+
+                except TimeoutError:
+                    self.inc(pool, 'timeouts')
+                    raise
+
+                finally:
+                    self.observe_checkout(pool, time() - start_t,
+                                                    _get_overflow(engine.pool))
+
+            return timed_connect
+
+        def wrap_pool(sqla_pool):
+            sqla_pool.connect = wrap(sqla_pool.connect)
+            if hasattr(sqla_pool, 'unique_connection'):
+                sqla_pool.unique_connection = \
+                                         wrap(sqla_pool.unique_connection)
+
+        def on_engine_disposed(engine):
+            wrap_pool(engine.pool)
+
+        wrap_pool(engine.pool)
+
+        def on_checkout(dbapi_connection, connection_record, connection_proxy):
+            connection_record.info['neurons.checkout_t'] = time()
+
+        def on_checkin(dbapi_connection, connection_record):
+            start_t = connection_record.info.pop('neurons.checkout_t', None)
+            if start_t is not None:
+                self.observe_checkin(pool, time() - start_t)
+
+        # record_info, unlike info, survives reconnects of the same record
+        def on_connect(dbapi_connection, connection_record):
+            self.inc(pool, 'connects')
+            if connection_record.record_info \
+                                       .pop('neurons.invalidated', False):
+                self.inc(pool, 'reconnects')
+
+        def on_invalidate(dbapi_connection, connection_record, exception):
+            self.inc(pool, 'disconnects')
+            connection_record.record_info['neurons.invalidated'] = True
+
+        def on_soft_invalidate(dbapi_connection, connection_record,
+                                                                   exception):
+            connection_record.record_info['neurons.invalidated'] = True
+
+        # pool events listened on an engine go to its pool, which passes them
+        # on to the pool that Engine.dispose() replaces it with.
+        event.listen(engine, 'engine_disposed', on_engine_disposed)
+        event.listen(engine, 'checkout', on_checkout)
+        event.listen(engine, 'checkin', on_checkin)
+        event.listen(engine, 'connect', on_connect)
+        event.listen(engine, 'invalidate', on_invalidate)
+        event.listen(engine, 'soft_invalidate', on_soft_invalidate)
+
+        def get_connection_counts():
+            p = engine.pool
+            return _call_or_none(p, 'checkedout'), \
+                                          _call_or_none(p, 'checkedin'), None
+
+        self.connection_getters[pool] = get_connection_counts
+
+    def log(self):
+        """Logs what happened in every pool since the last call."""
+
+        with self.lock:
+            snapshot = [(pool, c.copy())
+                                   for pool, c in sorted(self.counters.items())]
+
+            for c in self.counters.values():
+                c.recent_wait_max = c.recent_hold_max = 0.0
+                c.recent_overflow_max = 0
+
+        for pool, c in snapshot:
+            last = self._last_logged.get(pool, None) or PoolCounters()
+            self._last_logged[pool] = c
+
+            checkouts = c.checkouts - last.checkouts
+            checkins = c.checkins - last.checkins
+            in_use, idle, waiting = self.get_connection_counts(pool)
+
+            # don't flood the log with idle pools
+            if checkouts == 0 and checkins == 0 and not in_use \
+                    and c.connects == last.connects \
+                    and c.disconnects == last.disconnects:
+                continue
+
+            wait_avg = hold_avg = 0.0
+            if checkouts > 0:
+                wait_avg = (c.wait_total - last.wait_total) / checkouts
+            if checkins > 0:
+                hold_avg = (c.hold_total - last.hold_total) / checkins
+
+            logger.info("{%s} (%s) checkouts=%d wait_avg=%.1fms "
+                        "wait_max=%.1fms hold_avg=%.1fms hold_max=%.1fms "
+                        "overflow_max=%d timeouts=%d connects=%d "
+                        "disconnects=%d reconnects=%d size=%s in_use=%s "
+                        "idle=%s waiting=%s", self.store_name, pool, checkouts,
+                  wait_avg * 1e3, c.recent_wait_max * 1e3, hold_avg * 1e3,
+                  c.recent_hold_max * 1e3, c.recent_overflow_max,
+                  c.timeouts - last.timeouts, c.connects - last.connects,
+                  c.disconnects - last.disconnects,
+                  c.reconnects - last.reconnects, _get_size(in_use, idle),
+                  in_use, idle, waiting)
+
+
+def _call_or_none(obj, name):
+    # not every sqlalchemy pool class implements every statistics method
+    f = getattr(obj, name, None)
+    if f is None:
+        return None
+    return f()
+
+
+def _get_size(in_use, idle):
+    if in_use is None or idle is None:
+        return None
+
+    return in_use + idle
+
+
+def _get_overflow(sqla_pool):
+    checkedout = _call_or_none(sqla_pool, 'checkedout')
+    size = _call_or_none(sqla_pool, 'size')
+    if checkedout is None or size is None:
+        return None
+
+    return max(0, checkedout - size)
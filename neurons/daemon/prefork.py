@@ -0,0 +1,217 @@
+# encoding: utf8
+#
+# This file is part of the Neurons project.
+# Copyright (c), Arskom Ltd. (arskom.com.tr),
+#                Burak Arslan <burak.arslan@arskom.com.tr>.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of the Arskom Ltd., the neurons project nor the names of
+#   its its contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""Pre-forking worker process supervisor.
+
+The parent process binds all listening sockets, forks the requested number of
+worker processes and then just sits there, waiting for them to die. Workers
+that die are respawned until the supervisor is stopped. Workers return from
+:meth:`WorkerSupervisor.run` and go on to boot the daemon normally, adopting
+the inherited listening sockets instead of binding their own.
+
+The parent never imports the reactor.
+"""
+
+from __future__ import print_function, absolute_import
+
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import sys
+import errno
+import signal
+
+from time import time, sleep
+
+
+WORKER_MIN_UPTIME = 1.0
+"""Workers dying sooner than this many seconds after being forked are respawned
+with a delay to avoid a fork storm."""
+
+WORKER_RESPAWN_DELAY = 1.0
+"""Seconds to wait before respawning a worker that died too soon."""
+
+FORWARDED_SIGNALS = ('SIGHUP', 'SIGUSR1', 'SIGUSR2')
+"""Signals that are relayed as-is from the parent to all workers."""
+
+STOP_SIGNALS = ('SIGTERM', 'SIGINT')
+"""Signals that are relayed to all workers and stop the supervisor."""
+
+
+def _signals(names):
+    # not all signals are available on all platforms
+    return [getattr(signal, s) for s in names if hasattr(signal, s)]
+
+
+class WorkerSupervisor(object):
+    """Forks and supervises ``num_workers`` worker processes.
+
+    :param num_workers: Number of worker processes to keep alive.
+    :param name: Daemon name, only used for logging.
+    """
+
+    def __init__(self, num_workers, name=None):
+        assert num_workers > 0
+
+        self.num_workers = num_workers
+        self.name = name
+
+        self.workers = {}
+        """Maps pid to (worker_id, fork_time) tuples."""
+
+        self.stopping = False
+        self.retcode = 0
+
+    def _fork_worker(self, worker_id):
+        pid = os.fork()
+
+        if pid == 0:
+            # the worker is not supposed to inherit the supervisor's handlers
+            for s in _signals(STOP_SIGNALS + FORWARDED_SIGNALS + ('SIGCHLD',)):
+                signal.signal(s, signal.SIG_DFL)
+
+            self.workers = {}
+            return True
+
+        self.workers[pid] = (worker_id, time())
+        logger.info("Worker %d spawned with pid %d", worker_id, pid)
+
+        return False
+
+    def _relay_signal(self, signum, frame):
+        logger.info("Relaying signal %d to %d worker(s)",
+                                                      signum, len(self.workers))
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signum)
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    raise
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+        self._relay_signal(signum, frame)
+
+    def _install_signal_handlers(self):
+        for s in _signals(FORWARDED_SIGNALS):
+            signal.signal(s, self._relay_signal)
+
+        for s in _signals(STOP_SIGNALS):
+            signal.signal(s, self._stop)
+
+    def _wait(self):
+        while True:
+            try:
+                return os.waitpid(-1, 0)
+
+            except OSError as e:
+                # Python 2 doesn't retry on EINTR
+                if e.errno == errno.EINTR:
+                    continue
+
+                if e.errno == errno.ECHILD:
+                    return None, None
+
+                raise
+
+    def _handle_exit(self, pid, status):
+        worker_id, fork_t = self.workers.pop(pid)
+        uptime = time() - fork_t
+
+        if os.WIFSIGNALED(status):
+            retcode = 128 + os.WTERMSIG(status)
+            log = logger.info if self.stopping else logger.warning
+            log("Worker %d (pid %d) was killed by signal %d "
+                   "after %.1fs", worker_id, pid, os.WTERMSIG(status), uptime)
+
+        else:
+            retcode = os.WEXITSTATUS(status)
+            if retcode == 0:
+                logger.info("Worker %d (pid %d) exited after %.1fs",
+                                                       worker_id, pid, uptime)
+            else:
+                logger.warning("Worker %d (pid %d) exited with code %d "
+                                 "after %.1fs", worker_id, pid, retcode, uptime)
+
+        # workers killed by the stop signal we relayed are not an error
+        if retcode != 0 and not self.stopping:
+            self.retcode = retcode
+
+        # Workers that exit cleanly are respawned too, e.g. the timed limits
+        # stop workers with SIGTERM, which makes twisted exit with 0.
+        if self.stopping:
+            return False
+
+        if uptime < WORKER_MIN_UPTIME:
+            logger.warning("Worker %d died too soon, waiting %.1fs before "
+                                "respawning", worker_id, WORKER_RESPAWN_DELAY)
+            sleep(WORKER_RESPAWN_DELAY)
+
+        return self._fork_worker(worker_id)
+
+    def run(self):
+        """Forks the workers. Returns the worker id in the worker processes
+        and never returns in the supervisor process.
+        """
+
+        logger.info("%s Supervisor pid %d starting %d worker(s)",
+                                  self.name, os.getpid(), self.num_workers)
+
+        self._install_signal_handlers()
+
+        for worker_id in range(self.num_workers):
+            if self._fork_worker(worker_id):
+                return worker_id
+
+        while len(self.workers) > 0:
+            pid, status = self._wait()
+            if pid is None:
+                break
+
+            if not (pid in self.workers):
+                continue
+
+            worker_id = self.workers[pid][0]
+            if self._handle_exit(pid, status):
+                return worker_id
+
+        logger.info("%s Supervisor pid %d exiting with code %d",
+                                        self.name, os.getpid(), self.retcode)
+
+        logging.shutdown()
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        # see daemonize_do for why this is _exit and not exit
+        os._exit(self.retcode)
@@ -0,0 +1,280 @@
+# encoding: utf8
+#
+# This file is part of the Neurons project.
+# Copyright (c), Arskom Ltd. (arskom.com.tr),
+#                Burak Arslan <burak.arslan@arskom.com.tr>.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of the Arskom Ltd., the neurons project nor the names of
+#   its its contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""In-memory token bucket rate limiting for :class:`HttpServer` instances.
+
+Every rule keeps one bucket per client ip, user name or subapp url. A bucket
+holds up to ``burst`` tokens and is refilled at ``rate`` tokens per second.
+Every request takes one token from each bucket it maps to and is rejected
+with ``429 Too Many Requests`` when a bucket is empty, in which case it takes
+no tokens at all. Buckets that have filled up again are dropped by
+:meth:`RateLimiter.evict`, as a missing bucket is equivalent to a full one.
+
+Limits are per process. In pre-fork mode, each worker enforces them on its
+own.
+"""
+
+from __future__ import absolute_import
+
+import logging
+logger = logging.getLogger(__name__)
+
+from math import ceil
+from time import time
+from weakref import WeakKeyDictionary
+
+from spyne import Fault
+from spyne.const.http import HTTP_429
+
+
+KEY_IP = 'ip'
+KEY_USER = 'user'
+KEY_SUBAPP = 'subapp'
+
+
+class RateLimitExceeded(Fault):
+    def __init__(self, retry_after):
+        super(RateLimitExceeded, self).__init__('Client.RateLimitExceeded',
+                         "Rate limit exceeded, retry after %d seconds"
+                                                                 % retry_after)
+
+
+class TokenBuckets(object):
+    """Token buckets of a single rule. Buckets are two-item lists of the
+    number of tokens left and the time of the last update, so that the check
+    does not allocate anything for known keys."""
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.buckets = {}
+
+    def peek(self, key, now):
+        """Returns 0 when the bucket for the given key has a token, or the
+        number of seconds until it will have one. Takes nothing."""
+
+        bucket = self.buckets.get(key, None)
+        if bucket is None:
+            return 0
+
+        tokens = bucket[0] + (now - bucket[1]) * self.rate
+        if tokens >= 1:
+            return 0
+
+        return (1 - tokens) / self.rate
+
+    def consume(self, key, now):
+        """Takes one token from the bucket for the given key. Returns 0 when
+        there was one, or the number of seconds until there will be one."""
+
+        bucket = self.buckets.get(key, None)
+        if bucket is None:
+            self.buckets[key] = [self.burst - 1, now]
+            return 0
+
+        tokens = bucket[0] + (now - bucket[1]) * self.rate
+        if tokens > self.burst:
+            tokens = self.burst
+
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return 0
+
+        bucket[0] = tokens
+        return (1 - tokens) / self.rate
+
+    def evict(self, now):
+        """Drops the buckets that filled up again. Returns their number."""
+
+        rate, burst = self.rate, self.burst
+        full = [k for k, (tokens, last_t) in self.buckets.items()
+                                   if tokens + (now - last_t) * rate >= burst]
+
+        for k in full:
+            del self.buckets[k]
+
+        return len(full)
+
+
+class RateLimiter(object):
+    """Applies the :class:`neurons.daemon.config.RateLimit` rules of an
+    :class:`HttpServer`.
+
+    Ip and subapp rules are checked by :meth:`check_request` before the
+    request is dispatched. User rules can only be checked after the spyne
+    application authenticates the client, so they are checked by
+    :meth:`check_user` right before the method is called. See
+    :func:`instrument_application`."""
+
+    def __init__(self, rules, subapp_urls):
+        self.tables = []
+        self.subapp_urls = frozenset(subapp_urls)
+
+        # {subapp url or None: [(key type, TokenBuckets)]}
+        self.request_rules = {}
+        self.user_rules = {}
+
+        for rule in rules:
+            table = TokenBuckets(rule.rate, rule.get_burst())
+            self.tables.append(table)
+
+            scope = rule.subapp
+            if scope is not None:
+                scope = scope.strip('/').encode('utf8')
+
+            if rule.key == KEY_USER:
+                self.user_rules.setdefault(scope, []).append(table)
+            else:
+                self.request_rules.setdefault(scope, []) \
+                                                     .append((rule.key, table))
+
+    @staticmethod
+    def _check(checks, now):
+        """Takes one token for each of the given ``(TokenBuckets, key)``
+        pairs if every one of them has a token. Otherwise, takes none, so
+        that requests rejected by one rule don't use up the others."""
+
+        retval = 0
+        for table, key in checks:
+            wait = table.peek(key, now)
+            if wait > retval:
+                retval = wait
+
+        if retval > 0:
+            return retval
+
+        for table, key in checks:
+            table.consume(key, now)
+
+        return 0
+
+    def check_request(self, request):
+        """Returns the number of seconds the client should wait before trying
+        again, or 0 when the request can go through."""
+
+        rules = self.request_rules
+        if len(rules) == 0:
+            return 0
+
+        path = request.path
+        end = path.find(b'/', 1)
+        subapp = path[1:end] if end > 0 else path[1:]
+        if subapp not in self.subapp_urls:
+            subapp = b''
+
+        host = getattr(request.getClientAddress(), 'host', None)
+
+        checks = []
+        for scope in (None, subapp):
+            for key_type, table in rules.get(scope, ()):
+                if key_type == KEY_SUBAPP:
+                    checks.append((table, subapp))
+                elif host is not None:
+                    checks.append((table, host))
+
+        return self._check(checks, time())
+
+    def check_user(self, subapp, username):
+        """Same as :meth:`check_request`, but for user rules."""
+
+        rules = self.user_rules
+        if len(rules) == 0 or username is None:
+            return 0
+
+        checks = [(table, username) for scope in (None, subapp)
+                                           for table in rules.get(scope, ())]
+
+        return self._check(checks, time())
+
+    def evict(self):
+        now = time()
+        num_evicted = sum(t.evict(now) for t in self.tables)
+        logger.debug("Evicted %d idle rate limit buckets", num_evicted)
+
+
+def get_retry_after(wait):
+    return max(1, int(ceil(wait)))
+
+
+def deny_request(request, wait):
+    retry_after = get_retry_after(wait)
+
+    request.setResponseCode(429, b'Too Many Requests')
+    request.setHeader(b'retry-after', str(retry_after).encode('ascii'))
+    request.setHeader(b'content-type', b'text/plain')
+
+    if request.method != b'HEAD':
+        request.write(b'Rate limit exceeded, retry after '
+                                 + str(retry_after).encode('ascii') + b' s\n')
+
+    request.finish()
+
+
+_instrumented = WeakKeyDictionary()
+
+
+def instrument_application(app, limiter, subapp):
+    """Enforces the user rules of the given :class:`RateLimiter` for calls to
+    the given spyne application, after all ``method_call`` listeners, which
+    is where authentication happens, had their turn."""
+
+    from neurons.context import ReadContext
+
+    if isinstance(subapp, bytes):
+        subapp = subapp.decode('utf8')
+    scope = subapp.strip('/').encode('utf8')
+
+    if app in _instrumented:
+        _instrumented[app] = limiter, scope
+        return
+
+    _instrumented[app] = limiter, scope
+    call_wrapper = app.call_wrapper
+
+    def _call_wrapper(ctx):
+        limiter, scope = _instrumented[app]
+
+        udc = ctx.udc
+        if isinstance(udc, ReadContext):
+            wait = limiter.check_user(scope, udc.username)
+
+            if wait > 0:
+                retry_after = get_retry_after(wait)
+                ctx.transport.resp_code = HTTP_429
+                ctx.transport.resp_headers['Retry-After'] = str(retry_after)
+                raise RateLimitExceeded(retry_after)
+
+        return call_wrapper(ctx)
+
+    app.call_wrapper = _call_wrapper
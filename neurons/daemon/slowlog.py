@@ -0,0 +1,196 @@
+# encoding: utf8
+#
+# This file is part of the Neurons project.
+# Copyright (c), Arskom Ltd. (arskom.com.tr),
+#                Burak Arslan <burak.arslan@arskom.com.tr>.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of the Arskom Ltd., the neurons project nor the names of
+#   its its contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""Logs a breakdown of spyne method calls that take longer than a given
+threshold.
+
+Every slow call results in one warning with the method key, total time, time
+spent in and number of SQL queries, time spent serializing the response and
+the number of bytes written. The same values are attached to the log record
+as the ``slow_request`` attribute for the benefit of structured log handlers.
+
+SQL queries are attributed to a call via the SQLAlchemy sessions its
+:class:`neurons.context.ReadContext` hands out, so queries that are not run
+through :meth:`~neurons.context.ReadContext.get_session` are not counted.
+"""
+
+from __future__ import absolute_import
+
+import logging
+logger = logging.getLogger(__name__)
+
+from time import time
+from weakref import WeakKeyDictionary
+
+from neurons.context import ReadContext, SQLA_SESSION_KEY
+from neurons.daemon.metrics import get_method_name
+
+
+_CONN_KEY = 'neurons.slowlog.udc'
+_START_KEY = 'neurons.slowlog.start'
+
+
+def install_sql_hooks(store):
+    """Makes queries run through sessions of the given
+    :class:`spyne.store.relational.SqlDataStore` count towards the
+    :class:`ReadContext` that created the session."""
+
+    from sqlalchemy import event
+
+    if store.engine is None or getattr(store, '_neurons_slowlog', False):
+        return
+
+    def after_begin(session, transaction, connection):
+        udc = session.info.get(SQLA_SESSION_KEY, None)
+        if udc is not None:
+            connection.info[_CONN_KEY] = udc
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context,
+                                                                   executemany):
+        if _CONN_KEY in conn.info:
+            conn.info[_START_KEY] = time()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context,
+                                                                   executemany):
+        udc = conn.info.get(_CONN_KEY, None)
+        start_t = conn.info.pop(_START_KEY, None)
+        if udc is not None and start_t is not None:
+            udc.sql_time += time() - start_t
+            udc.sql_count += 1
+
+    def checkin(dbapi_connection, connection_record):
+        connection_record.info.pop(_CONN_KEY, None)
+        connection_record.info.pop(_START_KEY, None)
+
+    event.listen(store.Session, 'after_begin', after_begin)
+
+    for engine in [store.engine] + list(getattr(store, 'replicas', ())):
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+        event.listen(engine.pool, 'checkin', checkin)
+
+        logger.debug("Installed slow request log hooks for engine %s.", engine)
+
+    store._neurons_slowlog = True
+
+
+class _Timings(object):
+    __slots__ = 'serialize_start', 'serialize_end'
+
+    def __init__(self):
+        self.serialize_start = None
+        self.serialize_end = None
+
+
+def _get_bytes_written(ctx):
+    retval = 0
+
+    req = getattr(ctx.transport, 'req', None)
+    sent_length = getattr(req, 'sentLength', None)
+    if isinstance(sent_length, int):
+        retval = sent_length
+
+    # synchronous twisted responses are written after the context is closed
+    if isinstance(ctx.out_string, (list, tuple)):
+        retval = max(retval, sum(len(s) for s in ctx.out_string))
+
+    return retval
+
+
+_instrumented = WeakKeyDictionary()
+
+
+def instrument_application(app, threshold):
+    """Logs calls to the methods of the given spyne application that take
+    longer than ``threshold`` seconds. Calling this again for the same
+    application only updates the threshold."""
+
+    if app in _instrumented:
+        _instrumented[app] = threshold
+        return
+
+    timings = WeakKeyDictionary()
+
+    def _on_method_returned(ctx):
+        t = timings.get(ctx, None)
+        if t is None:
+            t = timings[ctx] = _Timings()
+        t.serialize_start = time()
+
+    def _on_string_created(ctx):
+        t = timings.get(ctx, None)
+        if t is not None:
+            t.serialize_end = time()
+
+    def _on_method_context_closed(ctx):
+        t = timings.pop(ctx, None)
+
+        total = ctx.call_end - ctx.call_start
+        if total < _instrumented.get(app, 0):
+            return
+
+        serialize = 0.0
+        if t is not None and t.serialize_start is not None:
+            end_t = t.serialize_end
+            if end_t is None:
+                end_t = ctx.call_end
+            serialize = end_t - t.serialize_start
+
+        sql_time, sql_count = 0.0, 0
+        if isinstance(ctx.udc, ReadContext):
+            sql_time, sql_count = ctx.udc.sql_time, ctx.udc.sql_count
+
+        entry = dict(
+            method=get_method_name(ctx),
+            total=total,
+            sql=sql_time,
+            queries=sql_count,
+            serialize=serialize,
+            bytes=_get_bytes_written(ctx),
+            error=ctx.out_error is not None,
+        )
+
+        logger.warning("Slow request: method=%s total=%.1fms sql=%.1fms "
+                       "queries=%d serialize=%.1fms bytes=%d error=%s",
+                  entry['method'], total * 1e3, sql_time * 1e3, sql_count,
+                      serialize * 1e3, entry['bytes'], entry['error'],
+                                            extra={'slow_request': entry})
+
+    evmgr = app.event_manager
+    evmgr.add_listener('method_return_object', _on_method_returned)
+    evmgr.add_listener('method_exception_object', _on_method_returned)
+    evmgr.add_listener('method_return_string', _on_string_created)
+    evmgr.add_listener('method_exception_string', _on_string_created)
+    evmgr.add_listener('method_context_closed', _on_method_context_closed)
+
+    _instrumented[app] = threshold
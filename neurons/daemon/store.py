@@ -35,6 +35,7 @@
 import logging
 logger = logging.getLogger(__name__)
 
+from time import time
 from contextlib import closing
 
 import threading
@@ -44,9 +45,7 @@ import neurons
 
 from spyne.util.color import G, YEL, R
 
-from sqlalchemy import MetaData
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.engine import Engine
+from neurons.daemon.poolstats import PoolStats
 
 
 try:
@@ -141,10 +140,134 @@ class LdapDataStore(DataStoreBase):
             raise ValueError(self.parent.method)
 
 
+class ThreadedTxPool(object):
+    """A txpostgres ``ConnectionPool`` lookalike for engines of any database
+    SQLAlchemy supports. Queries run in a dedicated thread pool, so at most
+    ``size`` of them run at the same time and the reactor thread pool is
+    left alone.
+
+    Queries are passed to the DB-API driver as they are, so they need to use
+    its parameter style. ``runQuery`` and ``runOperation`` commit right away.
+    ``runInteraction`` calls ``interaction(cursor, *args, **kwargs)`` in a
+    pool thread inside a transaction that is committed when the interaction
+    returns and rolled back when it raises. Unlike with txpostgres, the
+    cursor is a blocking DB-API cursor, so the interaction must not return
+    a Deferred.
+    """
+
+    def __init__(self, name, engine, size, stats=None):
+        from sqlalchemy.pool import StaticPool
+        from neurons.daemon.threadpool import gen_threadpool
+
+        # A StaticPool hands out the same connection to every thread
+        if isinstance(engine.pool, StaticPool):
+            size = 1
+
+        self.name = name
+        self.engine = engine
+        self.size = size
+        self.stats = stats
+        self.threadpool = gen_threadpool('txpool-%s' % name, min=0, max=size)
+
+        self._lock = threading.Lock()
+        self.num_pending = 0
+        """Number of queries that were submitted but did not finish yet."""
+
+        self.num_running = 0
+        """Number of queries that are running in a pool thread."""
+
+        if stats is not None:
+            stats.connection_getters['async'] = self.get_connection_counts
+
+    def start(self):
+        from twisted.internet.defer import succeed
+
+        return succeed(self)
+
+    def close(self):
+        from neurons.daemon.threadpool import stop_threadpool
+
+        stop_threadpool(self.threadpool)
+
+    def get_connection_counts(self):
+        """Returns the number of busy threads, the number of idle threads
+        and the number of queries waiting for a thread."""
+
+        running = self.num_running
+        return running, self.size - running, self.num_pending - running
+
+    def _defer(self, f, *args, **kwargs):
+        from twisted.internet import reactor
+        from twisted.internet.threads import deferToThreadPool
+
+        with self._lock:
+            self.num_pending += 1
+
+        return deferToThreadPool(reactor, self.threadpool, self._interact,
+                                                   time(), f, *args, **kwargs)
+
+    def _interact(self, queued_t, interaction, *args, **kwargs):
+        start_t = time()
+        with self._lock:
+            self.num_running += 1
+
+        if self.stats is not None:
+            self.stats.observe_checkout('async', start_t - queued_t)
+
+        try:
+            with closing(self.engine.raw_connection()) as connection:
+                cursor = connection.cursor()
+
+                try:
+                    retval = interaction(cursor, *args, **kwargs)
+                except:
+                    connection.rollback()
+                    raise
+                else:
+                    connection.commit()
+                finally:
+                    cursor.close()
+
+        finally:
+            with self._lock:
+                self.num_running -= 1
+                self.num_pending -= 1
+
+            if self.stats is not None:
+                self.stats.observe_checkin('async', time() - start_t)
+
+        return retval
+
+    @staticmethod
+    def _run_query(cursor, query, args):
+        cursor.execute(query, args)
+        return cursor.fetchall()
+
+    @staticmethod
+    def _run_operation(cursor, query, args):
+        cursor.execute(query, args)
+
+    def runQuery(self, query, args=()):
+        return self._defer(self._run_query, query, args)
+
+    def runOperation(self, query, args=()):
+        return self._defer(self._run_operation, query, args)
+
+    def runInteraction(self, interaction, *args, **kwargs):
+        return self._defer(interaction, *args, **kwargs)
+
+    def __repr__(self):
+        return "ThreadedTxPool(%r, size=%d)" % (self.engine, self.size)
+
+
 # FIXME: get rid of the overly complicated property setters.
 class SqlDataStore(DataStoreBase):
     def __init__(self, name=None, connection_string=None,
                                           engine=None, metadata=None, **kwargs):
+        from sqlalchemy import MetaData
+        from sqlalchemy.orm import sessionmaker
+        from sqlalchemy.engine import Engine
+
         DataStoreBase.__init__(self, name=name, type='sqlalchemy')
 
         if engine is not None:
@@ -159,6 +282,9 @@ class SqlDataStore(DataStoreBase):
         self.Session = None
         """SQLAlchemy session constructor."""
 
+        self.pool_stats = PoolStats(name)
+        """Connection pool telemetry."""
+
         self.metadata = metadata or MetaData()
         self.engine = engine
         self.Session = sessionmaker()
@@ -170,9 +296,36 @@ class SqlDataStore(DataStoreBase):
         self.txpool_min = 1
         """TxPostgres minimum number of pooled connections."""
 
+        self.txpool_max = None
+        """TxPostgres maximum number of pooled connections. Same as
+        `txpool_min` when None, which means the pool never grows."""
+
+        self.txpool_grow_threshold = 1
+        """TxPostgres pool opens a new connection when at least this many
+        queries are waiting for one."""
+
+        self.txpool_idle_timeout = 60
+        """TxPostgres pool closes connections above `txpool_min` that were
+        idle for this many seconds."""
+
         self.txpool_start_deferred = None
         """Deferred from TxPostgres pool start()."""
 
+        self.replicas = []
+        """Engines of read replicas. Added when `add_replica` is called."""
+
+        self.replica_policy = 'round_robin'
+        """How `get_read_engine` picks a replica. Either 'round_robin' or
+        'least_checked_out'."""
+
+        self.read_your_writes = None
+        """Number of seconds after a write during which `get_read_engine`
+        returns the primary engine for the user who made the write."""
+
+        self._next_replica = 0
+        self._last_writes = {}
+        self._last_writes_purged = 0
+
     @property
     def txpool(self):
         if neurons.REACTOR_THREAD_ID is not None and \
@@ -231,28 +384,6 @@ class SqlDataStore(DataStoreBase):
         self._txpool = FakeTxPool(session)
 
     def add_txpool(self):
-        # don't import twisted too soon
-        from txpostgres.txpostgres import Connection, ConnectionPool
-        from txpostgres.reconnection import DeadConnectionDetector
-
-        class LoggingDeadConnectionDetector(DeadConnectionDetector):
-            NAME_G = G('{%s}' % (self.name,))
-            NAME_R = R('{%s}' % (self.name,))
-            NAME_YEL = YEL('{%s}' % (self.name,))
-
-            def startReconnecting(self, err):
-                logger.warning('%s (txpool) database connection down: %r)',
-                                                         self.NAME_R, err.value)
-                return DeadConnectionDetector.startReconnecting(self, err)
-
-            def reconnect(self):
-                logger.warning('%s (txpool) reconnecting...', self.NAME_YEL)
-                return DeadConnectionDetector.reconnect(self)
-
-            def connectionRecovered(self):
-                logger.warning('%s (txpool) connection recovered.', self.NAME_G)
-                return DeadConnectionDetector.connectionRecovered(self)
-
         try:
             with closing(self.engine.raw_connection()) as connection:
                 dsn = connection.connection.dsn
@@ -260,31 +391,16 @@ class SqlDataStore(DataStoreBase):
             print("Error getting dsn for conn_str", self.connection_string)
             raise
 
+        stats = self.pool_stats
         txpool_min = self.txpool_min
 
-        class NeuronsConnectionPool(ConnectionPool):
-            @staticmethod
-            def connectionFactory(reactor=None, cooperator=None):
-                retval = Connection(reactor=reactor, cooperator=cooperator,
-                                       detector=LoggingDeadConnectionDetector())
-
-                logger.debug("{%s} (txpool) spawning backend", self.name)
-                return retval
-
-            def __repr__(self):
-                data = (
-                    ', '.join(repr(c) for c in self.connargs),
-                    'min=%d' % (txpool_min,),
-                    ', '.join(("%s=%r" % (k, v)
-                                              for k, v in self.connkw.items())),
-                )
-
-                data = [s for s in data if len(s) > 0]
-
-                return "NeuronsConnectionPool(%s)" % (', '.join(data),)
+        NeuronsConnectionPool = TNeuronsConnectionPool(self.name, stats,
+                     txpool_min, max(self.txpool_max or txpool_min, txpool_min),
+                     self.txpool_grow_threshold, self.txpool_idle_timeout)
 
         self.txpool = NeuronsConnectionPool("heleleley", dsn,
                                                             min=self.txpool_min)
+        stats.connection_getters['async'] = self._txpool.get_connection_counts
         self.txpool_start_deferred = self.txpool.start()
         self.txpool_start_deferred \
             .addCallback(lambda p:
@@ -294,6 +410,169 @@ class SqlDataStore(DataStoreBase):
 
         return self.txpool_start_deferred
 
+    def add_threaded_txpool(self, size):
+        """Adds a :class:`ThreadedTxPool` as ``txpool`` for databases that
+        txpostgres does not support."""
+
+        self.txpool = ThreadedTxPool(self.name, self.engine, size,
+                                                               self.pool_stats)
+        self.txpool_start_deferred = self.txpool.start()
+
+        logger.info("{%s} (txpool) %r started.", self.name, self._txpool)
+
+        return self.txpool_start_deferred
+
+    def add_replica(self, connection_string, **kwargs):
+        from sqlalchemy.engine import create_engine
+
+        retval = create_engine(connection_string, **kwargs)
+        self.pool_stats.instrument_engine(retval,
+                                            'replica%d' % len(self.replicas))
+        self.replicas.append(retval)
+
+        logger.info("{%s} (sqla) replica %r started with args: %r",
+                                                      self.name, retval, kwargs)
+
+        return retval
+
+    def get_read_engine(self, key=None):
+        """Returns the engine that read-only sessions should be bound to.
+
+        :param key: The user the session is for. Used to send reads to the
+            primary for ``read_your_writes`` seconds after that user's last
+            write, see `record_write`.
+        """
+
+        replicas = self.replicas
+        if len(replicas) == 0:
+            return self.engine
+
+        if key is not None and self.read_your_writes:
+            last_t = self._last_writes.get(key, None)
+            if last_t is not None and time() - last_t < self.read_your_writes:
+                return self.engine
+
+        if self.replica_policy == 'least_checked_out':
+            return min(replicas, key=_get_num_checked_out)
+
+        i = self._next_replica % len(replicas)
+        self._next_replica = i + 1
+        return replicas[i]
+
+    def record_write(self, key):
+        window = self.read_your_writes
+        if not window or key is None or len(self.replicas) == 0:
+            return
+
+        now = time()
+        self._last_writes[key] = now
+
+        if now - self._last_writes_purged > window:
+            for k, t in list(self._last_writes.items()):
+                if now - t >= window:
+                    self._last_writes.pop(k, None)
+
+            self._last_writes_purged = now
+
+    def dispose_replicas(self):
+        for engine in self.replicas:
+            engine.dispose()
+
+        del self.replicas[:]
+
+    def prewarm(self, num_connections):
+        """Opens up to ``num_connections`` connections to the primary and to
+        every replica in parallel, validates them with the dialect's ping
+        query and returns them to their pools. Blocks until done.
+
+        Returns a Deferred that fires once the connections of the txpostgres
+        pool, if any, are open and validated as well.
+        """
+
+        from twisted.internet.defer import succeed
+
+        if self.engine is not None:
+            self._prewarm_engine('sync', self.engine, num_connections)
+
+            for i, engine in enumerate(self.replicas):
+                self._prewarm_engine('replica%d' % i, engine, num_connections)
+
+        if self.txpool_start_deferred is None:
+            return succeed(None)
+
+        if isinstance(self._txpool, ThreadedTxPool):
+            # it uses the sync engine, which is already warm
+            return succeed(None)
+
+        start_t = time()
+        return self.txpool_start_deferred \
+                                  .addCallback(self._prewarm_txpool, start_t)
+
+    def _prewarm_engine(self, pool_name, engine, num_connections):
+        num_connections = _get_prewarm_size(engine.pool, num_connections)
+        if num_connections == 0:
+            return
+
+        connections = []
+        validated = []
+        errors = []
+
+        def _connect():
+            try:
+                connection = engine.connect()
+                connections.append(connection)
+                engine.dialect.do_ping(connection.connection.connection)
+                validated.append(connection)
+
+            except Exception as e:
+                errors.append(e)
+
+        start_t = time()
+
+        # all connections are kept checked out until every thread is done, so
+        # that each thread gets a new one.
+        threads = [threading.Thread(target=_connect,
+                                    name='prewarm-%s-%d' % (self.name, i))
+                                               for i in range(num_connections)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for c in connections:
+            c.close()
+
+        logger.info("{%s} (%s) Prewarmed %d/%d connections in %.1fms.",
+                                 self.name, pool_name, len(validated),
+                                     num_connections, (time() - start_t) * 1e3)
+
+        for e in errors:
+            logger.error("{%s} (%s) Prewarm failed: %r", self.name,
+                                                                  pool_name, e)
+
+    def _prewarm_txpool(self, _, start_t):
+        from twisted.internet.defer import DeferredList
+
+        pool = self._txpool
+        num_connections = len(pool.connections)
+
+        def _log(results):
+            num_ok = sum(1 for ok, _ in results if ok)
+            logger.info("{%s} (txpool) Prewarmed %d/%d connections in %.1fms.",
+                                      self.name, num_ok, num_connections,
+                                                     (time() - start_t) * 1e3)
+
+            for ok, err in results:
+                if not ok:
+                    logger.error("{%s} (txpool) Prewarm failed: %s", self.name,
+                                                        err.getErrorMessage())
+
+        # going through the pool so that the semaphore hands out connections.
+        # These are all issued at once, so each one gets its own connection.
+        return DeferredList([pool.runQuery("SELECT 1")
+                                               for _ in range(num_connections)],
+                                                         consumeErrors=True) \
+            .addCallback(_log)
+
     def connect(self):
         return self.__engine.connect()
 
@@ -353,6 +632,7 @@ class SqlDataStore(DataStoreBase):
                     del self.__kwargs['pool_size']
 
             self.engine = create_engine(what, **self.__kwargs)
+            self.pool_stats.instrument_engine(self.engine, 'sync')
             try:
                 dsn = self.engine.raw_connection().connection.dsn
             except Exception:
@@ -362,6 +642,213 @@ class SqlDataStore(DataStoreBase):
                                        self.name, self.engine, self.kwargs, dsn)
 
 
+def TNeuronsConnectionPool(store_name, stats, txpool_min, txpool_max,
+                                               grow_threshold, idle_timeout):
+    """Returns a txpostgres connection pool class that grows by one connection
+    whenever at least ``grow_threshold`` queries are waiting for a connection,
+    up to ``txpool_max`` connections, and closes connections that were idle
+    for ``idle_timeout`` seconds, down to ``txpool_min`` connections.
+
+    :param stats: A :class:`neurons.daemon.poolstats.PoolStats` instance.
+    """
+
+    # don't import twisted too soon
+    from txpostgres.txpostgres import Connection, ConnectionPool
+    from txpostgres.reconnection import DeadConnectionDetector
+
+    class LoggingDeadConnectionDetector(DeadConnectionDetector):
+        NAME_G = G('{%s}' % (store_name,))
+        NAME_R = R('{%s}' % (store_name,))
+        NAME_YEL = YEL('{%s}' % (store_name,))
+
+        def startReconnecting(self, err):
+            logger.warning('%s (txpool) database connection down: %r)',
+                                                     self.NAME_R, err.value)
+            stats.inc('async', 'disconnects')
+            return DeadConnectionDetector.startReconnecting(self, err)
+
+        def reconnect(self):
+            logger.warning('%s (txpool) reconnecting...', self.NAME_YEL)
+            return DeadConnectionDetector.reconnect(self)
+
+        def connectionRecovered(self):
+            logger.warning('%s (txpool) connection recovered.', self.NAME_G)
+            stats.inc('async', 'reconnects')
+            return DeadConnectionDetector.connectionRecovered(self)
+
+    class NeuronsConnectionPool(ConnectionPool):
+        def __init__(self, *args, **kwargs):
+            ConnectionPool.__init__(self, *args, **kwargs)
+
+            self.num_growing = 0
+            self.last_used = {}
+            self.shrinker = None
+
+        def start(self):
+            from twisted.internet.task import LoopingCall
+
+            now = time()
+            for c in self.connections:
+                self.last_used[c] = now
+
+            if txpool_max > txpool_min and idle_timeout:
+                self.shrinker = LoopingCall(self.shrink)
+                self.shrinker.start(max(1, idle_timeout / 2.0), now=False)
+
+            return ConnectionPool.start(self)
+
+        def close(self):
+            if self.shrinker is not None and self.shrinker.running:
+                self.shrinker.stop()
+
+            return ConnectionPool.close(self)
+
+        def grow(self):
+            """Opens a new connection if enough queries are waiting for
+            one and the pool is below its maximum size."""
+
+            semaphore = self._semaphore
+            if len(semaphore.waiting) < grow_threshold:
+                return
+
+            if semaphore.limit + self.num_growing >= txpool_max:
+                return
+
+            self.num_growing += 1
+
+            connection = self.connectionFactory(self.reactor,
+                                                           self.cooperator)
+            connection.connect(*self.connargs, **self.connkw) \
+                .addCallbacks(self._grown, self._grow_failed,
+                                               callbackArgs=(connection,))
+
+        def _grown(self, _, connection):
+            self.num_growing -= 1
+            self.last_used[connection] = time()
+            self.add(connection)
+
+            logger.info("{%s} (txpool) grew to %d connections.",
+                                        store_name, self._semaphore.limit)
+
+        def _grow_failed(self, err):
+            self.num_growing -= 1
+
+            logger.error("{%s} (txpool) could not open a new "
+                      "connection: %s", store_name, err.getErrorMessage())
+
+        def shrink(self):
+            """Closes connections above the minimum pool size that were
+            idle for longer than the idle timeout."""
+
+            now = time()
+            for c in list(self.connections):
+                if self._semaphore.limit <= txpool_min:
+                    break
+
+                # remove() needs to take a token without waiting for one
+                if self._semaphore.tokens == 0:
+                    break
+
+                if now - self.last_used.get(c, now) < idle_timeout:
+                    continue
+
+                self.remove(c)
+                self.last_used.pop(c, None)
+                c.close()
+
+                logger.info("{%s} (txpool) shrunk to %d connections.",
+                                        store_name, self._semaphore.limit)
+
+        def _putBackAndPassthrough(self, result, connection):
+            self.last_used[connection] = time()
+            return ConnectionPool._putBackAndPassthrough(self, result,
+                                                                connection)
+
+        @staticmethod
+        def connectionFactory(reactor=None, cooperator=None):
+            retval = Connection(reactor=reactor, cooperator=cooperator,
+                                   detector=LoggingDeadConnectionDetector())
+
+            logger.debug("{%s} (txpool) spawning backend", store_name)
+            stats.inc('async', 'connects')
+            return retval
+
+        def get_connection_counts(self):
+            """Returns the number of connections in use, the number of
+            idle connections and the number of queries waiting for a
+            connection."""
+
+            semaphore = self._semaphore
+            return semaphore.limit - semaphore.tokens, \
+                             len(self.connections), len(semaphore.waiting)
+
+        # The _run* methods run once the semaphore lets the query through
+        def _timed(self, f, queued_t, *args, **kwargs):
+            start_t = time()
+            stats.observe_checkout('async', start_t - queued_t)
+
+            def _observe_checkin(result):
+                stats.observe_checkin('async', time() - start_t)
+                return result
+
+            return f(*args, **kwargs).addBoth(_observe_checkin)
+
+        def runQuery(self, *args, **kwargs):
+            retval = self._semaphore.run(self._timed, self._runQuery,
+                                                   time(), *args, **kwargs)
+            self.grow()
+            return retval
+
+        def runOperation(self, *args, **kwargs):
+            retval = self._semaphore.run(self._timed, self._runOperation,
+                                                   time(), *args, **kwargs)
+            self.grow()
+            return retval
+
+        def runInteraction(self, interaction, *args, **kwargs):
+            retval = self._semaphore.run(self._timed, self._runInteraction,
+                                      time(), interaction, *args, **kwargs)
+            self.grow()
+            return retval
+
+        def __repr__(self):
+            data = (
+                ', '.join(repr(c) for c in self.connargs),
+                'min=%d' % (txpool_min,),
+                'max=%d' % (txpool_max,),
+                ', '.join(("%s=%r" % (k, v)
+                                          for k, v in self.connkw.items())),
+            )
+
+            data = [s for s in data if len(s) > 0]
+
+            return "NeuronsConnectionPool(%s)" % (', '.join(data),)
+
+    return NeuronsConnectionPool
+
+
+def _get_prewarm_size(sqla_pool, num_connections):
+    from sqlalchemy.pool import QueuePool, StaticPool
+
+    if isinstance(sqla_pool, QueuePool):
+        return min(num_connections, sqla_pool.size())
+
+    # every checkout of a StaticPool returns the same connection
+    if isinstance(sqla_pool, StaticPool):
+        return min(num_connections, 1)
+
+    # the rest don't keep connections around
+    return 0
+
+
+def _get_num_checked_out(engine):
+    checkedout = getattr(engine.pool, 'checkedout', None)
+    if checkedout is None:
+        return 0
+
+    return checkedout()
+
+
 def get_data_store(backend, *args, **kwargs):
     if backend.is_ldap:
         return LdapDataStore(*args, **kwargs)
@@ -0,0 +1,120 @@
+
+import zlib
+
+from twisted.trial import unittest
+
+
+PAYLOAD = b'neurons ' * 512
+
+
+class TestCompressingEncoder(unittest.TestCase):
+    def _gen_request(self, accept_encoding=None, content_type=b'text/plain',
+                                                           content_length=None):
+        from twisted.web.test.requesthelper import DummyRequest
+
+        retval = DummyRequest([b''])
+        retval.code = 200
+        if accept_encoding is not None:
+            retval.requestHeaders.setRawHeaders(b'accept-encoding',
+                                                             [accept_encoding])
+
+        retval.responseHeaders.setRawHeaders(b'content-type', [content_type])
+        if content_length is not None:
+            retval.responseHeaders.setRawHeaders(b'content-length',
+                                        [str(content_length).encode('ascii')])
+
+        return retval
+
+    def _encode(self, request, data=PAYLOAD, **kwargs):
+        from neurons.daemon.config import Compression
+        from neurons.daemon.config.compression import \
+                                                      CompressingEncoderFactory
+
+        factory = CompressingEncoderFactory(Compression(**kwargs))
+        encoder = factory.encoderForRequest(request)
+
+        # finish() also cancels the pending flush call
+        return encoder.encode(data) + encoder.finish()
+
+    def test_gzip(self):
+        request = self._gen_request(b'gzip, deflate')
+        data = self._encode(request, min_size=0)
+
+        headers = request.responseHeaders
+        assert headers.getRawHeaders(b'content-encoding') == [b'gzip']
+        assert zlib.decompress(data, 16 + zlib.MAX_WBITS) == PAYLOAD
+
+    def test_deflate(self):
+        request = self._gen_request(b'deflate')
+        data = self._encode(request, min_size=0)
+
+        headers = request.responseHeaders
+        assert headers.getRawHeaders(b'content-encoding') == [b'deflate']
+        assert zlib.decompress(data, zlib.MAX_WBITS) == PAYLOAD
+
+    def test_encoding_preference(self):
+        request = self._gen_request(b'gzip, deflate')
+        data = self._encode(request, min_size=0, encodings=['deflate'])
+
+        headers = request.responseHeaders
+        assert headers.getRawHeaders(b'content-encoding') == [b'deflate']
+        assert zlib.decompress(data, zlib.MAX_WBITS) == PAYLOAD
+
+    def test_not_accepted(self):
+        request = self._gen_request(b'gzip;q=0')
+        data = self._encode(request, min_size=0)
+
+        headers = request.responseHeaders
+        assert data == PAYLOAD
+        assert not headers.hasHeader(b'content-encoding')
+        assert headers.getRawHeaders(b'vary') == [b'accept-encoding']
+
+    def test_vary(self):
+        request = self._gen_request(b'gzip')
+        request.responseHeaders.setRawHeaders(b'vary', [b'origin'])
+        self._encode(request, min_size=0)
+
+        vary = request.responseHeaders.getRawHeaders(b'vary')
+        assert vary == [b'origin', b'accept-encoding']
+
+    def test_min_size(self):
+        request = self._gen_request(b'gzip', content_length=len(PAYLOAD))
+        data = self._encode(request, min_size=len(PAYLOAD) + 1)
+
+        headers = request.responseHeaders
+        assert data == PAYLOAD
+        assert not headers.hasHeader(b'content-encoding')
+        assert headers.getRawHeaders(b'content-length') == \
+                                           [str(len(PAYLOAD)).encode('ascii')]
+        assert headers.getRawHeaders(b'vary') == [b'accept-encoding']
+
+    def test_unknown_length(self):
+        request = self._gen_request(b'gzip')
+        data = self._encode(request, min_size=len(PAYLOAD) + 1)
+
+        assert zlib.decompress(data, 16 + zlib.MAX_WBITS) == PAYLOAD
+
+    def test_skipped_types(self):
+        request = self._gen_request(b'gzip', content_type=b'image/png')
+        data = self._encode(request, min_size=0)
+
+        headers = request.responseHeaders
+        assert data == PAYLOAD
+        assert not headers.hasHeader(b'content-encoding')
+        assert not headers.hasHeader(b'vary')
+
+    def test_custom_skipped_types(self):
+        request = self._gen_request(b'gzip',
+                                    content_type=b'text/csv; charset=utf-8')
+        data = self._encode(request, min_size=0, skipped_types=['text/csv'])
+
+        assert data == PAYLOAD
+        assert not request.responseHeaders.hasHeader(b'content-encoding')
+
+    def test_not_modified(self):
+        request = self._gen_request(b'gzip')
+        request.code = 304
+        data = self._encode(request, b'', min_size=0)
+
+        assert data == b''
+        assert not request.responseHeaders.hasHeader(b'content-encoding')
@@ -1,6 +1,8 @@
 
 import unittest
 
+from time import time
+
 import yaml
 
 from neurons.daemon import ServiceDaemon
@@ -68,6 +70,153 @@ class TestConfig(unittest.TestCase):
         config.uid = "root"
         assert config.get_uid() == 0
 
+    def test_reload_changed_fields(self):
+        from neurons.daemon.config._base import get_changed_fields
+
+        old = ServiceDaemon.parse_config_string(TEST_CONFIG, "test")
+        new = ServiceDaemon.parse_config_string(
+                        TEST_CONFIG.replace('port: 7001', 'port: 7002'), "test")
+
+        assert get_changed_fields(old, new) == {'services'}
+        assert get_changed_fields(old.services['someservice'],
+                                     new.services['someservice']) == {'port'}
+        assert get_changed_fields(old.limits, new.limits) == set()
+
+    def test_listener_stats(self):
+        from neurons.daemon.ipc import get_listener_stats
+
+        config = ServiceDaemon.parse_config_string(TEST_CONFIG, "test")
+        stats, = get_listener_stats(config)
+
+        assert stats.name == 'someservice'
+        assert stats.port == 7001
+        assert stats.state == 'stopped'
+        assert stats.connections == 0
+
+        config.services['someservice'].disabled = True
+        stats, = get_listener_stats(config)
+        assert stats.state == 'disabled'
+
+    def test_remove_stale_unix_socket(self):
+        import socket
+        import shutil
+        import tempfile
+        from os.path import exists, join
+        from neurons.daemon.config.endpoint import remove_stale_unix_socket
+
+        d = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, d)
+
+        path = join(d, 'test.sock')
+        assert not remove_stale_unix_socket(path)
+
+        live = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        live.bind(path)
+        live.listen(1)
+        self.assertRaises(socket.error, remove_stale_unix_socket, path)
+
+        live.close()
+        assert remove_stale_unix_socket(path)
+        assert not exists(path)
+
+    def test_asset_manifest(self):
+        import shutil
+        import tempfile
+        from os import mkdir
+        from os.path import join
+        from neurons.base.assets import gen_manifest, register_assets, \
+                                                                  get_asset_url
+
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        mkdir(join(path, 'css'))
+        for fn in ('css/X.css', 'css/X.css.gz', 'secret.py'):
+            with open(join(path, fn), 'wb') as f:
+                f.write(b'body {}')
+
+        manifest = gen_manifest(path, disallowed_exts=('py',))
+        fn, = manifest.keys()
+        assert fn == 'css/X.css'
+        assert manifest[fn].startswith('css/X.')
+        assert manifest[fn].endswith('.css')
+
+        register_assets('assets', manifest)
+        assert get_asset_url('/assets/css/X.css') == '/assets/' + manifest[fn]
+        assert get_asset_url('/assets/css/Y.css') == '/assets/css/Y.css'
+
+    def test_token_buckets(self):
+        from neurons.daemon.ratelimit import TokenBuckets
+
+        tb = TokenBuckets(rate=2, burst=3)
+        assert [tb.consume('a', 0) for _ in range(3)] == [0, 0, 0]
+        assert tb.consume('a', 0) == 0.5
+        assert tb.consume('b', 0) == 0
+        assert tb.consume('a', 0.5) == 0
+
+        assert tb.evict(1) == 1
+        assert tb.evict(2) == 1
+        assert len(tb.buckets) == 0
+
+    def test_token_buckets_peek(self):
+        from neurons.daemon.ratelimit import TokenBuckets
+
+        tb = TokenBuckets(rate=2, burst=1)
+        assert tb.peek('a', 0) == 0
+        assert tb.consume('a', 0) == 0
+        assert tb.peek('a', 0) == 0.5
+        assert tb.peek('a', 0) == 0.5
+        assert tb.peek('a', 0.5) == 0
+
+    def test_rate_limiter_no_partial_consume(self):
+        from neurons.daemon.config import RateLimit
+        from neurons.daemon.ratelimit import RateLimiter
+
+        class Address(object):
+            host = '10.0.0.1'
+
+        class Request(object):
+            path = b'/api/call'
+
+            def getClientAddress(self):
+                return Address()
+
+        limiter = RateLimiter([
+            RateLimit(key='ip', rate=1, burst=2),
+            RateLimit(key='subapp', rate=1, burst=1, subapp='api'),
+        ], [b'api'])
+
+        ip_table, subapp_table = limiter.tables
+        request = Request()
+
+        assert limiter.check_request(request) == 0
+        assert ip_table.buckets['10.0.0.1'][0] == 1
+
+        # rejected by the subapp rule, so the ip rule keeps its token
+        assert limiter.check_request(request) > 0
+        assert limiter.check_request(request) > 0
+        assert ip_table.peek('10.0.0.1', time()) == 0
+        assert ip_table.buckets['10.0.0.1'][0] == 1
+
+    def test_rate_limiter_user(self):
+        from neurons.daemon.config import RateLimit
+        from neurons.daemon.ratelimit import RateLimiter
+
+        limiter = RateLimiter([
+            RateLimit(key='user', rate=1, burst=2),
+            RateLimit(key='user', rate=1, burst=1, subapp='api'),
+        ], [b'api'])
+
+        all_table, api_table = limiter.tables
+
+        assert limiter.check_user(b'api', 'jdoe') == 0
+        assert limiter.check_user(b'api', 'jdoe') > 0
+        assert all_table.buckets['jdoe'][0] == 1
+
+        # other subapps are only limited by the first rule
+        assert limiter.check_user(b'other', 'jdoe') == 0
+        assert limiter.check_user(b'other', 'jdoe') > 0
+        assert limiter.check_user(b'api', None) == 0
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,66 @@
+
+import os
+import shutil
+import tempfile
+
+from twisted.trial import unittest
+
+
+CONFIG = b"ServiceDaemon:\n    name: test\n"
+
+
+class TestConfigCache(unittest.TestCase):
+    def setUp(self):
+        from neurons.daemon import ServiceDaemon
+        from neurons.daemon.config.cache import ConfigCache
+
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+
+        self.file_name = os.path.join(path, 'test.yaml')
+        self._write(CONFIG, 1000000000)
+
+        self.cache = ConfigCache(self.file_name, ServiceDaemon)
+        self.cache.store({'ServiceDaemon': {'name': 'test'}})
+
+    def _write(self, data, mtime):
+        with open(self.file_name, 'wb') as f:
+            f.write(data)
+        os.utime(self.file_name, (mtime, mtime))
+
+    def test_hit(self):
+        assert self.cache.load() == {'ServiceDaemon': {'name': 'test'}}
+
+    def test_mtime_change(self):
+        self._write(CONFIG, 1000000001)
+        assert self.cache.load() is None
+
+    def test_size_change(self):
+        self._write(CONFIG + b"    debug: true\n", 1000000000)
+        assert self.cache.load() is None
+
+    def test_class_change(self):
+        from neurons.daemon import Daemon
+        from neurons.daemon.config.cache import ConfigCache
+
+        assert ConfigCache(self.file_name, Daemon).load() is None
+
+    def test_corrupt(self):
+        with open(self.cache.cache_file_name, 'wb') as f:
+            f.write(b'not a pickle')
+        assert self.cache.load() is None
+
+    def test_truncated(self):
+        with open(self.cache.cache_file_name, 'rb') as f:
+            data = f.read()
+        with open(self.cache.cache_file_name, 'wb') as f:
+            f.write(data[:len(data) // 2])
+        assert self.cache.load() is None
+
+    def test_remove(self):
+        self.cache.remove()
+        assert not os.path.exists(self.cache.cache_file_name)
+        assert self.cache.load() is None
+
+        # removing twice is fine
+        self.cache.remove()
@@ -0,0 +1,275 @@
+
+import os
+import shutil
+import socket
+import tempfile
+
+from twisted.trial import unittest
+from twisted.internet.protocol import DatagramProtocol
+
+
+class DummyListener(object):
+    def __init__(self):
+        self.reading = True
+
+    def stopReading(self):
+        self.reading = False
+
+    def startReading(self):
+        self.reading = True
+
+
+class TestAdmissionControl(unittest.TestCase):
+    def _gen_server(self, **kwargs):
+        from neurons.daemon.config import Server
+
+        retval = Server(name='test', **kwargs)
+        retval.listener = DummyListener()
+        return retval
+
+    def test_max_connections(self):
+        server = self._gen_server(max_connections=2)
+
+        assert server.admit()
+        server.connection_made()
+        assert not server.paused
+
+        assert server.admit()
+        server.connection_made()
+        assert server.paused
+        assert not server.listener.reading
+        assert server.num_paused == 1
+
+        # accepted in the same batch, past the limit
+        assert not server.admit()
+        assert server.num_rejected == 1
+
+        server.connection_lost()
+        assert not server.paused
+        assert server.listener.reading
+        assert server.num_connections == 1
+
+    def test_max_pending(self):
+        server = self._gen_server(max_pending=10)
+
+        for _ in range(10):
+            server.request_started()
+        assert server.paused
+        assert not server.listener.reading
+
+        # stays paused until the number of pending requests falls to the low
+        # water mark
+        server.request_finished()
+        assert server.paused
+
+        server.request_finished()
+        assert not server.paused
+        assert server.listener.reading
+        assert server.num_paused == 1
+
+    def test_both_limits(self):
+        server = self._gen_server(max_connections=1, max_pending=1)
+
+        server.connection_made()
+        server.request_started()
+        assert server.paused
+
+        server.connection_lost()
+        assert server.paused
+
+        server.request_finished()
+        assert not server.paused
+        assert server.listener.reading
+
+    def test_warming_resume(self):
+        server = self._gen_server()
+
+        server.start_warming()
+        server.resume_accepting()
+        assert server.paused
+        assert not server.listener.reading
+
+        server.stop_warming()
+        assert not server.paused
+        assert server.listener.reading
+        assert server.num_paused == 1
+
+    def test_warming(self):
+        server = self._gen_server(max_connections=1)
+
+        server.start_warming()
+        assert server.paused
+        assert not server.listener.reading
+
+        server.connection_made()
+        server.connection_lost()
+        assert server.paused
+
+        server.stop_warming()
+        assert not server.paused
+        assert server.listener.reading
+
+
+class TestUnixSocket(unittest.TestCase):
+    def setUp(self):
+        from neurons.daemon.config import Server
+
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+
+        self.server = Server(name='test', type='unix',
+                                           path=os.path.join(path, 'test.sock'))
+
+    def _listen(self):
+        from twisted.internet import reactor
+        from twisted.internet.protocol import Factory
+
+        server = self.server
+        server.listener = server.adopt_socket(reactor, Factory())
+
+    def test_shared_socket(self):
+        # a socket bound by another process, eg. the pre-fork supervisor
+        skt = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        skt.bind(self.server.path)
+        skt.listen(5)
+        skt.setblocking(False)
+        self.addCleanup(skt.close)
+
+        self.server.socket = skt
+        self._listen()
+
+        d = self.server.unlisten()
+        d.addCallback(lambda _: self.assertTrue(
+                                              os.path.exists(self.server.path)))
+        return d
+
+    def test_own_socket(self):
+        self.server._bind_socket()
+        self._listen()
+
+        d = self.server.unlisten()
+        d.addCallback(lambda _: self.assertFalse(
+                                              os.path.exists(self.server.path)))
+        return d
+
+    def test_unknown_owner(self):
+        from spyne import ValidationError
+
+        self.server.owner = 'no-such-user-for-neurons'
+        e = self.assertRaises(ValidationError, self.server._bind_socket)
+
+        assert "'owner' option of test" in e.faultstring
+        assert self.server.socket is None
+        assert not os.path.exists(self.server.path)
+
+    def test_unknown_group(self):
+        from spyne import ValidationError
+
+        self.server.group = 'no-such-group-for-neurons'
+        e = self.assertRaises(ValidationError, self.server._bind_socket)
+
+        assert "'group' option of test" in e.faultstring
+        assert not os.path.exists(self.server.path)
+
+
+class DatagramCollector(DatagramProtocol):
+    def __init__(self):
+        self.batches = []
+
+    def datagramsReceived(self, datagrams):
+        self.batches.append(datagrams)
+
+
+class TestUdp(unittest.TestCase):
+    def _listen(self, **kwargs):
+        from twisted.internet import reactor
+        from neurons.daemon.config import UdpServer
+
+        server = UdpServer(name='test', host='127.0.0.1', port=0, **kwargs)
+        proxy = server.get_datagram_proxy()(server)
+
+        server.listener = server.listen_udp(reactor, proxy)
+        self.addCleanup(server.unlisten)
+
+        return server, proxy
+
+    def _send(self, server, num, size=16):
+        import select
+
+        skt = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(skt.close)
+
+        addr = server.listener.socket.getsockname()
+        for i in range(num):
+            skt.sendto(b'%d' % i + b'x' * (size - 3), addr)
+
+        # loopback delivery is synchronous, this is just to be safe
+        select.select([server.listener.socket], [], [], 1)
+
+    def test_batch(self):
+        server, proxy = self._listen()
+        proxy.real_factory = collector = DatagramCollector()
+
+        self._send(server, 10)
+        server.listener.doRead()
+
+        assert len(collector.batches) == 1
+        assert [d[:1] for d, _ in collector.batches[0][:2]] == [b'0', b'1']
+        assert len(collector.batches[0]) == 10
+        assert server.num_datagrams_total == 10
+
+    def test_max_batch(self):
+        server, proxy = self._listen(max_batch=4)
+        proxy.real_factory = collector = DatagramCollector()
+
+        self._send(server, 10)
+        for _ in range(3):
+            server.listener.doRead()
+
+        assert [len(b) for b in collector.batches] == [4, 4, 2]
+
+    def test_no_protocol(self):
+        server, proxy = self._listen()
+
+        self._send(server, 3)
+        server.listener.doRead()
+
+        assert server.num_datagrams_total == 3
+        assert server.num_datagrams_dropped == 3
+
+    def test_rcvbuf(self):
+        server, proxy = self._listen(rcvbuf=32768)
+
+        # linux doubles the value
+        actual = server.listener.socket.getsockopt(socket.SOL_SOCKET,
+                                                              socket.SO_RCVBUF)
+        assert actual >= 32768
+
+    def test_kernel_drops(self):
+        import logging
+        from neurons.daemon.config.endpoint import get_udp_drops
+
+        # the smallest receive buffer linux allows
+        server, proxy = self._listen(rcvbuf=1)
+        if server.num_kernel_drops is None:
+            raise unittest.SkipTest("The kernel's drop counter is not "
+                                                                   "available")
+
+        assert server.drop_monitor.running
+        assert server.num_kernel_drops == 0
+
+        self._send(server, 64, size=1024)
+        drops = get_udp_drops(server.listener.socket)
+        assert drops > 0
+
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger('neurons.daemon.config.endpoint')
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+
+        server._check_drops(server.listener)
+        assert server.num_kernel_drops == drops
+        assert len(records) == 1
+        assert '%d datagrams dropped' % drops in records[0].getMessage()
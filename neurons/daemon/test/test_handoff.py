@@ -0,0 +1,161 @@
+
+import os
+import sys
+import socket
+import threading
+
+from array import array
+from twisted.trial import unittest
+
+
+FAKE_PID = 4000000 + os.getpid()
+
+
+def _count_fds():
+    return len(os.listdir('/proc/self/fd'))
+
+
+class TestTakeOver(unittest.TestCase):
+    if not sys.platform.startswith('linux'):
+        skip = "Socket handoff needs abstract namespace unix sockets"
+
+    def setUp(self):
+        from neurons.daemon.ipc import gen_handoff_address_for_pid
+
+        self.old = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.old.bind(gen_handoff_address_for_pid(FAKE_PID))
+        self.old.listen(1)
+        self.addCleanup(self.old.close)
+
+        self.listening = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listening.bind(('127.0.0.1', 0))
+        self.listening.listen(1)
+        self.addCleanup(self.listening.close)
+
+        self.port = self.listening.getsockname()[1]
+
+    def _serve(self, response, num_fds):
+        def _run():
+            conn, _ = self.old.accept()
+            try:
+                conn.recv(64)
+                fds = [self.listening.fileno()] * num_fds
+                conn.sendmsg([response], [(socket.SOL_SOCKET,
+                               socket.SCM_RIGHTS, array('i', fds).tobytes())])
+            finally:
+                conn.close()
+
+        thread = threading.Thread(target=_run)
+        thread.start()
+        self.addCleanup(thread.join)
+
+        return thread
+
+    def _gen_servers(self):
+        from neurons.daemon.config import Server
+        from neurons.daemon.handoff import _server_key
+
+        server = Server(name='test', host='127.0.0.1', port=self.port)
+        return {_server_key('tcp4', '127.0.0.1', self.port): server}
+
+    def test_take_over(self):
+        from neurons.daemon.handoff import _take_over_from
+
+        entry = b'[{"type": "tcp4", "host": "127.0.0.1", "port": %d}]\n' % \
+                                                                      self.port
+        self._serve(entry, 1)
+
+        servers = self._gen_servers()
+        server, = servers.values()
+
+        conn = _take_over_from(FAKE_PID, servers)
+        conn.close()
+
+        assert len(servers) == 0
+        assert server.socket.getsockname() == self.listening.getsockname()
+        server.socket.close()
+
+    def _assert_cleaned_up(self, response, num_fds, exc_class):
+        from neurons.daemon.handoff import _take_over_from
+
+        thread = self._serve(response, num_fds)
+        servers = self._gen_servers()
+
+        num_fds = _count_fds()
+        self.assertRaises(exc_class, _take_over_from, FAKE_PID, servers)
+        thread.join()
+
+        assert _count_fds() == num_fds
+        assert len(servers) == 1
+
+    def test_bad_json(self):
+        self._assert_cleaned_up(b'not json\n', 2, ValueError)
+
+    def test_fd_count_mismatch(self):
+        self._assert_cleaned_up(b'[]\n', 2, ValueError)
+
+    def test_eof(self):
+        self._assert_cleaned_up(b'[', 2, EOFError)
+
+
+class DummyListener(object):
+    def stopListening(self):
+        pass
+
+
+class DummyConfig(object):
+    handoff_drain_timeout = 10
+
+    def __init__(self, services):
+        self._services = services
+
+
+class TestDrain(unittest.SynchronousTestCase):
+    def setUp(self):
+        from twisted.internet import reactor, task
+        from neurons.daemon import handoff
+        from neurons.daemon.config import Server
+
+        clock = self.clock = task.Clock()
+        BaseLoopingCall = task.LoopingCall
+
+        class LoopingCall(BaseLoopingCall):
+            def __init__(self, *args, **kwargs):
+                BaseLoopingCall.__init__(self, *args, **kwargs)
+                self.clock = clock
+
+        self.patch(task, 'LoopingCall', LoopingCall)
+        self.patch(handoff, 'time', clock.seconds)
+
+        self.stopped = []
+        self.patch(reactor, 'stop', lambda: self.stopped.append(True))
+
+        self.server = Server(name='test', port=1)
+        self.server.listener = DummyListener()
+        self.server.num_connections = 1
+
+        self.config = DummyConfig([self.server])
+
+    def test_drain(self):
+        from neurons.daemon.handoff import drain_and_stop, DRAIN_CHECK_PERIOD
+
+        drain_and_stop(self.config)
+        assert self.server.listener is None
+
+        self.clock.advance(DRAIN_CHECK_PERIOD)
+        assert self.stopped == []
+
+        self.server.num_connections = 0
+        self.clock.advance(DRAIN_CHECK_PERIOD)
+        assert self.stopped == [True]
+
+    def test_drain_timeout(self):
+        from neurons.daemon.handoff import drain_and_stop, DRAIN_CHECK_PERIOD
+
+        drain_and_stop(self.config)
+
+        self.clock.advance(self.config.handoff_drain_timeout - 1)
+        assert self.stopped == []
+
+        self.clock.advance(1 + DRAIN_CHECK_PERIOD)
+        assert self.stopped == [True]
@@ -0,0 +1,105 @@
+
+from twisted.trial import unittest
+
+
+try:
+    from spyne.server.twisted import TwistedWebResource
+
+except ImportError as e:
+    # needs twisted.python.constants, which recent Twisted versions don't have.
+    TwistedWebResource = None
+    IMPORT_ERROR = str(e)
+
+
+TOKEN = u'management token'
+
+
+class DummyListener(object):
+    stopped = False
+
+    def stopListening(self):
+        self.stopped = True
+
+
+class DummyConfig(object):
+    def __init__(self, services, management_token=None):
+        self._services = services
+        self.management_token = management_token
+
+
+class TestDaemonControlServices(unittest.TestCase):
+    def setUp(self):
+        if TwistedWebResource is None:
+            raise unittest.SkipTest("spyne.server.twisted can't be "
+                                              "imported: %s" % (IMPORT_ERROR,))
+
+        from neurons.daemon.config import Server
+
+        self.server = Server(name='test', host='127.0.0.1', port=1)
+        self.listener = self.server.listener = DummyListener()
+
+    def _listen(self, management_token=TOKEN):
+        from twisted.internet import reactor
+        from twisted.web.server import Site
+        from neurons.daemon.ipc import gen_management_resource
+
+        config = DummyConfig([self.server], management_token)
+        port = reactor.listenTCP(0, Site(gen_management_resource(config)),
+                                                          interface='127.0.0.1')
+        self.addCleanup(port.stopListening)
+
+        return port.getHost().port
+
+    def _request(self, port, method=b'POST', token=TOKEN):
+        from twisted.internet import reactor
+        from twisted.web.client import Agent, readBody
+        from twisted.web.http_headers import Headers
+
+        headers = Headers()
+        if token is not None:
+            headers.setRawHeaders(b'x-management-token',
+                                                       [token.encode('utf8')])
+
+        url = b'http://127.0.0.1:%d/control/unlisten?port=1' % port
+        d = Agent(reactor).request(method, url, headers)
+
+        def _read(response):
+            return readBody(response) \
+                           .addCallback(lambda body: (response.code, body))
+
+        return d.addCallback(_read)
+
+    def _assert_refused(self, result):
+        code, body = result
+        assert code >= 400, (code, body)
+        assert not self.listener.stopped
+
+    def test_unlisten(self):
+        def _check(result):
+            code, body = result
+            assert code == 200, (code, body)
+            assert self.listener.stopped
+            assert self.server.listener is None
+
+        return self._request(self._listen()).addCallback(_check)
+
+    def test_get(self):
+        return self._request(self._listen(), method=b'GET') \
+                                             .addCallback(self._assert_refused)
+
+    def test_no_token(self):
+        return self._request(self._listen(), token=None) \
+                                             .addCallback(self._assert_refused)
+
+    def test_wrong_token(self):
+        return self._request(self._listen(), token=u'wrong') \
+                                             .addCallback(self._assert_refused)
+
+    def test_disabled(self):
+        def _check(result):
+            code, body = result
+            assert code == 404, (code, body)
+            assert not self.listener.stopped
+
+        return self._request(self._listen(management_token=None)) \
+                                                       .addCallback(_check)
@@ -0,0 +1,177 @@
+
+from twisted.trial import unittest
+
+
+class DummyApplication(object):
+    def __init__(self):
+        from spyne import EventManager
+
+        self.event_manager = EventManager(self)
+
+
+class DummyDescriptor(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class DummyMethodContext(object):
+    def __init__(self, method_name, out_error=None):
+        self.descriptor = None
+        if method_name is not None:
+            self.descriptor = DummyDescriptor(method_name)
+
+        self.call_start = 10.0
+        self.call_end = 10.25
+        self.out_error = out_error
+
+
+class TestRender(unittest.TestCase):
+    def setUp(self):
+        from neurons.daemon.metrics import Registry
+
+        self.registry = Registry()
+
+    def _render(self):
+        return self.registry.render().decode('utf8').split('\n')
+
+    def test_counter(self):
+        family = self.registry.counter('test_total', "Test counter.",
+                                                               ('a', 'b'))
+        family.labels('x', 'y').inc()
+        family.labels('x', 'y').inc(2)
+        family.labels('p', 'q').inc()
+
+        assert self._render() == [
+            '# HELP test_total Test counter.',
+            '# TYPE test_total counter',
+            'test_total{a="p",b="q"} 1',
+            'test_total{a="x",b="y"} 3',
+            '',
+        ]
+
+    def test_gauge(self):
+        family = self.registry.gauge('test', "Test gauge.")
+        family.labels().set(3)
+
+        assert self._render() == [
+            '# HELP test Test gauge.',
+            '# TYPE test gauge',
+            'test 3.0',
+            '',
+        ]
+
+    def test_histogram(self):
+        family = self.registry.histogram('test_seconds', "Test histogram.",
+                                                  ('a',), buckets=(0.1, 1))
+        child = family.labels('x')
+        child.observe(0.05)
+        child.observe(0.1)
+        child.observe(0.5)
+        child.observe(2)
+
+        assert self._render() == [
+            '# HELP test_seconds Test histogram.',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{a="x",le="0.1"} 2',
+            'test_seconds_bucket{a="x",le="1.0"} 3',
+            'test_seconds_bucket{a="x",le="+Inf"} 4',
+            'test_seconds_sum{a="x"} 2.65',
+            'test_seconds_count{a="x"} 4',
+            '',
+        ]
+
+    def test_histogram_no_labels(self):
+        family = self.registry.histogram('test_seconds', "Test histogram.",
+                                                                  buckets=(1,))
+        family.labels().observe(0.5)
+
+        assert self._render()[2:] == [
+            'test_seconds_bucket{le="1.0"} 1',
+            'test_seconds_bucket{le="+Inf"} 1',
+            'test_seconds_sum 0.5',
+            'test_seconds_count 1',
+            '',
+        ]
+
+    def test_label_escaping(self):
+        family = self.registry.counter('test_total', "Test counter.", ('a',))
+        family.labels(u'back\\slash "quoted"\nnewline').inc()
+
+        assert self._render()[2] == \
+                      r'test_total{a="back\\slash \"quoted\"\nnewline"} 1'
+
+    def test_unicode(self):
+        family = self.registry.counter('test_total', "Test counter.", ('a',))
+        family.labels(u'\xe7').inc()
+
+        assert self.registry.render().split(b'\n')[2] == \
+                                             u'test_total{a="\xe7"} 1' \
+                                                                .encode('utf8')
+
+    def test_remove(self):
+        family = self.registry.gauge('test', "Test gauge.", ('a',))
+        family.labels('x').set(1)
+        family.labels('y').set(2)
+
+        family.remove('x')
+        family.remove('z')
+
+        assert self._render()[2:] == ['test{a="y"} 2.0', '']
+
+    def test_collectors(self):
+        family = self.registry.gauge('test', "Test gauge.")
+
+        def collect():
+            with self.registry.lock:
+                family.labels().set(5)
+
+        self.registry.collectors.append(collect)
+
+        assert self._render()[2] == 'test 5.0'
+
+
+class TestInstrumentApplication(unittest.TestCase):
+    def _get(self, family, *labels):
+        return family._children[labels]
+
+    def test_method_calls(self):
+        from neurons.daemon import metrics
+
+        app = DummyApplication()
+        metrics.instrument_application(app, b'test_method_calls')
+        # instrumenting again doesn't count calls twice
+        metrics.instrument_application(app, b'test_method_calls')
+
+        fire = app.event_manager.fire_event
+        fire('method_context_closed', DummyMethodContext('some_call'))
+        fire('method_context_closed', DummyMethodContext('some_call',
+                                                         out_error=Exception()))
+        fire('method_context_closed', DummyMethodContext(None))
+
+        labels = (u'test_method_calls', 'some_call')
+        assert self._get(metrics.method_calls, *labels).value == 2
+        assert self._get(metrics.method_errors, *labels).value == 1
+        assert self._get(metrics.method_duration, *labels).sum == 0.5
+
+        labels = (u'test_method_calls', metrics.UNKNOWN_METHOD)
+        assert self._get(metrics.method_calls, *labels).value == 1
+        assert labels not in metrics.method_errors._children
+
+
+class TestMetricsResource(unittest.TestCase):
+    def test_render(self):
+        from twisted.web.test.requesthelper import DummyRequest
+        from neurons.daemon.metrics import Registry, TMetricsResource, \
+                                                                   CONTENT_TYPE
+
+        registry = Registry()
+        registry.counter('test_total', "Test counter.").labels().inc()
+
+        request = DummyRequest([b''])
+        body = TMetricsResource()(registry).render_GET(request)
+
+        assert request.responseHeaders.getRawHeaders(b'content-type') == \
+                                                                  [CONTENT_TYPE]
+        assert body == b'# HELP test_total Test counter.\n' \
+                       b'# TYPE test_total counter\n' \
+                       b'test_total 1\n'
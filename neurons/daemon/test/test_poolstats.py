@@ -0,0 +1,139 @@
+
+import os
+import shutil
+import tempfile
+
+from twisted.trial import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import QueuePool
+
+from neurons.daemon import metrics
+from neurons.daemon.poolstats import PoolStats
+
+
+class TestPoolStats(unittest.TestCase):
+    def setUp(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.url = 'sqlite:///' + os.path.join(path, 'test.db')
+
+        # metric series are global, so every test needs its own store name
+        self.store_name = self.id()
+        self.stats = PoolStats(self.store_name)
+        self.addCleanup(self.stats.close)
+
+    def _gen_engine(self, **kwargs):
+        retval = create_engine(self.url, poolclass=QueuePool, **kwargs)
+        self.addCleanup(retval.dispose)
+
+        self.stats.instrument_engine(retval, 'sync')
+        return retval
+
+    def _histogram(self, family):
+        return family.labels(self.store_name, 'sync')
+
+    def test_checkout(self):
+        engine = self._gen_engine(pool_size=1, max_overflow=2)
+        c = self.stats.counters
+
+        conn1 = engine.connect()
+        conn2 = engine.connect()
+        assert c['sync'].checkouts == 2
+        assert c['sync'].overflow_max == 1
+        assert c['sync'].checkins == 0
+        assert self.stats.get_connection_counts('sync') == (2, 0, None)
+
+        wait = self._histogram(metrics.pool_checkout_wait)
+        assert sum(wait.counts) == 2
+        overflow = self._histogram(metrics.pool_overflow)
+        assert overflow.counts[0] == 1  # the first checkout, le=0
+        assert sum(overflow.counts) == 2
+
+        conn1.close()
+        assert c['sync'].checkins == 1
+        assert self.stats.get_connection_counts('sync') == (1, 1, None)
+
+        conn2.close()
+        assert c['sync'].checkins == 2
+        # the pool is full, so the overflow connection is discarded
+        assert self.stats.get_connection_counts('sync') == (0, 1, None)
+
+        hold = self._histogram(metrics.pool_hold)
+        assert sum(hold.counts) == 2
+        assert c['sync'].hold_max > 0
+        assert c['sync'].connects == 2
+
+    def test_collect(self):
+        engine = self._gen_engine(pool_size=2, max_overflow=0)
+
+        conn1 = engine.connect()
+        conn2 = engine.connect()
+        conn2.close()
+
+        self.stats.collect()
+
+        def get(family, *labels):
+            return family.labels(self.store_name, 'sync', *labels).value
+
+        assert get(metrics.pool_connections, 'in_use') == 1
+        assert get(metrics.pool_connections, 'idle') == 1
+        assert get(metrics.pool_size) == 2
+        assert get(metrics.pool_waiting) == 0
+
+        conn1.close()
+
+    def test_timeout(self):
+        engine = self._gen_engine(pool_size=1, max_overflow=0,
+                                                             pool_timeout=0.01)
+
+        conn = engine.connect()
+        self.assertRaises(TimeoutError, engine.connect)
+
+        c = self.stats.counters['sync']
+        assert c.timeouts == 1
+        # the failed checkout is counted as well, with its wait time
+        assert c.checkouts == 2
+        assert c.wait_max >= 0.01
+
+        conn.close()
+
+    def test_reconnect(self):
+        engine = self._gen_engine(pool_size=1, max_overflow=0)
+
+        conn = engine.connect()
+        conn.invalidate()
+        conn.close()
+
+        engine.connect().close()
+
+        c = self.stats.counters['sync']
+        assert c.connects == 2
+        assert c.disconnects == 1
+        assert c.reconnects == 1
+
+    def test_close_after_dispose(self):
+        engine = self._gen_engine(pool_size=1, max_overflow=0)
+
+        engine.connect().close()
+        engine.dispose()
+
+        # the new pool is instrumented as well
+        engine.connect().close()
+        c = self.stats.counters['sync']
+        assert c.checkouts == 2
+        assert c.checkins == 2
+
+        self.stats.collect()
+        family = metrics.pool_connections
+        key = (self.store_name, 'sync', 'idle')
+        assert key in family._children
+
+        self.stats.close()
+        assert self.stats.collect not in metrics.registry.collectors
+        assert key not in family._children
+        assert self.stats.connection_getters == {}
+
+        # closing twice is harmless
+        self.stats.close()
@@ -0,0 +1,89 @@
+
+import signal
+
+from time import time
+
+from twisted.trial import unittest
+
+
+def _exit_status(retcode):
+    return retcode << 8
+
+
+def _signal_status(signum):
+    return signum
+
+
+class TestWorkerSupervisor(unittest.TestCase):
+    def setUp(self):
+        from neurons.daemon import prefork
+
+        class DummySupervisor(prefork.WorkerSupervisor):
+            def _fork_worker(self, worker_id):
+                self.forked.append(worker_id)
+                self.workers[self.next_pid] = (worker_id, time())
+                self.next_pid += 1
+                return False
+
+        self.sleeps = []
+        self.patch(prefork, 'sleep', self.sleeps.append)
+
+        self.prefork = prefork
+        self.supervisor = DummySupervisor(2, 'test')
+        self.supervisor.forked = []
+        self.supervisor.next_pid = 200
+
+    def _add_worker(self, pid, worker_id, uptime):
+        self.supervisor.workers[pid] = (worker_id, time() - uptime)
+
+    def test_clean_exit(self):
+        sup = self.supervisor
+        self._add_worker(100, 0, 60)
+
+        # e.g. stopped by a timed limit
+        assert not sup._handle_exit(100, _exit_status(0))
+        assert sup.forked == [0]
+        assert sorted(sup.workers) == [200]
+        assert sup.retcode == 0
+        assert self.sleeps == []
+
+    def test_respawn(self):
+        sup = self.supervisor
+        self._add_worker(100, 0, 60)
+        self._add_worker(101, 1, 60)
+
+        assert not sup._handle_exit(101, _exit_status(3))
+        assert sup.forked == [1]
+        assert sorted(sup.workers) == [100, 200]
+        assert sup.workers[200][0] == 1
+        assert sup.retcode == 3
+        assert self.sleeps == []
+
+    def test_respawn_after_signal(self):
+        sup = self.supervisor
+        self._add_worker(100, 0, 60)
+
+        assert not sup._handle_exit(100, _signal_status(signal.SIGKILL))
+        assert sup.forked == [0]
+        assert sup.retcode == 128 + signal.SIGKILL
+
+    def test_backoff(self):
+        sup = self.supervisor
+        self._add_worker(100, 0, 0)
+
+        assert not sup._handle_exit(100, _exit_status(1))
+        assert sup.forked == [0]
+        assert self.sleeps == [self.prefork.WORKER_RESPAWN_DELAY]
+
+    def test_stopping(self):
+        sup = self.supervisor
+        sup.stopping = True
+        self._add_worker(100, 0, 60)
+        self._add_worker(101, 1, 0)
+
+        assert not sup._handle_exit(100, _signal_status(signal.SIGTERM))
+        assert not sup._handle_exit(101, _exit_status(1))
+        assert sup.forked == []
+        assert sup.workers == {}
+        assert sup.retcode == 0
+        assert self.sleeps == []
@@ -0,0 +1,158 @@
+
+import os
+import shutil
+import logging
+import tempfile
+
+from time import time
+
+from twisted.trial import unittest
+
+
+class DummyApplication(object):
+    def __init__(self):
+        from spyne import EventManager
+
+        self.event_manager = EventManager(self)
+
+
+class DummyDescriptor(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class DummyMethodContext(object):
+    def __init__(self, call_start, call_end, udc=None):
+        self.call_start = call_start
+        self.call_end = call_end
+        self.udc = udc
+        self.descriptor = DummyDescriptor('some_call')
+        self.transport = None
+        self.out_error = None
+        self.out_string = [b'abc', b'de']
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestSqlHooks(unittest.TestCase):
+    def setUp(self):
+        from neurons.daemon.store import SqlDataStore
+        from neurons.daemon.slowlog import install_sql_hooks
+
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+
+        self.store = SqlDataStore('test',
+                                   'sqlite:///' + os.path.join(path, 'test.db'))
+        install_sql_hooks(self.store)
+
+    def test_count(self):
+        from neurons.context import ReadContext
+
+        udc = ReadContext(None)
+        session = udc.get_session(self.store)
+        session.execute("SELECT 1")
+        session.execute("SELECT 2")
+
+        assert udc.sql_count == 2
+        assert udc.sql_time > 0
+
+        udc.close()
+        assert udc.sql_count == 2
+
+    def test_checkin_clears(self):
+        from neurons.context import ReadContext
+
+        udc = ReadContext(None)
+        udc.get_session(self.store).execute("SELECT 1")
+        udc.close()
+        assert udc.sql_count == 1
+
+        # the connection goes back to the pool, queries of sessions that
+        # don't belong to a context must not count towards the old one
+        session = self.store.Session()
+        session.execute("SELECT 1")
+        session.close()
+
+        with self.store.engine.connect() as conn:
+            conn.execute("SELECT 1")
+
+        assert udc.sql_count == 1
+
+    def test_install_twice(self):
+        from neurons.context import ReadContext
+        from neurons.daemon.slowlog import install_sql_hooks
+
+        install_sql_hooks(self.store)
+
+        udc = ReadContext(None)
+        udc.get_session(self.store).execute("SELECT 1")
+        udc.close()
+
+        assert udc.sql_count == 1
+
+
+class TestInstrumentApplication(unittest.TestCase):
+    def setUp(self):
+        from neurons.daemon import slowlog
+
+        self.handler = ListHandler()
+        slowlog.logger.addHandler(self.handler)
+        self.addCleanup(slowlog.logger.removeHandler, self.handler)
+
+        self.app = DummyApplication()
+        slowlog.instrument_application(self.app, 0.5)
+
+    def _close(self, ctx):
+        self.app.event_manager.fire_event('method_context_closed', ctx)
+
+    def test_slow(self):
+        from neurons.context import ReadContext
+
+        udc = ReadContext(None)
+        udc.sql_time = 0.25
+        udc.sql_count = 3
+
+        # serialization times come from time(), so the call needs to be
+        # in the recent past
+        start_t = time()
+        ctx = DummyMethodContext(start_t - 1.0, None, udc)
+        self.app.event_manager.fire_event('method_return_object', ctx)
+        ctx.call_end = time()
+        self._close(ctx)
+
+        assert len(self.handler.records) == 1
+        record = self.handler.records[0]
+        assert record.levelno == logging.WARNING
+
+        entry = record.slow_request
+        assert entry['method'] == 'some_call'
+        assert entry['total'] >= 1.0
+        assert entry['sql'] == 0.25
+        assert entry['queries'] == 3
+        assert entry['bytes'] == 5
+        assert entry['error'] is False
+        # there was no method_return_string event, so serialization is
+        # assumed to last until the end of the call
+        assert 0 <= entry['serialize'] <= ctx.call_end - start_t
+
+    def test_fast(self):
+        self._close(DummyMethodContext(10.0, 10.25))
+
+        assert self.handler.records == []
+
+    def test_threshold_update(self):
+        from neurons.daemon import slowlog
+
+        slowlog.instrument_application(self.app, 0.1)
+        self._close(DummyMethodContext(10.0, 10.25))
+
+        assert len(self.handler.records) == 1
+        assert self.handler.records[0].slow_request['queries'] == 0
@@ -0,0 +1,229 @@
+
+import os
+import zlib
+import shutil
+import tempfile
+
+from twisted.trial import unittest
+
+
+try:
+    from neurons.daemon.config import static_file
+
+except ImportError as e:
+    # spyne's twisted transport needs twisted.python.constants, which recent
+    # Twisted versions don't have.
+    static_file = None
+    IMPORT_ERROR = str(e)
+
+
+def _import_static_file():
+    if static_file is None:
+        raise unittest.SkipTest("static_file can't be imported: %s" %
+                                                                (IMPORT_ERROR,))
+
+    return static_file
+
+
+class TestFileCache(unittest.TestCase):
+    def setUp(self):
+        self.FileCache = _import_static_file().FileCache
+
+    def test_lru_eviction(self):
+        cache = self.FileCache(max_size=10, max_file_size=8)
+
+        cache.put('a', 1, b'aaaa')
+        cache.put('b', 1, b'bbbb')
+        assert cache.get('a', 1) == b'aaaa'
+
+        # b is the least recently used entry now
+        cache.put('c', 1, b'cccc')
+        assert len(cache) == 2
+        assert cache.size == 8
+        assert cache.get('b', 1) is None
+        assert cache.get('a', 1) == b'aaaa'
+        assert cache.get('c', 1) == b'cccc'
+
+    def test_eviction_by_size(self):
+        cache = self.FileCache(max_size=10, max_file_size=9)
+
+        cache.put('a', 1, b'a')
+        cache.put('b', 1, b'b')
+        cache.put('c', 1, b'ccccccccc')
+
+        assert len(cache) == 2
+        assert cache.size == 10
+        assert cache.get('a', 1) is None
+
+    def test_max_file_size(self):
+        cache = self.FileCache(max_size=10, max_file_size=4)
+
+        cache.put('a', 1, b'aaaaa')
+        assert len(cache) == 0
+        assert cache.size == 0
+
+    def test_invalidation(self):
+        cache = self.FileCache(max_size=10, max_file_size=8)
+
+        cache.put('a', 1, b'aaaa')
+        assert cache.get('a', 2) is None
+        assert len(cache) == 0
+        assert cache.size == 0
+        assert (cache.hits, cache.misses) == (0, 1)
+
+        cache.put('a', 2, b'aa')
+        assert cache.get('a', 2) == b'aa'
+        assert cache.size == 2
+        assert (cache.hits, cache.misses) == (1, 1)
+
+
+class TestFastStaticFile(unittest.TestCase):
+    DATA = b'body { color: black; }\n' * 8
+
+    def setUp(self):
+        static_file = _import_static_file()
+
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self._write('style.css', self.DATA)
+
+        self.cache = static_file.FileCache(1024, 512)
+        self.FastStaticFile = static_file.TFastStaticFile((), 'static',
+                                                                     self.cache)
+
+    def _write(self, name, data):
+        with open(os.path.join(self.path, name), 'wb') as f:
+            f.write(data)
+
+    def _render(self, name='style.css', **headers):
+        from twisted.web.test.requesthelper import DummyRequest
+
+        request = DummyRequest([name.encode('ascii')])
+        for k, v in headers.items():
+            request.requestHeaders.setRawHeaders(k.replace('_', '-'), [v])
+
+        resource = self.FastStaticFile(os.path.join(self.path, name))
+        return request, resource.render(request)
+
+    def test_get(self):
+        request, data = self._render()
+
+        assert data == self.DATA
+        assert request.responseCode is None
+        assert request.responseHeaders.getRawHeaders(b'content-type') == \
+                                                                   [b'text/css']
+        assert request.responseHeaders.getRawHeaders(b'vary') == \
+                                                           [b'accept-encoding']
+
+    def test_cache(self):
+        self._render()
+        assert (self.cache.hits, self.cache.misses, len(self.cache)) == \
+                                                                      (0, 1, 1)
+
+        _, data = self._render()
+        assert data == self.DATA
+        assert (self.cache.hits, self.cache.misses) == (1, 1)
+
+    def test_mtime_change(self):
+        self._render()
+
+        data = b'body { color: white; }\n'
+        self._write('style.css', data)
+        path = os.path.join(self.path, 'style.css')
+        st = os.stat(path)
+        os.utime(path, (st.st_atime, st.st_mtime + 10))
+
+        _, retval = self._render()
+        assert retval == data
+        assert (self.cache.hits, self.cache.misses) == (0, 2)
+        assert self.cache.size == len(data)
+
+    def test_etag(self):
+        request, _ = self._render()
+        etag, = request.responseHeaders.getRawHeaders(b'etag')
+
+        request, data = self._render(if_none_match=etag)
+        assert request.responseCode == 304
+        assert data == b''
+
+        request, data = self._render(if_none_match=b'W/' + etag)
+        assert request.responseCode == 304
+
+        request, data = self._render(if_none_match=b'"nope"')
+        assert request.responseCode is None
+        assert data == self.DATA
+
+    def test_precompressed(self):
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        gz_data = compressor.compress(self.DATA) + compressor.flush()
+        self._write('style.css.gz', gz_data)
+
+        request, data = self._render(accept_encoding=b'br, gzip')
+        headers = request.responseHeaders
+
+        assert data == gz_data
+        assert headers.getRawHeaders(b'content-encoding') == [b'gzip']
+        assert headers.getRawHeaders(b'content-type') == [b'text/css']
+        assert headers.getRawHeaders(b'vary') == [b'accept-encoding']
+        gz_etag, = headers.getRawHeaders(b'etag')
+
+        request, data = self._render(accept_encoding=b'deflate')
+        headers = request.responseHeaders
+
+        assert data == self.DATA
+        assert not headers.hasHeader(b'content-encoding')
+        assert headers.getRawHeaders(b'etag') != [gz_etag]
+
+    def _get_content_length(self, request):
+        value, = request.responseHeaders.getRawHeaders(b'content-length')
+        return int(value)
+
+    def test_content_length(self):
+        request, data = self._render()
+        assert self._get_content_length(request) == len(self.DATA)
+
+        # from the cache
+        request, data = self._render()
+        assert self.cache.hits == 1
+        assert self._get_content_length(request) == len(self.DATA)
+
+    def test_head(self):
+        from twisted.web.test.requesthelper import DummyRequest
+
+        request = DummyRequest([b'style.css'])
+        request.method = b'HEAD'
+
+        resource = self.FastStaticFile(os.path.join(self.path, 'style.css'))
+        assert resource.render(request) == b''
+        assert self._get_content_length(request) == len(self.DATA)
+
+    def test_mmap(self):
+        data = b'x' * (self.cache.max_file_size * 3)
+        self._write('big.css', data)
+
+        request, retval = self._render('big.css')
+        assert retval == static_file.server.NOT_DONE_YET
+        assert b''.join(request.written) == data
+        assert request.finished == 1
+        assert self._get_content_length(request) == len(data)
+        assert len(self.cache) == 0
+
+    def test_replaced_while_serving(self):
+        # the file is replaced right before it's opened, eg. by a deployment
+        path = os.path.join(self.path, 'style.css')
+        new_data = b'body { color: white; }\n'
+
+        def _open(fn, *args):
+            if fn == path:
+                with open(path + '.new', 'wb') as f:
+                    f.write(new_data)
+                os.rename(path + '.new', path)
+
+            return open(fn, *args)
+
+        static_file.open = _open
+        self.addCleanup(delattr, static_file, 'open')
+
+        request, data = self._render()
+        assert data == new_data
+        assert self._get_content_length(request) == len(new_data)
@@ -0,0 +1,435 @@
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+
+from os.path import abspath, dirname
+
+from twisted.trial import unittest
+
+
+def _gen_engine():
+    from sqlalchemy import create_engine
+    from sqlalchemy.pool import StaticPool
+
+    # this is what SqlDataStore does for sqlite
+    return create_engine('sqlite://', poolclass=StaticPool,
+                                   connect_args={'check_same_thread': False})
+
+
+class TestThreadedTxPool(unittest.TestCase):
+    def setUp(self):
+        from neurons.daemon.store import ThreadedTxPool
+
+        self.pool = ThreadedTxPool('test', _gen_engine(), 4)
+        if not self.pool.threadpool.started:
+            self.pool.threadpool.start()
+
+        return self.pool.runOperation("CREATE TABLE t (x INTEGER)")
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_static_pool_size(self):
+        assert self.pool.size == 1
+        assert self.pool.threadpool.max == 1
+
+    def test_commit(self):
+        def _interaction(cursor):
+            cursor.execute("INSERT INTO t VALUES (1)")
+            cursor.execute("INSERT INTO t VALUES (2)")
+
+        d = self.pool.runInteraction(_interaction)
+        d.addCallback(lambda _: self.pool.runQuery("SELECT x FROM t"))
+        d.addCallback(lambda rows: self.assertEqual(sorted(rows),
+                                                              [(1,), (2,)]))
+        return d
+
+    def test_rollback(self):
+        def _interaction(cursor):
+            cursor.execute("INSERT INTO t VALUES (2)")
+            raise ValueError("oops")
+
+        d = self.pool.runOperation("INSERT INTO t VALUES (1)")
+        d.addCallback(lambda _: self.pool.runInteraction(_interaction))
+        d = self.assertFailure(d, ValueError)
+        d.addCallback(lambda _: self.pool.runQuery("SELECT x FROM t"))
+        d.addCallback(lambda rows: self.assertEqual(rows, [(1,)]))
+        return d
+
+    def test_counts(self):
+        d = self.pool.runQuery("SELECT 1")
+        d.addCallback(lambda _: self.assertEqual(
+                                  self.pool.get_connection_counts(), (0, 1, 0)))
+        return d
+
+
+class TestReplicas(unittest.TestCase):
+    def setUp(self):
+        from sqlalchemy.pool import QueuePool
+        from neurons.daemon.store import SqlDataStore
+
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+
+        self.store = SqlDataStore('test', 'sqlite://')
+        for i in range(2):
+            self.store.add_replica('sqlite:///%s/replica%d.db' % (path, i),
+                                                           poolclass=QueuePool)
+
+    def tearDown(self):
+        self.store.dispose_replicas()
+        self.store.engine.dispose()
+
+    def _gen_context(self, cls, username=None):
+        retval = cls(None)
+        retval.username = username
+        return retval
+
+    def test_read_only_session(self):
+        from neurons.context import ReadContext, WriteContext
+
+        store = self.store
+        replicas = store.replicas
+
+        ctx = self._gen_context(ReadContext)
+        assert ctx.get_session(store).bind is replicas[0]
+        ctx.close()
+
+        ctx = self._gen_context(ReadContext)
+        assert ctx.get_session(store).bind is replicas[1]
+        ctx.close()
+
+        ctx = self._gen_context(WriteContext)
+        assert ctx.get_session(store).get_bind() is store.engine
+        ctx.close()
+
+    def test_least_checked_out(self):
+        store = self.store
+        store.replica_policy = 'least_checked_out'
+
+        connection = store.replicas[0].connect()
+        try:
+            assert store.get_read_engine() is store.replicas[1]
+        finally:
+            connection.close()
+
+    def test_read_your_writes(self):
+        from neurons.context import ReadContext, WriteContext
+
+        store = self.store
+        store.read_your_writes = 60
+
+        ctx = self._gen_context(WriteContext, 'alice')
+        ctx.get_session(store)
+        ctx.close()
+
+        ctx = self._gen_context(ReadContext, 'alice')
+        assert ctx.get_session(store).get_bind() is store.engine
+        ctx.close()
+
+        ctx = self._gen_context(ReadContext, 'bob')
+        assert ctx.get_session(store).bind in store.replicas
+        ctx.close()
+
+        store._last_writes['alice'] -= 60
+        assert store.get_read_engine('alice') in store.replicas
+
+
+class TestPrewarm(unittest.TestCase):
+    def setUp(self):
+        from sqlalchemy import create_engine
+        from sqlalchemy.pool import QueuePool
+        from neurons.daemon.store import SqlDataStore
+
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+
+        # SqlDataStore would use a StaticPool for a sqlite connection string
+        self.url = 'sqlite:///%s/test.db' % (path,)
+        self.store = SqlDataStore('test')
+        self.store.engine = create_engine(self.url, poolclass=QueuePool,
+                                                                   pool_size=3)
+        self.addCleanup(self.store.engine.dispose)
+
+    def test_prewarm(self):
+        pool = self.store.engine.pool
+        assert pool.checkedin() == 0
+
+        d = self.store.prewarm(10)
+
+        assert pool.checkedin() == 3
+        assert pool.checkedout() == 0
+        return d
+
+    def test_prewarm_replicas(self):
+        from sqlalchemy.pool import QueuePool
+
+        store = self.store
+        replica = store.add_replica(self.url, poolclass=QueuePool,
+                                                                   pool_size=2)
+        self.addCleanup(replica.dispose)
+
+        d = store.prewarm(10)
+
+        assert store.engine.pool.checkedin() == 3
+        assert replica.pool.checkedin() == 2
+        return d
+
+    def test_prewarm_size(self):
+        from sqlalchemy.pool import NullPool, QueuePool, StaticPool
+        from neurons.daemon.store import _get_prewarm_size
+
+        creator = lambda: None
+
+        assert _get_prewarm_size(QueuePool(creator, pool_size=5), 3) == 3
+        assert _get_prewarm_size(QueuePool(creator, pool_size=5), 10) == 5
+        assert _get_prewarm_size(StaticPool(creator), 10) == 1
+        assert _get_prewarm_size(NullPool(creator), 10) == 0
+
+
+class FakeConnection(object):
+    """Stands in for a txpostgres Connection. Queries don't finish until
+    :meth:`finish` is called."""
+
+    def __init__(self):
+        self.queries = []
+        self.closed = False
+        self.connect_deferred = None
+
+    def connect(self, *args, **kwargs):
+        from twisted.internet.defer import Deferred
+
+        self.connect_deferred = Deferred()
+        return self.connect_deferred
+
+    def runQuery(self, *args, **kwargs):
+        from twisted.internet.defer import Deferred
+
+        retval = Deferred()
+        self.queries.append(retval)
+        return retval
+
+    def finish(self):
+        self.queries.pop(0).callback([(1,)])
+
+    def close(self):
+        self.closed = True
+
+
+class TestElasticTxPool(unittest.TestCase):
+    def setUp(self):
+        try:
+            import txpostgres.txpostgres
+
+        except ImportError as e:
+            # txpostgres needs psycopg2
+            raise unittest.SkipTest("txpostgres can't be imported: %s" % (e,))
+
+        from neurons.daemon import store
+        from neurons.daemon.store import TNeuronsConnectionPool
+        from neurons.daemon.poolstats import PoolStats
+
+        self.now = 1000.0
+        self.patch(store, 'time', lambda: self.now)
+
+        self.stats = PoolStats('test')
+        self.addCleanup(self.stats.close)
+
+        # min=2, max=4, grow_threshold=2, idle_timeout=60
+        BasePool = TNeuronsConnectionPool('test', self.stats, 2, 4, 2, 60)
+
+        self.connections = connections = []
+
+        class Pool(BasePool):
+            @staticmethod
+            def connectionFactory(reactor=None, cooperator=None):
+                retval = FakeConnection()
+                connections.append(retval)
+                return retval
+
+        self.pool = Pool(None, 'dsn', min=2)
+        self.addCleanup(self.pool.close)
+
+        d = self.pool.start()
+        for c in list(connections):
+            c.connect_deferred.callback(None)
+        return d
+
+    def _run_queries(self, n):
+        return [self.pool.runQuery("SELECT 1") for _ in range(n)]
+
+    def _connect_new(self):
+        for c in self.connections:
+            if not c.connect_deferred.called:
+                c.connect_deferred.callback(None)
+
+    def _finish_all(self):
+        while True:
+            busy = [c for c in self.connections if len(c.queries) > 0]
+            if len(busy) == 0:
+                break
+
+            for c in busy:
+                c.finish()
+
+    def test_counts(self):
+        pool = self.pool
+        assert pool.get_connection_counts() == (0, 2, 0)
+
+        self._run_queries(3)
+        assert pool.get_connection_counts() == (2, 0, 1)
+
+        self._finish_all()
+        assert pool.get_connection_counts() == (0, 2, 0)
+
+    def test_grow(self):
+        pool = self.pool
+
+        # one waiting query is below grow_threshold
+        self._run_queries(3)
+        assert len(self.connections) == 2
+
+        # two are not
+        self._run_queries(1)
+        assert len(self.connections) == 3
+        assert pool.num_growing == 1
+
+        self._connect_new()
+        assert pool.num_growing == 0
+        assert pool._semaphore.limit == 3
+
+        # the new connection took one of the waiting queries
+        assert pool.get_connection_counts() == (3, 0, 1)
+
+        self._finish_all()
+        assert pool.get_connection_counts() == (0, 3, 0)
+
+    def test_grow_max(self):
+        pool = self.pool
+
+        self._run_queries(20)
+        assert len(self.connections) == 4
+        assert pool.num_growing == 2
+
+        self._connect_new()
+        assert pool._semaphore.limit == 4
+
+        self._run_queries(20)
+        assert len(self.connections) == 4
+
+        self._finish_all()
+        assert pool.get_connection_counts() == (0, 4, 0)
+
+    def test_grow_failed(self):
+        from twisted.python.failure import Failure
+
+        pool = self.pool
+
+        self._run_queries(4)
+        assert pool.num_growing == 1
+
+        self.connections[-1].connect_deferred.errback(Failure(ValueError()))
+        assert pool.num_growing == 0
+        assert pool._semaphore.limit == 2
+
+        self._finish_all()
+        assert pool.get_connection_counts() == (0, 2, 0)
+
+    def _grow_to_max(self):
+        self._run_queries(20)
+        self._connect_new()
+        self._finish_all()
+
+        assert self.pool.get_connection_counts() == (0, 4, 0)
+
+    def test_shrink(self):
+        pool = self.pool
+        self._grow_to_max()
+
+        pool.shrink()
+        assert pool._semaphore.limit == 4
+
+        self.now += 61
+        pool.shrink()
+        assert pool._semaphore.limit == 2
+        assert pool.get_connection_counts() == (0, 2, 0)
+        assert len([c for c in self.connections if c.closed]) == 2
+
+        # the pool still works
+        self._run_queries(3)
+        assert pool.get_connection_counts() == (2, 0, 1)
+        self._finish_all()
+        assert pool.get_connection_counts() == (0, 2, 0)
+
+    def test_shrink_idle_only(self):
+        pool = self.pool
+        self._grow_to_max()
+
+        self.now += 61
+        self._run_queries(3)
+
+        # only one connection is idle
+        pool.shrink()
+        assert pool._semaphore.limit == 3
+        assert pool.get_connection_counts() == (3, 0, 0)
+
+        busy = [c for c in self.connections if len(c.queries) > 0]
+        assert len(busy) == 3
+        assert not any(c.closed for c in busy)
+
+        self._finish_all()
+        assert pool.get_connection_counts() == (0, 3, 0)
+
+        # these were just used
+        pool.shrink()
+        assert pool._semaphore.limit == 3
+
+    def test_shrink_recently_used(self):
+        pool = self.pool
+        self._grow_to_max()
+
+        self.now += 61
+        self._run_queries(4)
+        self._finish_all()
+
+        pool.shrink()
+        assert pool._semaphore.limit == 4
+
+
+CLOSE_THEN_SHUTDOWN = """
+from sqlalchemy import create_engine
+from twisted.internet import reactor
+from neurons.daemon.store import ThreadedTxPool
+
+pool = ThreadedTxPool('test', create_engine('sqlite://'), 2)
+
+def _stop(_):
+    pool.close()
+    reactor.stop()
+
+reactor.callWhenRunning(lambda: pool.runQuery("SELECT 1").addBoth(_stop))
+reactor.run()
+"""
+
+
+class TestThreadedTxPoolShutdown(unittest.TestCase):
+    def test_close_then_shutdown(self):
+        # Stopping the reactor after close() used to stop the thread pool a
+        # second time, which logs an AlreadyQuit error from a system event
+        # trigger. This needs its own reactor, hence the subprocess.
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([
+            dirname(dirname(dirname(dirname(abspath(__file__))))),
+            env.get('PYTHONPATH', ''),
+        ])
+
+        p = subprocess.Popen([sys.executable, '-c', CLOSE_THEN_SHUTDOWN],
+                   env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        out, _ = p.communicate()
+
+        assert p.returncode == 0, out
+        assert b'AlreadyQuit' not in out, out
+        assert b'Traceback' not in out, out
@@ -0,0 +1,122 @@
+
+import os
+import shutil
+import datetime
+import tempfile
+
+from twisted.trial import unittest
+
+
+def _gen_cert_pair(common_name):
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    now = datetime.datetime.utcnow()
+
+    cert = x509.CertificateBuilder() \
+        .subject_name(name) \
+        .issuer_name(name) \
+        .public_key(key.public_key()) \
+        .serial_number(x509.random_serial_number()) \
+        .not_valid_before(now - datetime.timedelta(days=1)) \
+        .not_valid_after(now + datetime.timedelta(days=1)) \
+        .sign(key, hashes.SHA256())
+
+    return cert.public_bytes(serialization.Encoding.PEM), \
+           key.private_bytes(serialization.Encoding.PEM,
+                                 serialization.PrivateFormat.TraditionalOpenSSL,
+                                 serialization.NoEncryption())
+
+
+def _get_common_name(connection):
+    return connection.get_certificate().get_subject().CN
+
+
+def _connect(factory):
+    """Returns the ``OpenSSL.SSL.Connection`` of a new server-side
+    connection."""
+
+    from twisted.internet.address import IPv4Address
+    from twisted.internet.testing import StringTransport
+
+    addr = IPv4Address('TCP', '127.0.0.1', 12345)
+    protocol = factory.buildProtocol(addr)
+    protocol.makeConnection(StringTransport())
+
+    return protocol._tlsConnection
+
+
+class TestReloadTls(unittest.TestCase):
+    def setUp(self):
+        from neurons.daemon.config import SslServer
+
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+        self.cert = os.path.join(self.path, 'cert.pem')
+        self.key = os.path.join(self.path, 'key.pem')
+        self._write(*_gen_cert_pair(u'one'))
+
+        self.server = SslServer(name='test', cert=self.cert, key=self.key,
+                                                           tls_check_interval=0)
+        self.addCleanup(self.server.stop_tls_monitor)
+
+    def _wrap_factory(self):
+        from twisted.internet.protocol import Factory, Protocol
+
+        return self.server.wrap_factory(Factory.forProtocol(Protocol))
+
+    def _write(self, cert, key):
+        # replace the files the way certificate renewal tools do
+        for fn, data in ((self.cert, cert), (self.key, key)):
+            with open(fn + '.new', 'wb') as f:
+                f.write(data)
+            os.rename(fn + '.new', fn)
+
+    def test_reload(self):
+        factory = self._wrap_factory()
+        creator = self.server.get_connection_creator()
+        old_conn = _connect(factory)
+        old_context = creator.getContext()
+        assert _get_common_name(old_conn) == 'one'
+        assert not self.server.tls_files_changed()
+
+        self._write(*_gen_cert_pair(u'two'))
+        assert self.server.tls_files_changed()
+        assert self.server.reload_tls()
+
+        assert self.server.get_connection_creator() is creator
+        assert creator.num_reloads == 1
+        assert creator.getContext() is not old_context
+        assert not self.server.tls_files_changed()
+
+        new_conn = _connect(factory)
+        assert _get_common_name(new_conn) == 'two'
+
+        # existing connections keep the old certificate
+        assert old_conn.get_context() is old_context
+        assert _get_common_name(old_conn) == 'one'
+
+    def test_reload_error(self):
+        factory = self._wrap_factory()
+        creator = self.server.get_connection_creator()
+        old_context = creator.getContext()
+
+        cert, _ = _gen_cert_pair(u'two')
+        self._write(cert, b'not a key')
+
+        assert not self.server.reload_tls()
+        assert creator.num_reloads == 0
+        assert creator.getContext() is old_context
+        assert _get_common_name(_connect(factory)) == 'one'
+
+        # it's tried again on the next check
+        assert self.server.tls_files_changed()
+
+    def test_reload_not_listening(self):
+        assert not self.server.reload_tls()
+        assert self.server.connection_creator is None
@@ -0,0 +1,137 @@
+# encoding: utf8
+#
+# This file is part of the Neurons project.
+# Copyright (c), Arskom Ltd. (arskom.com.tr),
+#                Burak Arslan <burak.arslan@arskom.com.tr>.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of the Arskom Ltd., the neurons project nor the names of
+#   its its contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""Thread pools that keep track of how long work items wait in the queue."""
+
+from __future__ import absolute_import
+
+import logging
+logger = logging.getLogger(__name__)
+
+from time import time
+from threading import Lock
+
+from spyne.util import memoize
+
+
+@memoize
+def TMeteredThreadPool():
+    from twisted.python.threadpool import ThreadPool
+
+    class MeteredThreadPool(ThreadPool):
+        """A ThreadPool that measures the time between a work item being
+        queued and it starting to run."""
+
+        def __init__(self, *args, **kwargs):
+            ThreadPool.__init__(self, *args, **kwargs)
+
+            self._stats_lock = Lock()
+
+            self.num_tasks = 0
+            """Number of work items that started running."""
+
+            self.wait_time_total = 0.0
+            """Sum of queue wait times of all work items, in seconds."""
+
+            self.wait_time_max = 0.0
+            """Longest queue wait time of any work item, in seconds."""
+
+        def callInThreadWithCallback(self, onResult, func, *args, **kw):
+            queued_t = time()
+
+            def _run_metered(*args, **kw):
+                wait_t = time() - queued_t
+
+                with self._stats_lock:
+                    self.num_tasks += 1
+                    self.wait_time_total += wait_t
+                    if wait_t > self.wait_time_max:
+                        self.wait_time_max = wait_t
+
+                return func(*args, **kw)
+
+            return ThreadPool.callInThreadWithCallback(self, onResult,
+                                                      _run_metered, *args, **kw)
+
+        @property
+        def wait_time_avg(self):
+            if self.num_tasks == 0:
+                return 0.0
+            return self.wait_time_total / self.num_tasks
+
+    return MeteredThreadPool
+
+
+def gen_threadpool(name, min=None, max=None):
+    """Returns a new :class:`MeteredThreadPool` that is started with the
+    reactor and stopped when the reactor shuts down. Use
+    :func:`stop_threadpool` to stop it earlier.
+
+    :param name: Name of the pool. Shows up in thread names.
+    :param min: Minimum number of threads. Twisted's default when None.
+    :param max: Maximum number of threads. Twisted's default when None.
+    """
+
+    from twisted.internet import reactor
+
+    kwargs = {}
+    if min is not None:
+        kwargs['minthreads'] = min
+    if max is not None:
+        kwargs['maxthreads'] = max
+
+    retval = TMeteredThreadPool()(name=name, **kwargs)
+
+    reactor.callWhenRunning(retval.start)
+    retval.shutdown_trigger = \
+                 reactor.addSystemEventTrigger('during', 'shutdown', retval.stop)
+
+    logger.debug("Thread pool '%s' created with min=%d max=%d",
+                                                 name, retval.min, retval.max)
+
+    return retval
+
+
+def stop_threadpool(threadpool):
+    """Stops a thread pool returned by :func:`gen_threadpool` before the
+    reactor shuts down. Stopping it twice would raise ``AlreadyQuit``, so
+    this also removes its shutdown trigger."""
+
+    from twisted.internet import reactor
+
+    if threadpool.shutdown_trigger is not None:
+        reactor.removeSystemEventTrigger(threadpool.shutdown_trigger)
+        threadpool.shutdown_trigger = None
+
+    if not threadpool.joined:
+        threadpool.stop()
@@ -42,6 +42,7 @@ from spyne.protocol.cloth import XmlCloth
 from slimit.mangler import mangle as slimit_mangler
 from slimit.visitors.minvisitor import ECMAMinifier
 
+from neurons.base.assets import get_asset_url
 from neurons.base.screen import Link
 from neurons.polymer.jsutil import get_js_parser, set_js_variable
 from neurons.polymer.const import POLYMER_PREAMBLE, DEFAULT_URL_POLYFILL
@@ -119,8 +120,8 @@ def gen_component(cls, component_name, DetailScreen, gen_css_imports, minify_js,
 
     styles = []
     if gen_css_imports:
-        styles.append('@import url("/static/screen/{}.css")'
-                                                        .format(component_name))
+        href = get_asset_url("/static/screen/{}.css".format(component_name))
+        styles.append('@import url("{}")'.format(href))
 
     getter_url = "{}{}.get".format(api_read_url_prefix, cls.get_type_name())
     putter_url = "{}{}.put".format(api_write_url_prefix, cls.get_type_name())
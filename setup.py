@@ -135,6 +135,9 @@ setup(
     license='LGPL-2.1',
     zip_safe=False,
     install_requires=install_reqs,
+    extras_require={
+        'http2': ['Twisted[http2]'],
+    },
 
     entry_points={
         'console_scripts': [],